@@ -0,0 +1,57 @@
+'''Build time and CPU traversal cost of the SAH BVH against the uniform voxel
+grid, on an even mesh and on meshes whose triangles are badly skewed'''
+from timing import best_time
+from meshes import ground, look_at, merge, perspective, sphere, triangle_soup
+from engine import bvh, cpu_voxelizer
+from engine.cpu_tracer import CpuTracer, generate_rays
+from engine.instance import Instance
+from engine.mesh_data import MeshData
+
+
+WIDTH = 160
+HEIGHT = 120
+# The CPU tracer expands every ray against every triangle of the cells it
+# visits, which on skewed grids needs batches to fit in memory
+BATCH = 512
+
+
+def meshes():
+    yield "even", MeshData(*sphere(64))
+    # A detailed object on a huge floor: nearly every grid cell is empty
+    yield "stadium", MeshData(*merge(ground(200.0), sphere(64)))
+    # A dense cluster with a few far away triangles stretching the bounds
+    yield "cluster", MeshData(*merge(triangle_soup(20000), sphere(4, (60.0, 60.0, 60.0), 0.5)))
+
+
+def trace(tracer, instances, ray_o, ray_d):
+    for start in range(0, len(ray_o), BATCH):
+        tracer.trace(instances, ray_o[start:start + BATCH], ray_d[start:start + BATCH])
+
+
+def main():
+    view = look_at((0.0, -4.0, 2.0), (0.5, 0.5, 0.0))
+    projection = perspective(0.8, WIDTH / HEIGHT)
+    ray_o, ray_d = generate_rays(WIDTH, HEIGHT, view, projection)
+
+    print("%d rays" % len(ray_o))
+    print("%8s %10s %9s %12s %12s %12s %12s" % (
+        "mesh", "triangles", "grid", "grid build", "bvh build", "grid kray/s", "bvh kray/s"))
+    for name, mesh in meshes():
+        instances = [Instance(name, mesh)]
+        grid_build = best_time(lambda: cpu_voxelizer.voxelize_mesh(mesh, csr=True), 3)
+        bvh_build = best_time(lambda: bvh.build_mesh_bvh(mesh), 3)
+
+        rates = []
+        for acceleration in ("grid", "bvh"):
+            tracer = CpuTracer(acceleration)
+            # Builds the structure once, outside the timing
+            trace(tracer, instances, ray_o[:1], ray_d[:1])
+            rates.append(len(ray_o) / best_time(lambda: trace(tracer, instances, ray_o, ray_d), 1) / 1e3)
+
+        resolution = "x".join(str(res) for res in mesh.voxel_resolution)
+        print("%8s %10d %9s %10.1fms %10.1fms %12.1f %12.1f" % (
+            name, mesh.count, resolution, grid_build * 1000, bvh_build * 1000, *rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+'''Decode time of the positions, normals and indices of one glTF primitive:
+the old per-vertex struct loop against read_accessor'''
+import base64
+import ctypes
+import struct
+
+import numpy
+
+from timing import best_time
+from gltf import BufferCache, read_accessor
+from engine.gpu_types import VEC3
+
+
+# The old loop only read unsigned short indices
+SIZES = (1000, 10000, 60000)
+
+
+def make_gltf(vert_count):
+    '''One primitive with interleaved positions and normals, as the exporter
+    writes them'''
+    rng = numpy.random.default_rng(0)
+    vertices = rng.random((vert_count, 2, 3), numpy.float32)
+    indices = rng.integers(0, vert_count, vert_count * 2, numpy.uint16)
+    data = vertices.tobytes() + indices.tobytes()
+    uri = "data:application/octet-stream;base64," + base64.b64encode(data).decode()
+    return {
+        "buffers": {"buffer": {"uri": uri}},
+        "bufferViews": {
+            "vertices": {"buffer": "buffer", "byteOffset": 0},
+            "indices": {"buffer": "buffer", "byteOffset": vertices.nbytes},
+        },
+        "accessors": {
+            "position": {"bufferView": "vertices", "byteOffset": 0, "byteStride": 24,
+                         "componentType": 5126, "type": "VEC3", "count": vert_count},
+            "normal": {"bufferView": "vertices", "byteOffset": 12, "byteStride": 24,
+                       "componentType": 5126, "type": "VEC3", "count": vert_count},
+            "indices": {"bufferView": "indices", "byteOffset": 0,
+                        "componentType": 5123, "type": "SCALAR", "count": len(indices)},
+        },
+    }
+
+
+def legacy_vec3(data, name, vert_count):
+    accessor = data["accessors"][name]
+    bufview = data["bufferViews"][accessor["bufferView"]]
+    buf = data["buffers"][bufview["buffer"]]
+    bufdata = base64.b64decode(buf["uri"].split(",")[1])
+    offset = bufview["byteOffset"]+accessor["byteOffset"]
+    stride = accessor["byteStride"]
+    values = (VEC3 * vert_count)()
+    for j in range(vert_count):
+        values[j].x = struct.unpack("f", bufdata[offset + j * stride + 0:offset + j * stride + 4])[0]
+        values[j].y = struct.unpack("f", bufdata[offset + j * stride + 4:offset + j * stride + 8])[0]
+        values[j].z = struct.unpack("f", bufdata[offset + j * stride + 8:offset + j * stride + 12])[0]
+    return values
+
+
+def legacy_decode(data):
+    '''The loop handle_gltf used before read_accessor'''
+    vert_count = data["accessors"]["position"]["count"]
+    element_count = data["accessors"]["indices"]["count"]
+    positions = legacy_vec3(data, "position", vert_count)
+    normals = legacy_vec3(data, "normal", vert_count)
+    accessor = data["accessors"]["indices"]
+    bufview = data["bufferViews"][accessor["bufferView"]]
+    bufdata = base64.b64decode(data["buffers"][bufview["buffer"]]["uri"].split(",")[1])
+    offset = bufview["byteOffset"]+accessor["byteOffset"]
+    indices = (ctypes.c_ushort * element_count).from_buffer_copy(bufdata, offset)
+    return positions, normals, indices
+
+
+def decode(data):
+    buffers = BufferCache(data)
+    return [read_accessor(data, name, buffers) for name in ("position", "normal", "indices")]
+
+
+def main():
+    print("%10s %12s %12s %9s" % ("vertices", "loop ms", "numpy ms", "speedup"))
+    for vert_count in SIZES:
+        data = make_gltf(vert_count)
+        legacy = best_time(lambda: legacy_decode(data), 3)
+        vectorized = best_time(lambda: decode(data))
+        print("%10d %12.2f %12.2f %8.0fx" % (vert_count, legacy * 1000, vectorized * 1000, legacy / vectorized))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+'''Frame time of the tiled CPU backend for 1, 2, 4, 8 and all workers
+against a single process CpuTracer'''
+import multiprocessing
+
+import numpy
+
+from timing import best_time
+from meshes import look_at, perspective, sphere
+from engine.cpu_backend import CpuRenderer
+from engine.cpu_tracer import CpuTracer
+from engine.instance import Instance
+from engine.mesh_data import MeshData
+
+
+WIDTH = 320
+HEIGHT = 240
+
+
+def scene():
+    mesh = MeshData(*sphere(32))
+    instances = []
+    for x in range(-2, 3):
+        for y in range(-2, 3):
+            matrix = numpy.identity(4)
+            matrix[:3, 3] = (x * 2.5, y * 2.5, 0.0)
+            instances.append(Instance("sphere", mesh, matrix))
+    return instances
+
+
+def main():
+    instances = scene()
+    view = look_at((0.0, -14.0, 8.0), (0.0, 0.0, 0.0))
+    projection = perspective(0.8, WIDTH / HEIGHT)
+    args = (instances, WIDTH, HEIGHT, view, projection)
+
+    single = best_time(lambda: CpuTracer().render(*args), 3)
+    print("%dx%d, %d instances, %d cores" % (WIDTH, HEIGHT, len(instances), multiprocessing.cpu_count()))
+    print("%8s %10s %9s" % ("workers", "frame ms", "speedup"))
+    print("%8s %10.1f %9s" % ("tracer", single * 1000, "1.00x"))
+    for workers in sorted({1, 2, 4, 8, multiprocessing.cpu_count()}):
+        renderer = CpuRenderer(workers)
+        try:
+            # Publishes the scene and lets every worker attach to it
+            renderer.render(*args)
+            frame = best_time(lambda: renderer.render(*args), 3)
+        finally:
+            renderer.close()
+        print("%8d %10.1f %8.2fx" % (workers, frame * 1000, single / frame))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+'''Frames per second and bytes per frame of the frame return stream for each
+codec, encoded, sent over a loopback socket and decoded'''
+import socket
+import threading
+import time
+
+import numpy
+
+import timing  # Puts src on the path
+from frame_codec import FrameDecoder, FrameEncoder, lz4
+from socket_api import *
+
+
+WIDTH = 1506
+HEIGHT = 871
+FRAMES = 30
+
+
+def shaded_frames(moving_object, zooming):
+    '''Renderer-like frames: flat background with a diffuse shaded sphere'''
+    y, x = numpy.mgrid[0:HEIGHT, 0:WIDTH].astype(numpy.float32)
+    frames = []
+    for i in range(FRAMES):
+        cx = WIDTH / 2 + (i * 8 if moving_object else 0)
+        cy = HEIGHT / 2 + (i * 3 if zooming else 0)
+        radius = 200 + (i if zooming else 0)
+        d2 = ((x - cx) ** 2 + (y - cy) ** 2) / radius ** 2
+        shade = numpy.sqrt(numpy.clip(1 - d2, 0, 1)) * 0.8
+        gray = numpy.where(d2 < 1, shade, 0.2)
+        frames.append(numpy.repeat((gray * 255).astype(numpy.uint8)[..., numpy.newaxis], 3, axis=2))
+    return frames
+
+
+def run(codec, frames):
+    sender, receiver = socket.socketpair()
+    encoder = FrameEncoder(codec)
+    sent = []
+
+    def send():
+        for frame in frames:
+            header, payload = encoder.encode(frame)
+            sender.sendall(header)
+            sender.sendall(payload)
+            sent.append(len(header) + len(payload))
+
+    decoder = FrameDecoder()
+    thread = threading.Thread(target=send)
+    start = time.perf_counter()
+    thread.start()
+    for frame in frames:
+        image = decoder.read(receiver)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    assert numpy.array_equal(image, frames[-1])
+    return len(frames) / elapsed, sum(sent) / len(sent)
+
+
+def main():
+    codecs = [FrameCodecs.raw, FrameCodecs.zlib]
+    if lz4 is not None:
+        codecs.append(FrameCodecs.lz4)
+
+    scenes = (
+        ("static", shaded_frames(False, False)),
+        ("object", shaded_frames(True, False)),
+        ("zoom", shaded_frames(False, True)),
+    )
+    print("%dx%d, %d frames" % (WIDTH, HEIGHT, FRAMES))
+    print("%8s %6s %8s %14s" % ("scene", "codec", "fps", "bytes/frame"))
+    for name, frames in scenes:
+        for codec in codecs:
+            fps, size = run(codec, frames)
+            print("%8s %6s %8.1f %14.0f" % (name, codec.name, fps, size))
+
+
+if __name__ == "__main__":
+    main()
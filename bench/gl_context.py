@@ -0,0 +1,27 @@
+'''Hidden GLUT window for the benchmarks that need an OpenGL context'''
+from OpenGL.GLUT import *
+from OpenGL.GL import *
+
+
+def create_context(title, width=64, height=64):
+    glutInit()
+    glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB)
+    glutInitWindowSize(width, height)
+    glutCreateWindow(title.encode())
+    glutHideWindow()
+
+
+def create_target(width, height):
+    '''Binds an RGB8 framebuffer with a depth buffer, like the client's
+    render target, and returns the framebuffer'''
+    fbo = glGenFramebuffers(1)
+    glBindFramebuffer(GL_FRAMEBUFFER, fbo)
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB8, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, None)
+    glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, texture, 0)
+    depth = glGenRenderbuffers(1)
+    glBindRenderbuffer(GL_RENDERBUFFER, depth)
+    glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT32F, width, height)
+    glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth)
+    return fbo
@@ -0,0 +1,88 @@
+'''GPU memory and CPU voxelization time of a scene as the instance count and
+the unique mesh count grow separately. Unique meshes are voxelized once
+however many instances place them, and instances only add a GPU_INSTANCE
+and a scene grid entry; the flattened column is what baking every instance
+into its own mesh would hold.'''
+import ctypes
+
+import numpy
+
+from timing import best_time
+from meshes import sphere
+from engine import cpu_voxelizer
+from engine.gpu_types import GPU_INSTANCE, GPU_MESH
+from engine.instance import Instance
+from engine.mesh_data import MeshData, voxel_bytes, voxel_list_shape
+
+
+RINGS = 16
+INSTANCE_COUNTS = (1, 16, 256, 4096)
+MESH_COUNTS = (1, 16, 64, 256)
+# Instances placed in the unique mesh sweep
+SHARED_INSTANCES = 256
+
+
+def unique_meshes(count):
+    '''Spheres with different contents, so none are deduplicated'''
+    return [MeshData(*sphere(RINGS, radius=0.5 + i * 1e-3)) for i in range(count)]
+
+
+def place(meshes, count):
+    side = int(numpy.ceil(count ** (1 / 3)))
+    instances = []
+    for i in range(count):
+        matrix = numpy.identity(4)
+        matrix[:3, 3] = numpy.array([i % side, i // side % side, i // side ** 2]) * 1.5
+        instances.append(Instance("mesh%d" % (i % len(meshes)), meshes[i % len(meshes)], matrix))
+    return instances
+
+
+def mesh_bytes(mesh):
+    '''Mesh.gpu_size with link lists sized to the mesh's references'''
+    offsets = cpu_voxelizer.voxelize_mesh(mesh, csr=True)[0]
+    capacity = int(numpy.prod(voxel_list_shape(int(offsets[-1]))))
+    cells = int(numpy.prod(mesh.voxel_resolution))
+    return mesh.gpu_size() - cells * 4 + voxel_bytes(mesh.voxel_resolution, capacity, "lists")
+
+
+def scene_bytes(instances, mesh_count):
+    '''Instance and mesh buffers plus the scene grid of instance ids'''
+    aabb, resolution, voxels, links = cpu_voxelizer.voxelize_scene([i.aabb for i in instances])
+    capacity = int(numpy.prod(voxel_list_shape(len(links) - 1)))
+    return (len(instances) * ctypes.sizeof(GPU_INSTANCE) + mesh_count * ctypes.sizeof(GPU_MESH)
+            + voxel_bytes(resolution, capacity, "lists"))
+
+
+def measure(meshes, instances):
+    '''Returns MiB held, MiB if flattened, mesh and scene voxelization ms'''
+    sizes = [mesh_bytes(mesh) for mesh in meshes]
+    held = sum(sizes) + scene_bytes(instances, len(meshes))
+    flattened = sum(sizes[i % len(meshes)] for i in range(len(instances)))
+    flattened += scene_bytes(instances, len(instances))
+    mesh_time = best_time(lambda: [cpu_voxelizer.voxelize_mesh(mesh, csr=True) for mesh in meshes], 3)
+    aabbs = [instance.aabb for instance in instances]
+    scene_time = best_time(lambda: cpu_voxelizer.voxelize_scene(aabbs), 3)
+    return held / 2**20, flattened / 2**20, mesh_time * 1000, scene_time * 1000
+
+
+def main():
+    header = "%10s %8s %10s %14s %10s %10s" % (
+        "instances", "meshes", "MiB", "flattened MiB", "mesh ms", "scene ms")
+    row = "%10d %8d %10.2f %14.2f %10.2f %10.2f"
+
+    print("One unique mesh of %d triangles" % (4 * RINGS ** 2))
+    print(header)
+    mesh = unique_meshes(1)
+    for count in INSTANCE_COUNTS:
+        print(row % ((count, 1) + measure(mesh, place(mesh, count))))
+
+    print()
+    print("%d instances" % SHARED_INSTANCES)
+    print(header)
+    for count in MESH_COUNTS:
+        meshes = unique_meshes(count)
+        print(row % ((SHARED_INSTANCES, count) + measure(meshes, place(meshes, SHARED_INSTANCES))))
+
+
+if __name__ == "__main__":
+    main()
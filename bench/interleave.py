@@ -0,0 +1,57 @@
+'''Time to prepare VertexBuffer uploads per million vertices: the old
+per-vertex VERTEX struct loop and uint32 index list against interleave()
+and a NumPy widening cast'''
+import ctypes
+
+import numpy
+
+from timing import best_time
+from engine.gpu_types import VEC3, VERTEX
+from engine.mesh_data import interleave
+
+
+SIZES = (10000, 100000, 1000000)
+
+
+def legacy_upload_data(positions, normals, indices):
+    '''The buffers the old VertexBuffer.update filled for one mesh'''
+    c_buffer = (VERTEX * len(positions))()
+    for i, data in enumerate(zip(positions, normals)):
+        c_buffer[i].vx = data[0].x
+        c_buffer[i].vy = data[0].y
+        c_buffer[i].vz = data[0].z
+        c_buffer[i].nx = data[1].x
+        c_buffer[i].ny = data[1].y
+        c_buffer[i].nz = data[1].z
+    elements = (ctypes.c_uint32 * len(indices))(
+        *[ctypes.c_uint32(i) for i in indices]
+    )
+    return c_buffer, elements
+
+
+def upload_data(positions, normals, indices):
+    return interleave(positions, normals), indices.astype(numpy.uint32)
+
+
+def main():
+    rng = numpy.random.default_rng(0)
+    print("%10s %16s %16s %9s" % ("vertices", "loop ms/Mvert", "numpy ms/Mvert", "speedup"))
+    for vert_count in SIZES:
+        positions = rng.random((vert_count, 3), numpy.float32)
+        normals = rng.random((vert_count, 3), numpy.float32)
+        indices = rng.integers(0, 2**16, vert_count * 2, numpy.uint16)
+        struct_args = (
+            (VEC3 * vert_count).from_buffer_copy(positions),
+            (VEC3 * vert_count).from_buffer_copy(normals),
+            (ctypes.c_ushort * len(indices)).from_buffer_copy(indices),
+        )
+
+        scale = 1000 * 1000000 / vert_count
+        repeat = 1 if vert_count >= 1000000 else 3
+        legacy = best_time(lambda: legacy_upload_data(*struct_args), repeat)
+        vectorized = best_time(lambda: upload_data(positions, normals, indices))
+        print("%10d %16.1f %16.1f %8.0fx" % (vert_count, legacy * scale, vectorized * scale, legacy / vectorized))
+
+
+if __name__ == "__main__":
+    main()
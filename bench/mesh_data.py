@@ -0,0 +1,45 @@
+'''CPU side of Mesh construction across mesh sizes: the old bounds and voxel
+resolution loop over VEC3 structs against MeshData on NumPy arrays'''
+import math
+
+import numpy
+
+from timing import best_time
+from engine.gpu_types import VEC3
+from engine.mesh_data import MeshData
+
+
+SIZES = (1000, 10000, 100000, 1000000)
+
+
+def legacy_bounds(positions, element_count):
+    '''What Mesh.__init__ computed before MeshData, minus the GL calls'''
+    aabb = [[0, 0, 0], [0, 0, 0]]
+    aabb[0][0] = min(positions, key=lambda p: p.x).x * 1.001
+    aabb[0][1] = min(positions, key=lambda p: p.y).y * 1.001
+    aabb[0][2] = min(positions, key=lambda p: p.z).z * 1.001
+    aabb[1][0] = max(positions, key=lambda p: p.x).x * 1.001
+    aabb[1][1] = max(positions, key=lambda p: p.y).y * 1.001
+    aabb[1][2] = max(positions, key=lambda p: p.z).z * 1.001
+    dimensions = [aabb[1][i] - aabb[0][i] for i in range(3)]
+    res_factor = (element_count // 3 / (dimensions[0] * dimensions[1] * dimensions[2])) ** (1/3)
+    return aabb, tuple(math.ceil(d * res_factor) for d in dimensions)
+
+
+def main():
+    rng = numpy.random.default_rng(0)
+    print("%10s %12s %12s %9s" % ("vertices", "loop ms", "numpy ms", "speedup"))
+    for vert_count in SIZES:
+        positions = rng.random((vert_count, 3), numpy.float32) - 0.5
+        normals = positions.copy()
+        indices = rng.integers(0, vert_count, vert_count * 2, numpy.uint32)
+        structs = (VEC3 * vert_count).from_buffer_copy(positions)
+
+        repeat = 1 if vert_count >= 1000000 else 3
+        legacy = best_time(lambda: legacy_bounds(structs, len(indices)), repeat)
+        vectorized = best_time(lambda: MeshData(positions, normals, indices))
+        print("%10d %12.2f %12.2f %8.0fx" % (vert_count, legacy * 1000, vectorized * 1000, legacy / vectorized))
+
+
+if __name__ == "__main__":
+    main()
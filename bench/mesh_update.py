@@ -0,0 +1,59 @@
+'''Work to update one mesh in a 1000 mesh scene. The old VertexBuffer packed
+and uploaded every mesh again, the sub-allocated one only the changed mesh's
+range. Times the CPU side and counts the bytes glBufferSubData would send.'''
+import ctypes
+
+import numpy
+
+from timing import best_time
+from engine.allocator import RangeAllocator
+from engine.gpu_types import VERTEX
+from engine.mesh_data import interleave
+
+
+MESH_COUNT = 1000
+SIZES = (100, 1000, 10000)
+
+
+def upload_size(vert_count, element_count):
+    return vert_count * ctypes.sizeof(VERTEX) + element_count * 4
+
+
+def main():
+    rng = numpy.random.default_rng(0)
+    print("%d meshes" % MESH_COUNT)
+    print("%14s %10s %10s %12s %12s" % ("verts/mesh", "all ms", "one ms", "all MiB", "one MiB"))
+    for vert_count in SIZES:
+        meshes = [(rng.random((vert_count, 3), numpy.float32),
+                   rng.random((vert_count, 3), numpy.float32),
+                   rng.integers(0, vert_count, vert_count * 2, numpy.uint16))
+                  for _ in range(MESH_COUNT)]
+
+        vertices = RangeAllocator(vert_count * MESH_COUNT)
+        elements = RangeAllocator(vert_count * 2 * MESH_COUNT)
+        offsets = [(vertices.allocate(vert_count), elements.allocate(vert_count * 2)) for _ in meshes]
+
+        def update_all():
+            for positions, normals, indices in meshes:
+                interleave(positions, normals)
+                indices.astype(numpy.uint32)
+
+        def update_one():
+            # A changed mesh of the same size frees and takes back its range
+            positions, normals, indices = meshes[MESH_COUNT // 2]
+            vert_offset, element_offset = offsets[MESH_COUNT // 2]
+            vertices.free(vert_offset)
+            elements.free(element_offset)
+            vertices.allocate(len(positions))
+            elements.allocate(len(indices))
+            interleave(positions, normals)
+            indices.astype(numpy.uint32)
+
+        one_size = upload_size(vert_count, vert_count * 2)
+        print("%14d %10.3f %10.3f %12.2f %12.4f" % (
+            vert_count, best_time(update_all) * 1000, best_time(update_one) * 1000,
+            one_size * MESH_COUNT / 2**20, one_size / 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+'''Synthetic meshes and cameras shared by the benchmarks'''
+import numpy
+
+
+def sphere(rings, center=(0.0, 0.0, 0.0), radius=1.0):
+    '''UV sphere with about 4 * rings**2 triangles, returned as positions,
+    normals and uint32 indices'''
+    segments = 2 * rings
+    theta, phi = numpy.meshgrid(numpy.linspace(0, numpy.pi, rings + 1),
+                                numpy.linspace(0, 2 * numpy.pi, segments + 1), indexing="ij")
+    normals = numpy.stack([
+        numpy.sin(theta) * numpy.cos(phi),
+        numpy.sin(theta) * numpy.sin(phi),
+        numpy.cos(theta),
+    ], axis=-1).reshape(-1, 3).astype(numpy.float32)
+    positions = normals * radius + numpy.asarray(center, numpy.float32)
+
+    row, col = numpy.meshgrid(numpy.arange(rings), numpy.arange(segments), indexing="ij")
+    a = (row * (segments + 1) + col).ravel()
+    b, c = a + 1, a + segments + 1
+    d = c + 1
+    indices = numpy.stack([a, c, b, b, c, d], axis=1).ravel().astype(numpy.uint32)
+    return positions, normals, indices
+
+
+def triangle_soup(count, seed=0):
+    '''count small triangles scattered through a unit cube, as in a
+    cluttered scan'''
+    rng = numpy.random.default_rng(seed)
+    centers = rng.random((count, 1, 3), numpy.float32)
+    positions = (centers + (rng.random((count, 3, 3), numpy.float32) - 0.5) * 0.05).reshape(-1, 3)
+    normals = numpy.tile(numpy.array([0.0, 0.0, 1.0], numpy.float32), (len(positions), 1))
+    return positions, normals, numpy.arange(len(positions), dtype=numpy.uint32)
+
+
+def merge(*parts):
+    '''Joins (positions, normals, indices) tuples into one'''
+    offsets = numpy.cumsum([0] + [len(positions) for positions, _, _ in parts[:-1]])
+    return (
+        numpy.concatenate([positions for positions, _, _ in parts]),
+        numpy.concatenate([normals for _, normals, _ in parts]),
+        numpy.concatenate([indices + offset for (_, _, indices), offset in zip(parts, offsets)]),
+    )
+
+
+def ground(size, height=-1.0):
+    '''A single square of two triangles facing up'''
+    positions = numpy.array([[-size, -size, height], [size, -size, height], [size, size, height], [-size, size, height]],
+                            numpy.float32)
+    normals = numpy.tile(numpy.array([0, 0, 1], numpy.float32), (4, 1))
+    return positions, normals, numpy.array([0, 1, 2, 0, 2, 3], numpy.uint32)
+
+
+def look_at(eye, target, up=(0.0, 0.0, 1.0)):
+    '''View matrix as the flat column major list Blender sends'''
+    eye = numpy.asarray(eye, numpy.float64)
+    forward = numpy.asarray(target, numpy.float64) - eye
+    forward /= numpy.linalg.norm(forward)
+    side = numpy.cross(forward, up)
+    side /= numpy.linalg.norm(side)
+    matrix = numpy.identity(4)
+    matrix[0, :3] = side
+    matrix[1, :3] = numpy.cross(side, forward)
+    matrix[2, :3] = -forward
+    matrix[:3, 3] = -matrix[:3, :3] @ eye
+    return matrix.T.ravel().tolist()
+
+
+def perspective(fov, aspect, near=0.1, far=100.0):
+    '''Projection matrix as the flat column major list Blender sends'''
+    focal = 1 / numpy.tan(fov / 2)
+    matrix = numpy.zeros((4, 4))
+    matrix[0, 0] = focal / aspect
+    matrix[1, 1] = focal
+    matrix[2, 2] = (far + near) / (near - far)
+    matrix[2, 3] = 2 * far * near / (near - far)
+    matrix[3, 2] = -1
+    return matrix.T.ravel().tolist()
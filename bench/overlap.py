@@ -0,0 +1,57 @@
+'''Voxel list size and CPU trace cost of the bounding box overlap mode
+against the separating axis test, on synthetic meshes'''
+import numpy
+
+from timing import best_time
+from meshes import ground, look_at, merge, perspective, sphere, triangle_soup
+from engine import cpu_voxelizer
+from engine.cpu_tracer import CpuTracer, generate_rays
+from engine.instance import Instance
+from engine.mesh_data import MeshData, voxel_bytes, voxel_list_shape
+
+
+WIDTH = 160
+HEIGHT = 120
+
+
+def tilted(part, angle=0.6):
+    '''Rotates a mesh about the x and z axes so its big triangles lie
+    diagonally across the grid'''
+    positions, normals, indices = part
+    c, s = numpy.cos(angle), numpy.sin(angle)
+    rotation = numpy.array([[c, -s, 0], [s, c, 0], [0, 0, 1]]) @ numpy.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+    return (positions @ rotation.T).astype(numpy.float32), (normals @ rotation.T).astype(numpy.float32), indices
+
+
+def meshes():
+    yield "sphere", MeshData(*sphere(48))
+    yield "soup", MeshData(*triangle_soup(20000))
+    # Large slanted triangles cross many cells of their bounding box
+    yield "slanted", MeshData(*tilted(merge(ground(2.0, 0.0), sphere(24, (0.0, 0.0, 0.5), 0.3))))
+
+
+def main():
+    view = look_at((0.0, -4.0, 2.0), (0.0, 0.0, 0.0))
+    projection = perspective(0.8, WIDTH / HEIGHT)
+    ray_o, ray_d = generate_rays(WIDTH, HEIGHT, view, projection)
+
+    print("%d rays" % len(ray_o))
+    print("%8s %8s %11s %8s %8s %10s %10s" % (
+        "mesh", "overlap", "references", "mean", "max", "list MiB", "kray/s"))
+    for name, mesh in meshes():
+        instances = [Instance(name, mesh)]
+        for overlap in cpu_voxelizer.OVERLAP_MODES:
+            offsets, tri_ids = cpu_voxelizer.voxelize_mesh(mesh, csr=True, overlap=overlap)
+            stats = cpu_voxelizer.list_stats(numpy.diff(offsets.astype(numpy.int64)))
+
+            tracer = CpuTracer(overlap=overlap)
+            tracer.set_grid(mesh, offsets, tri_ids)
+            rate = len(ray_o) / best_time(lambda: tracer.trace(instances, ray_o, ray_d), 3) / 1e3
+            print("%8s %8s %11d %8.2f %8d %10.2f %10.1f" % (
+                name, overlap, stats["references"], stats["mean_occupied"], stats["max"],
+                voxel_bytes(mesh.voxel_resolution, numpy.prod(voxel_list_shape(stats["references"])),
+                            "lists") / 2**20, rate))
+
+
+if __name__ == "__main__":
+    main()
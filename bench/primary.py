@@ -0,0 +1,71 @@
+'''Frame time of the GPU engine with primary hits traced for every pixel
+against rasterized into the visibility buffer (PRIMARY_VISIBILITY in the
+client), for both acceleration structures on a sphere field over a ground
+plane. Reports the raster and trace GPU scopes and the whole frame. Needs
+an OpenGL 4.4 context with ARB_bindless_texture.'''
+import time
+
+import numpy
+from OpenGL.GL import *
+
+import timing  # Puts src on the path
+from gl_context import create_context, create_target
+from meshes import ground, look_at, perspective, sphere
+from engine.engine import Engine
+from engine.profiler import Profiler
+
+
+WIDTH = 1280
+HEIGHT = 720
+WARMUP = 10
+FRAMES = 60
+# Spheres per side of the field
+GRID = 8
+
+
+def build_scene(engine):
+    engine.add_or_update_mesh("ground", engine.get_mesh(*ground(GRID)))
+    engine.add_or_update_instance("ground", "ground")
+    engine.add_or_update_mesh("sphere", engine.get_mesh(*sphere(32, radius=0.4)))
+    for i in range(GRID * GRID):
+        matrix = numpy.identity(4)
+        matrix[:3, 3] = (i % GRID - GRID / 2 + 0.5, i // GRID - GRID / 2 + 0.5, -0.6)
+        engine.add_or_update_instance("sphere%d" % i, "sphere", matrix)
+
+
+def run(acceleration, primary):
+    '''Median GPU raster and trace ms and mean wall ms per frame'''
+    profiler = Profiler(gpu=True, history=FRAMES)
+    engine = Engine(acceleration, profiler, primary=primary)
+    build_scene(engine)
+    view = look_at((0.0, -GRID * 0.9, GRID * 0.5), (0.0, 0.0, -1.0))
+    projection = perspective(0.9, WIDTH / HEIGHT)
+
+    for _ in range(WARMUP):
+        engine.draw(WIDTH, HEIGHT, view, projection)
+    glFinish()
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        engine.draw(WIDTH, HEIGHT, view, projection)
+    glFinish()
+    frame = (time.perf_counter() - start) / FRAMES
+    # Picks up the queries of the last frames
+    profiler.collect()
+
+    gpu = profiler.summary()["gpu"]
+    raster = gpu["raster"]["p50"] if "raster" in gpu else 0.0
+    return raster, gpu["trace"]["p50"], frame * 1000
+
+
+def main():
+    create_context("Fafnir primary visibility benchmark")
+    create_target(WIDTH, HEIGHT)
+    print("%dx%d, %d sphere instances" % (WIDTH, HEIGHT, GRID * GRID))
+    print("%6s %8s %10s %10s %10s" % ("accel", "primary", "raster ms", "trace ms", "frame ms"))
+    for acceleration in ("grid", "bvh"):
+        for primary in ("trace", "raster"):
+            print("%6s %8s %10.2f %10.2f %10.2f" % ((acceleration, primary) + run(acceleration, primary)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+'''Readback time and bytes per frame of the render target at common viewport
+sizes, sized exactly to the viewport and rounded up to powers of two as the
+client used to, with GL_PACK_ALIGNMENT 1 and 4. The whole target is read
+back through the client's double buffered PBOs each frame and unpacked into
+a (height, width, 3) array. Needs an OpenGL context.'''
+import ctypes
+
+import numpy
+from OpenGL.GL import *
+
+from timing import best_time
+from gl_context import create_context
+
+
+# 1506x871 is the client default; its rows need padding at alignment 4
+SIZES = (("720p", 1280, 720), ("1080p", 1920, 1080), ("1440p", 2560, 1440), ("client", 1506, 871))
+ALIGNMENTS = (1, 4)
+FRAMES = 30
+
+
+def next_pow2(value):
+    return 1 << (value - 1).bit_length()
+
+
+def row_pitch(width, alignment):
+    return (width * 3 + alignment - 1) // alignment * alignment
+
+
+class Target:
+    '''Render target and PBO pair of the given size'''
+    def __init__(self, width, height, alignment):
+        self.width = width
+        self.height = height
+        self.alignment = alignment
+        self.size = row_pitch(width, alignment) * height
+
+        self.fbo = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        self.texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGB8, width, height, 0, GL_RGB, GL_UNSIGNED_BYTE, None)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.texture, 0)
+        glClearColor(0.2, 0.2, 0.2, 1.0)
+        glClear(GL_COLOR_BUFFER_BIT)
+
+        self.host = (ctypes.c_ubyte * self.size)()
+        self.pbos = glGenBuffers(2)
+        for pbo in self.pbos:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.size, None, GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+    def read(self, frames):
+        '''Reads the target back frames times like client.display'''
+        glPixelStorei(GL_PACK_ALIGNMENT, self.alignment)
+        width, height = self.width, self.height
+        pitch = row_pitch(width, self.alignment)
+        for i in range(frames):
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[i % 2])
+            glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE, ctypes.c_void_p())
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pbos[(i + 1) % 2])
+            glGetBufferSubData(GL_PIXEL_PACK_BUFFER, 0, self.size, self.host)
+            rows = numpy.frombuffer(self.host, numpy.uint8, self.size).reshape(height, pitch)
+            rows[:, :width * 3].reshape(height, width, 3)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        glFinish()
+
+    def delete(self):
+        glDeleteBuffers(2, self.pbos)
+        glDeleteTextures([self.texture])
+        glDeleteFramebuffers(1, [self.fbo])
+
+
+def main():
+    create_context("Fafnir readback benchmark")
+    print("%6s %6s %10s %12s %12s %10s" % ("size", "align", "target", "pixels", "host bytes", "ms/frame"))
+    for label, width, height in SIZES:
+        for alignment in ALIGNMENTS:
+            for kind, size in (("exact", (width, height)), ("pow2", (next_pow2(width), next_pow2(height)))):
+                target = Target(*size, alignment)
+                target.read(2)
+                elapsed = best_time(lambda: target.read(FRAMES), 3) / FRAMES
+                print("%6s %6d %10s %12d %12d %10.2f" % (
+                    label, alignment, kind, size[0] * size[1], target.size, elapsed * 1000))
+                target.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+'''Loopback receive throughput of large messages: the old recv loop that
+concatenated bytes against MessageReader with its reusable buffer pool.
+Takes payload sizes in MiB as arguments.'''
+import socket
+import struct
+import sys
+import threading
+import time
+
+import timing  # Puts src on the path
+from socket_api import *
+
+
+# Payload size in MiB and how many messages are sent of it
+RUNS = ((1, 64), (64, 4), (512, 1))
+
+
+def legacy_read(_socket):
+    '''The receive loop of handle_socket before MessageReader'''
+    method_id, data_id = decode_cmd_message(_socket.recv(1))
+    size = decode_size_message(_socket.recv(4))
+    data = b""
+    remaining = size
+    while remaining > 0:
+        chunk = _socket.recv(min(2**23, remaining))
+        remaining -= len(chunk)
+        data += chunk
+    return method_id, data_id, data
+
+
+def throughput(read, size, count):
+    '''MiB/s of receiving count messages of size bytes over a TCP loopback
+    connection with read(socket)'''
+    server = socket.create_server(("127.0.0.1", 0))
+    sender = socket.create_connection(server.getsockname())
+    receiver, _ = server.accept()
+    server.close()
+
+    header = encode_cmd_message(MethodIDs.add, DataIDs.gltf_binary) + struct.pack("I", size)
+    payload = bytes(size)
+
+    def send():
+        for _ in range(count):
+            sender.sendall(header)
+            sender.sendall(payload)
+
+    thread = threading.Thread(target=send)
+    start = time.perf_counter()
+    thread.start()
+    for _ in range(count):
+        read(receiver)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    sender.close()
+    receiver.close()
+    return size * count / elapsed / 2**20
+
+
+def main():
+    runs = RUNS
+    if len(sys.argv) > 1:
+        runs = [(int(size), max(1, 64 // int(size))) for size in sys.argv[1:]]
+
+    print("%8s %14s %14s" % ("MiB", "recv MiB/s", "reader MiB/s"))
+    for size, count in runs:
+        legacy = throughput(legacy_read, size * 2**20, count)
+        reader = MessageReader()
+        pooled = throughput(reader.read, size * 2**20, count)
+        print("%8d %14.0f %14.0f" % (size, legacy, pooled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+'''Engine startup with an empty (cold) and a filled (warm) program binary
+cache, and the per-frame cost of the uniform lookups _trace makes with and
+without the Shader location cache. Needs an OpenGL 4.4 context; the driver's
+own shader disk caches are turned off so cold runs really compile.'''
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault("MESA_SHADER_CACHE_DISABLE", "true")
+os.environ.setdefault("__GL_SHADER_DISK_CACHE", "0")
+
+from OpenGL.GL import *
+
+from timing import best_time
+from gl_context import create_context
+from engine import shaders
+from engine.engine import Engine
+from engine.profiler import Profiler
+
+
+REPEAT = 3
+FRAMES = 1000
+# Uniforms looked up by Engine._trace every frame
+TRACE_UNIFORMS = (
+    "out_width", "view_matrix", "proj_matrix", "num_instances", "use_bvh", "use_csr",
+    "use_visibility", "scene_aabb[0]", "scene_aabb[1]", "scene_resolution", "scene_voxels",
+    "scene_list",
+)
+
+
+def startup(primary):
+    profiler = Profiler(gpu=True)
+    with profiler.scope("engine startup"):
+        engine = Engine(profiler=profiler, primary=primary)
+    glFinish()
+    return engine, profiler.samples["cpu"]["engine startup"][-1]
+
+
+def cold_and_warm(primary):
+    '''Best startup in milliseconds from an empty cache and from the cache
+    the cold run filled'''
+    cold = warm = float("inf")
+    for _ in range(REPEAT):
+        directory = tempfile.mkdtemp()
+        shaders.program_cache = shaders.ProgramCache(directory)
+        try:
+            cold = min(cold, startup(primary)[1])
+            misses = shaders.program_cache.misses
+            warm = min(warm, startup(primary)[1])
+            hits = shaders.program_cache.hits
+        finally:
+            shutil.rmtree(directory)
+    return cold, warm, misses, hits
+
+
+def uniform_lookups(shader):
+    '''Microseconds per frame for the _trace lookups, cached and direct'''
+    def cached():
+        for _ in range(FRAMES):
+            for name in TRACE_UNIFORMS:
+                shader.get_location(name)
+
+    def direct():
+        for _ in range(FRAMES):
+            for name in TRACE_UNIFORMS:
+                glGetUniformLocation(shader.program, name.encode())
+
+    return (best_time(cached) / FRAMES * 1e6, best_time(direct) / FRAMES * 1e6)
+
+
+def main():
+    create_context("Fafnir startup benchmark")
+    print("%8s %10s %10s %8s %8s" % ("primary", "cold ms", "warm ms", "compiled", "cached"))
+    for primary in ("trace", "raster"):
+        cold, warm, misses, hits = cold_and_warm(primary)
+        print("%8s %10.1f %10.1f %8d %8d" % (primary, cold, warm, misses, hits))
+
+    engine = startup("trace")[0]
+    cached, direct = uniform_lookups(engine._shader_fsq)
+    print()
+    print("uniform lookups per frame (%d names): cached %.1f us, glGetUniformLocation %.1f us" % (
+        len(TRACE_UNIFORMS), cached, direct))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+'''Bytes on the wire and receive-side decode time of one glTF primitive sent
+as JSON with base64 buffers and as a gltf_binary message'''
+import base64
+import json
+
+from timing import best_time
+from accessors import decode, make_gltf
+from gltf import BufferCache, read_accessor
+from socket_api import *
+
+
+SIZES = (1000, 10000, 60000)
+
+
+def binary_message(data):
+    '''Moves the base64 buffers of data into raw chunks'''
+    header = json.loads(json.dumps(data))
+    chunks = []
+    for buf in header["buffers"].values():
+        chunks.append(base64.b64decode(buf.pop("uri").split(",", 1)[1]))
+    return b"".join(encode_binary_payload(header, chunks))
+
+
+def decode_json(payload):
+    return decode(json.loads(payload.decode()))
+
+
+def decode_binary(payload):
+    data, chunks = decode_binary_payload(payload)
+    buffers = BufferCache(data, chunks)
+    return [read_accessor(data, name, buffers) for name in ("position", "normal", "indices")]
+
+
+def main():
+    print("%10s %12s %12s %10s %10s" % ("vertices", "json bytes", "binary bytes", "json ms", "binary ms"))
+    for vert_count in SIZES:
+        data = make_gltf(vert_count)
+        json_payload = json.dumps(data).encode()
+        binary_payload = bytearray(binary_message(data))
+        json_time = best_time(lambda: decode_json(json_payload))
+        binary_time = best_time(lambda: decode_binary(binary_payload))
+        print("%10d %12d %12d %10.2f %10.2f" % (
+            vert_count, len(json_payload) + HEADER_SIZE, len(binary_payload) + HEADER_SIZE,
+            json_time * 1000, binary_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
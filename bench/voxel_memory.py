@@ -0,0 +1,43 @@
+'''GPU memory of every mesh grid in the link list and CSR voxel layouts, as
+Mesh.voxel_bytes counts it, for the benchmark meshes and both overlap modes'''
+import numpy
+
+import timing  # Puts src on the path
+from meshes import ground, merge, sphere, triangle_soup
+from engine import cpu_voxelizer
+from engine.mesh_data import MeshData, voxel_bytes, voxel_list_shape
+
+
+def meshes():
+    for rings in (16, 48, 128):
+        yield "sphere%d" % rings, MeshData(*sphere(rings))
+    yield "soup", MeshData(*triangle_soup(20000))
+    yield "ground", MeshData(*ground(10.0))
+    yield "scene", MeshData(*merge(ground(4.0), sphere(48, (0.0, 0.0, 0.0), 0.8),
+                                   sphere(16, (2.0, 1.0, -0.5), 0.4)))
+
+
+def main():
+    print("%9s %10s %8s %10s %11s %10s %10s %7s" % (
+        "mesh", "triangles", "overlap", "cells", "references", "lists KiB", "csr KiB", "csr %"))
+    totals = {"lists": 0, "csr": 0}
+    for name, mesh in meshes():
+        cells = int(numpy.prod(mesh.voxel_resolution))
+        for overlap in cpu_voxelizer.OVERLAP_MODES:
+            offsets = cpu_voxelizer.voxelize_mesh(mesh, csr=True, overlap=overlap)[0]
+            references = int(offsets[-1])
+            # Both layouts round their capacity up to the same buckets
+            capacity = int(numpy.prod(voxel_list_shape(references)))
+            sizes = {layout: voxel_bytes(mesh.voxel_resolution, capacity, layout) for layout in totals}
+            for layout, size in sizes.items():
+                totals[layout] += size
+            print("%9s %10d %8s %10d %11d %10.1f %10.1f %6.0f%%" % (
+                name, mesh.count, overlap, cells, references, sizes["lists"] / 2**10,
+                sizes["csr"] / 2**10, sizes["csr"] / sizes["lists"] * 100))
+    print("%9s %10s %8s %10s %11s %10.1f %10.1f %6.0f%%" % (
+        "total", "", "", "", "", totals["lists"] / 2**10, totals["csr"] / 2**10,
+        totals["csr"] / totals["lists"] * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+'''Triangles per second of the CPU voxelizer: voxelize_loop, the straight
+port of comp_voxelize.glsl, against the vectorized voxelize'''
+from timing import best_time
+from meshes import sphere, triangle_soup
+from engine import cpu_voxelizer
+from engine.mesh_data import MeshData
+
+
+def meshes():
+    for rings in (16, 48):
+        yield "sphere", MeshData(*sphere(rings))
+    yield "soup", MeshData(*triangle_soup(20000))
+
+
+def main():
+    print("%8s %10s %8s %14s %14s %9s" % ("mesh", "triangles", "overlap", "loop tris/s", "numpy tris/s", "speedup"))
+    for name, mesh in meshes():
+        args = (mesh.buf_positions, mesh.buf_indices, mesh.aabb, mesh.dimensions, mesh.voxel_resolution)
+        for overlap in cpu_voxelizer.OVERLAP_MODES:
+            loop = best_time(lambda: cpu_voxelizer.voxelize_loop(*args, overlap=overlap), 1)
+            vectorized = best_time(lambda: cpu_voxelizer.voxelize(*args, overlap=overlap))
+            print("%8s %10d %8s %14.0f %14.0f %8.0fx" % (
+                name, mesh.count, overlap, mesh.count / loop, mesh.count / vectorized, loop / vectorized))
+
+
+if __name__ == "__main__":
+    main()
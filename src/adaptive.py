@@ -0,0 +1,69 @@
+import math
+import time
+
+import numpy
+
+
+# Scales are rounded to this step so small frame time jitter does not
+# change the render size every frame
+SCALE_STEP = 1 / 16
+
+
+class AdaptiveResolution:
+    '''Picks the internal render scale. While the camera moves the scale
+    follows the frame time budget, since tracing cost grows with the pixel
+    count; once no motion arrived for settle_time seconds it steps back up
+    to full resolution over refine_frames frames.'''
+    def __init__(self, budget_ms=33.0, min_scale=0.25, settle_time=0.1, refine_frames=3):
+        self.budget_ms = budget_ms
+        self.min_scale = min_scale
+        self.settle_time = settle_time
+        self.refine_frames = refine_frames
+        self.scale = 1.0
+        self._last_motion = -math.inf
+
+    @property
+    def moving(self):
+        return time.perf_counter() - self._last_motion < self.settle_time
+
+    @property
+    def settled(self):
+        return self.scale >= 1.0 and not self.moving
+
+    def motion(self):
+        '''Called for every view or projection change'''
+        self._last_motion = time.perf_counter()
+
+    def _quantize(self, scale):
+        scale = math.floor(scale / SCALE_STEP) * SCALE_STEP
+        return min(1.0, max(self.min_scale, scale))
+
+    def update(self, frame_ms):
+        '''Takes the time of a frame rendered at the current scale and
+        returns the scale of the next one'''
+        if self.moving:
+            if frame_ms > 0:
+                target = self.scale * math.sqrt(self.budget_ms / frame_ms)
+                # Drop at once when over budget but climb back gradually
+                self.scale = self._quantize(min(target, self.scale * 1.25))
+        elif self.scale < 1.0:
+            step = (1.0 - self.min_scale) / self.refine_frames
+            self.scale = min(1.0, self.scale + step)
+        return self.scale
+
+    def size(self, width, height):
+        '''The render size for a width x height target at the current scale'''
+        if self.scale >= 1.0:
+            return width, height
+        return max(1, math.ceil(width * self.scale)), max(1, math.ceil(height * self.scale))
+
+
+def upscale(image, width, height):
+    '''Nearest neighbour upscale of an image traced at reduced resolution
+    to width x height'''
+    if image.shape[:2] == (height, width):
+        return image
+
+    rows = numpy.arange(height) * image.shape[0] // height
+    cols = numpy.arange(width) * image.shape[1] // width
+    return image[rows[:, None], cols]
@@ -1,4 +1,3 @@
-import base64
 import ctypes
 import json
 import math
@@ -7,8 +6,17 @@ import socket
 import struct
 import time
 
+import numpy
+
 from socket_api import *
-from engine.engine import Engine, VEC3, Mesh
+from adaptive import AdaptiveResolution, upscale
+from frame_codec import FrameEncoder, encode_message_frame
+from gltf import BufferCache, NodeTree, find_id, items, node_meshes, read_accessor
+from network import NetworkThread
+from engine.engine import Engine
+from engine.cpu_backend import CpuEngine
+from engine.profiler import Profiler
+from engine.shaders import program_cache
 
 from OpenGL.GLUT import *
 from OpenGL.GL import *
@@ -17,7 +25,11 @@ from OpenGL.WGL import *
 g_width = 1506
 g_height = 871
 g_pbos = [0, 0]
+# Render size each PBO was read back at
+g_pbo_sizes = [(g_width, g_height), (g_width, g_height)]
 g_pbo_index = 0
+# Render size of the image in img_data
+g_frame_size = (g_width, g_height)
 g_fbo = 0
 g_render_target = 0
 g_depth_target = 0
@@ -30,26 +42,79 @@ img_data = (ctypes.c_ubyte * (g_width*g_height*3))()
 
 
 g_socket = socket.socket()
+g_network = None
 g_time = time.perf_counter()
 
 
 g_engine = None
+g_profiler = None
+# Scene state kept between glTF messages so updates can be deltas
+g_nodes = NodeTree()
+# glTF mesh id to the engine names of its primitives
+g_primitives = {}
+# Node id to the names of the instances it placed
+g_node_instances = {}
+g_dirty = True
+# Print voxel list statistics after the next draw
+g_report_lists = False
+g_stats_time = 0.0
 
 
 USE_SOCKET = True
+USE_GPU = True
+CPU_WORKERS = None
+# Per-mesh acceleration structure: "grid" or "bvh"
+ACCELERATION = "grid"
+# Grid cells a triangle is listed in: its bounding box ("aabb") or only the
+# ones it overlaps ("sat")
+VOXEL_OVERLAP = "aabb"
+# GPU grid storage: per cell link lists ("lists") or offsets into one cell
+# sorted array ("csr")
+VOXEL_LAYOUT = "lists"
+# Primary hits: traced for every pixel ("trace") or rasterized into a
+# visibility buffer with only uncovered pixels traced ("raster")
+PRIMARY_VISIBILITY = "trace"
+FRAME_CODEC = FrameCodecs.zlib
+# Seconds between timing summaries sent to Blender
+STATS_INTERVAL = 1.0
+# Chrome trace of every profiled scope, written on exit when set
+TRACE_FILE = None
+# Trace at reduced resolution while the camera moves
+ADAPTIVE_RESOLUTION = True
+FRAME_BUDGET_MS = 33.0
+# glReadPixels pads every RGB row to a multiple of this many bytes
+PACK_ALIGNMENT = 4
+
+
+# Legacy frames until the receiver sends DataIDs.capabilities
+g_encoder = FrameEncoder(FRAME_CODEC, protocol=LEGACY_FRAME_PROTOCOL)
+g_adaptive = AdaptiveResolution(FRAME_BUDGET_MS)
+
+
+def row_pitch(width):
+    '''Bytes per row of a read back RGB8 image'''
+    return (width * 3 + PACK_ALIGNMENT - 1) // PACK_ALIGNMENT * PACK_ALIGNMENT
 
 
 def update_img(width, height):
-    global g_width, g_height, img_data, g_pbos, g_pbo_index
-
-    g_width = 2 ** math.ceil(math.log2(width))
-    g_height = 2 ** math.ceil(math.log2(height))
+    global g_width, g_height, img_data, g_pbos, g_pbo_index, g_pbo_sizes, g_frame_size
+
+    # Render targets match the viewport exactly
+    g_width = width
+    g_height = height
+    g_frame_size = (width, height)
+    if not USE_GPU:
+        img_data = None
+        img_data = g_engine.resize(width, height)
+        return
 
-    img_data = (ctypes.c_ubyte * (g_width*g_height*3))()
+    g_pbo_sizes = [(g_width, g_height), (g_width, g_height)]
+    size = row_pitch(g_width) * g_height
+    img_data = (ctypes.c_ubyte * size)()
     glBindBuffer(GL_PIXEL_PACK_BUFFER, g_pbos[0])
-    glBufferData(GL_PIXEL_PACK_BUFFER, g_width*g_height*3, img_data, GL_STREAM_READ)
+    glBufferData(GL_PIXEL_PACK_BUFFER, size, img_data, GL_STREAM_READ)
     glBindBuffer(GL_PIXEL_PACK_BUFFER, g_pbos[1])
-    glBufferData(GL_PIXEL_PACK_BUFFER, g_width*g_height*3, img_data, GL_STREAM_READ)
+    glBufferData(GL_PIXEL_PACK_BUFFER, size, img_data, GL_STREAM_READ)
     glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
 
     glBindTexture(GL_TEXTURE_2D, g_render_target)
@@ -62,115 +127,145 @@ def update_img(width, height):
 
 
 def display():
-    global g_time, g_pbos, g_pbo_index, g_width, g_height, img_data
+    global g_time, g_pbos, g_pbo_index, g_width, g_height, img_data, g_frame_size, g_report_lists
 
     mrays = 0
     start = time.perf_counter()
+    width, height = g_adaptive.size(g_width, g_height)
     if g_vmat and g_pmat:
-        g_engine.draw(g_width, g_height, g_vmat, g_pmat)
+        g_engine.draw(width, height, g_vmat, g_pmat)
+        if g_report_lists and ACCELERATION == "grid":
+            for name, stats in g_engine.list_stats().items():
+                print("Voxel lists %s (%s): %d references, %.2f mean, %d max per cell" % (
+                    name, VOXEL_OVERLAP, stats["references"], stats["mean"], stats["max"]))
+        g_report_lists = False
     if USE_SOCKET:
-        g_pbo_index = (g_pbo_index + 1) % 2;
-        next_index = (g_pbo_index + 1) % 2;
-        glBindBuffer(GL_PIXEL_PACK_BUFFER, g_pbos[g_pbo_index])
-        glReadPixels(0, 0, g_width, g_height, GL_RGB, GL_UNSIGNED_BYTE, ctypes.c_void_p())
-
-        glBindBuffer(GL_PIXEL_PACK_BUFFER, g_pbos[next_index])
-        glGetBufferSubData(GL_PIXEL_PACK_BUFFER, 0, g_width*g_height*3, img_data)
-        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        with g_profiler.scope("readback"):
+            g_pbo_index = (g_pbo_index + 1) % 2;
+            next_index = (g_pbo_index + 1) % 2;
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, g_pbos[g_pbo_index])
+            glReadPixels(0, 0, width, height, GL_RGB, GL_UNSIGNED_BYTE, ctypes.c_void_p())
+            g_pbo_sizes[g_pbo_index] = (width, height)
+
+            g_frame_size = g_pbo_sizes[next_index]
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, g_pbos[next_index])
+            glGetBufferSubData(GL_PIXEL_PACK_BUFFER, 0, row_pitch(g_frame_size[0])*g_frame_size[1], img_data)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
         # glReadPixels(0, 0, g_width, g_height, GL_RGB, GL_UNSIGNED_BYTE, img_data)
     glutSwapBuffers()
 
     end = time.perf_counter()
     elapsed = end - start
     if elapsed > 0:
-        mrays = g_width * g_height / 1000000 / (end - start)
+        mrays = width * height / 1000000 / (end - start)
 
     handle_socket()
 
     new_time = time.perf_counter()
+    if ADAPTIVE_RESOLUTION:
+        g_adaptive.update((new_time - g_time) * 1000)
     # glutSetWindowTitle("Fafnir %0.2f ms" % (elapsed * 1000))
     glutSetWindowTitle("Fafnir %0.2f mrays/s" % (mrays))
     g_time = new_time
 
 
+def display_cpu():
+    global g_dirty, g_frame_size
+
+    if g_dirty and g_vmat and g_pmat:
+        start = time.perf_counter()
+        g_frame_size = g_adaptive.size(g_width, g_height)
+        g_engine.draw(*g_frame_size, g_vmat, g_pmat)
+        if ADAPTIVE_RESOLUTION:
+            g_adaptive.update((time.perf_counter() - start) * 1000)
+        # Keep tracing until refinement reaches full resolution
+        g_dirty = not g_adaptive.settled
+
+    if handle_socket():
+        g_dirty = True
+    else:
+        time.sleep(0.005)
+
+
 def handle_socket():
-    global g_socket, g_width, g_height, img_data, g_vmat, g_pmat, g_ready
+    '''Applies pending messages, sends the current frame and returns whether
+    any message arrived'''
+    global g_width, g_height, img_data, g_vmat, g_pmat, g_ready, g_stats_time, g_report_lists
     if not USE_SOCKET:
-        return
+        return False
 
-    try:
-        while True:
-            try:
-                g_socket.setblocking(False)
-                message = g_socket.recv(1)
-                if message:
-                    g_socket.setblocking(True)
-                    method_id, data_id = decode_cmd_message(message)
-                    size = decode_size_message(g_socket.recv(4))
-                    # print("Received", method_id.name, data_id.name, size)
-
-                    data = b""
-                    remaining = size
-                    start = time.perf_counter()
-                    while remaining > 0:
-                        chunk = g_socket.recv(min(2**23, remaining))
-                        remaining -= len(chunk)
-                        data += chunk
-                    data = json.loads(data.decode())
-                    # print("Time to download data: %.2fs" % (time.perf_counter() - start))
-                    if data_id == DataIDs.projection:
-                        glMatrixMode(GL_PROJECTION)
-                        glLoadMatrixf(data["data"])
-                        g_pmat = data["data"]
-                        g_engine._scene_dirty = True
-                    elif data_id == DataIDs.view:
-                        glMatrixMode(GL_MODELVIEW)
-                        glLoadMatrixf(data["data"])
-                        g_vmat = data["data"]
-                    elif data_id == DataIDs.viewport:
-                        update_img(data["width"], data["height"])
-                        g_ready = True
-                        g_engine._scene_dirty = True
-                    elif data_id == DataIDs.gltf:
-                        start = time.perf_counter()
-                        handle_gltf(method_id, data)
-                        print("Convert time: %.2f" % (time.perf_counter() - start))
-            except BlockingIOError:
-                break
-
-        # Return output
-        if g_ready:
-            g_socket.setblocking(True)
-            data_size = len(img_data)
-            # print("Sending data of size", data_size)
-            try:
-                g_socket.send(struct.pack("HH", g_width, g_height))
-
-                start_time = time.perf_counter()
-                sent_count = 0
-
-                while sent_count < data_size:
-                    sent_count += g_socket.send(img_data)
-            except socket.timeout:
-                print("Failed to send result data")
-
-            etime = time.perf_counter() - start_time
-            tx = 0 if etime == 0 else sent_count*8/1024/1024/etime
-            # print("Sent %d bytes in %.2f ms (%.2f Mbps)" % (sent_count, etime*1000, tx))
-    except ConnectionResetError:
-        print("Connection reset")
+    # Raises whatever stopped the I/O thread
+    messages = g_network.poll()
+    if g_network.closed and not messages:
         close()
 
+    for method_id, data_id, data, chunks in messages:
+        # print("Received", method_id.name, data_id.name)
+        if data_id == DataIDs.projection:
+            if g_pmat and data["data"] != g_pmat:
+                g_adaptive.motion()
+            g_pmat = data["data"]
+        elif data_id == DataIDs.view:
+            if g_vmat and data["data"] != g_vmat:
+                g_adaptive.motion()
+            g_vmat = data["data"]
+        elif data_id == DataIDs.viewport:
+            update_img(data["width"], data["height"])
+            g_ready = True
+        elif data_id in (DataIDs.gltf, DataIDs.gltf_binary):
+            start = time.perf_counter()
+            handle_gltf(method_id, data, chunks)
+            print("Convert time: %.2f" % (time.perf_counter() - start))
+            cache = g_engine.mesh_cache
+            print("Mesh cache: %d hits, %d misses, %.1f MiB" % (cache.hits, cache.misses, cache.size / 2**20))
+            if USE_GPU:
+                usage, total = g_engine.voxel_stats()
+                for name, (used, capacity) in usage.items():
+                    print("Voxel list %s: %d / %d links" % (name, used, capacity))
+                print("Voxel memory: %.1f MiB" % (total / 2**20))
+                g_report_lists = True
+        elif data_id == DataIDs.transform:
+            handle_transform(data)
+            g_adaptive.motion()
+
+    # Return output
+    if g_ready:
+        with g_profiler.scope("socket send"):
+            width, height = g_frame_size
+            if USE_GPU:
+                pitch = row_pitch(width)
+                rows = numpy.frombuffer(img_data, numpy.uint8, pitch*height).reshape(height, pitch)
+                frame = rows[:, :width*3].reshape(height, width, 3)
+            else:
+                frame = img_data[:height, :width]
+            frame = upscale(frame, g_width, g_height)
+            g_network.submit_frame(frame)
+
+    now = time.perf_counter()
+    if now - g_stats_time > STATS_INTERVAL:
+        g_stats_time = now
+        stats = g_profiler.summary()
+        stats["program cache"] = {"hits": program_cache.hits, "misses": program_cache.misses}
+        g_network.submit_message(*encode_message_frame(MethodIDs.update, DataIDs.stats, stats))
+
+    return bool(messages)
+
 
 def close():
     print("Exiting client")
     if USE_SOCKET:
+        g_network.running = False
         g_socket.close()
+    if not USE_GPU:
+        g_engine.renderer.close()
+    if TRACE_FILE:
+        g_profiler.dump_trace(TRACE_FILE)
+        print("Wrote trace to", TRACE_FILE)
     sys.exit()
 
 
 def main():
-    global img_data, g_socket, g_fbo, g_render_target, g_pbos, g_depth_target, g_engine, g_ready
+    global img_data, g_socket, g_network, g_fbo, g_render_target, g_pbos, g_depth_target, g_engine, g_ready, g_profiler
 
     # Init result image buffer
     for i in range(len(img_data), ):
@@ -181,9 +276,18 @@ def main():
     if USE_SOCKET:
         g_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         g_socket.connect(("127.0.0.1", 4242))
+        g_network = NetworkThread(g_socket, g_encoder)
+        g_network.start()
     else:
         g_ready = True
 
+    if not USE_GPU:
+        g_profiler = Profiler(trace=bool(TRACE_FILE))
+        g_engine = CpuEngine(CPU_WORKERS, ACCELERATION, g_profiler, VOXEL_OVERLAP)
+        update_img(g_width, g_height)
+        while True:
+            display_cpu()
+
     # Init Glut
     glutInit(sys.argv)
     glutInitDisplayMode(GLUT_DOUBLE | GLUT_RGB)
@@ -196,6 +300,7 @@ def main():
 
     # Setup pixel buffer object
     g_pbos = glGenBuffers(2)
+    glPixelStorei(GL_PACK_ALIGNMENT, PACK_ALIGNMENT)
 
     # Setup framebuffer
     g_fbo = glGenFramebuffers(1)
@@ -209,65 +314,106 @@ def main():
     if not USE_SOCKET:
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
-    g_engine = Engine()
+    g_profiler = Profiler(gpu=True, trace=bool(TRACE_FILE))
+    with g_profiler.scope("engine startup"):
+        g_engine = Engine(ACCELERATION, g_profiler, VOXEL_OVERLAP, VOXEL_LAYOUT, PRIMARY_VISIBILITY)
 
     glutMainLoop()
 
 
-def handle_gltf(method_id, data):
-    meshes = data["meshes"]
-
-    for name, mesh in meshes.items():
-        for i, primitive in enumerate(mesh["primitives"]):
-            accessor = data["accessors"][primitive["indices"]]
-            element_count = accessor["count"]
+def handle_gltf(method_id, data, chunks=None):
+    '''add and update merge the meshes and nodes in data into the scene,
+    remove deletes the mesh and node ids it lists'''
+    if method_id == MethodIDs.remove:
+        remove_gltf(data)
+        return
 
-            attributes = primitive["attributes"]
-            accessor = data["accessors"][attributes["POSITION"]]
-            vert_count = accessor["count"]
+    buffers = BufferCache(data, chunks)
 
-            # Positions
-            attributes = primitive["attributes"]
-            accessor = data["accessors"][attributes["POSITION"]]
-            bufview = data["bufferViews"][accessor["bufferView"]]
-            buf = data["buffers"][bufview["buffer"]]
-            bufdata = base64.b64decode(buf["uri"].split(",")[1])
-            offset = bufview["byteOffset"]+accessor["byteOffset"]
-            stride = accessor["byteStride"]
-            positions = (VEC3 * vert_count)()
-            for j in range(vert_count):
-                positions[j].x = struct.unpack("f", bufdata[offset + j * stride + 0:offset + j * stride + 4])[0]
-                positions[j].y = struct.unpack("f", bufdata[offset + j * stride + 4:offset + j * stride + 8])[0]
-                positions[j].z = struct.unpack("f", bufdata[offset + j * stride + 8:offset + j * stride + 12])[0]
-
-            # Normals
+    changed_meshes = set()
+    for name, mesh in items(data.get("meshes", {})):
+        names = []
+        for i, primitive in enumerate(mesh["primitives"]):
             attributes = primitive["attributes"]
-            accessor = data["accessors"][attributes["NORMAL"]]
-            bufview = data["bufferViews"][accessor["bufferView"]]
-            buf = data["buffers"][bufview["buffer"]]
-            bufdata = base64.b64decode(buf["uri"].split(",")[1])
-            offset = bufview["byteOffset"]+accessor["byteOffset"]
-            stride = accessor["byteStride"]
-            normals = (VEC3 * vert_count)()
-            for j in range(vert_count):
-                normals[j].x = struct.unpack("f", bufdata[offset + j * stride + 0:offset + j * stride + 4])[0]
-                normals[j].y = struct.unpack("f", bufdata[offset + j * stride + 4:offset + j * stride + 8])[0]
-                normals[j].z = struct.unpack("f", bufdata[offset + j * stride + 8:offset + j * stride + 12])[0]
-
-            # Indices
-            accessor = data["accessors"][primitive["indices"]]
-            bufview = data["bufferViews"][accessor["bufferView"]]
-            buf = data["buffers"][bufview["buffer"]]
-            bufdata = base64.b64decode(buf["uri"].split(",")[1])
-            offset = bufview["byteOffset"]+accessor["byteOffset"]
-            indices = (ctypes.c_ushort * element_count).from_buffer_copy(bufdata, offset)
-
-            mesh_name = name + "_prim" + str(i)
-            mesh_data = Mesh(vert_count, element_count, positions, normals, indices)
+            positions = read_accessor(data, attributes["POSITION"], buffers)
+            normals = read_accessor(data, attributes["NORMAL"], buffers)
+            indices = read_accessor(data, primitive["indices"], buffers)
+
+            # Unchanged geometry comes back from the mesh cache, which
+            # makes resending it a no-op for the engine
+            mesh_name = str(name) + "_prim" + str(i)
+            mesh_data = g_engine.get_mesh(positions, normals, indices)
             g_engine.add_or_update_mesh(mesh_name, mesh_data)
+            names.append(mesh_name)
+
+        old_names = g_primitives.get(name, [])
+        for mesh_name in old_names[len(names):]:
+            g_engine.remove_mesh(mesh_name)
+        if names != old_names:
+            changed_meshes.add(name)
+        g_primitives[name] = names
+
+    changed_nodes = g_nodes.update(dict(items(data.get("nodes", {}))))
+    if not len(g_nodes):
+        for name, mesh in items(data.get("meshes", {})):
+            for mesh_name in g_primitives[name]:
+                g_engine.add_or_update_instance(mesh_name, mesh_name)
+        return
 
-    for name, node in data["nodes"]:
-        print(name)
+    changed_nodes += [
+        node_id for node_id, node in g_nodes.nodes.items()
+        if changed_meshes.intersection(node_meshes(node))
+    ]
+    for node_id in set(changed_nodes):
+        place_node(node_id)
+
+
+def place_node(node_id):
+    '''Adds, moves or removes the instances of the mesh primitives a node
+    places. They all share the primitives' geometry and acceleration
+    structures.'''
+    matrix = g_nodes.world_transform(node_id)
+    names = set()
+    for mesh_id in node_meshes(g_nodes.nodes[node_id]):
+        for mesh_name in g_primitives.get(mesh_id, ()):
+            name = str(node_id) + "/" + mesh_name
+            g_engine.add_or_update_instance(name, mesh_name, matrix)
+            names.add(name)
+
+    for name in g_node_instances.get(node_id, set()) - names:
+        g_engine.remove_instance(name)
+    g_node_instances[node_id] = names
+
+
+def handle_transform(data):
+    '''Moves the instances of the nodes in data and of their descendants
+    without touching any geometry'''
+    for node_id in g_nodes.set_transforms(data["nodes"]):
+        matrix = g_nodes.world_transform(node_id)
+        for name in g_node_instances.get(node_id, ()):
+            g_engine.set_instance_matrix(name, matrix)
+
+
+def remove_gltf(data):
+    '''Deletes the node and mesh ids listed in data. Meshes are freed once
+    no primitive name refers to them anymore. Ids are matched like
+    transform updates, so "3" also removes glTF 2.0 node or mesh 3.'''
+    node_ids = [g_nodes.find(key) for key in data.get("nodes", ())]
+    node_ids = [node_id for node_id in node_ids if node_id is not None]
+    for node_id in node_ids:
+        for name in g_node_instances.pop(node_id, ()):
+            g_engine.remove_instance(name)
+    # Children of removed nodes become roots
+    for node_id in g_nodes.remove(node_ids):
+        place_node(node_id)
+
+    for key in data.get("meshes", ()):
+        mesh_names = g_primitives.pop(find_id(g_primitives, key), ())
+        for mesh_name in mesh_names:
+            # Also removes the instances placing it
+            g_engine.remove_mesh(mesh_name)
+        for node_id, names in g_node_instances.items():
+            names.difference_update(str(node_id) + "/" + mesh_name for mesh_name in mesh_names)
 
 
 def update_object(data_bytes):
@@ -0,0 +1,109 @@
+import bisect
+
+
+class RangeAllocator:
+    '''First-fit free-list allocator over a linear range of units (vertices,
+    elements, ...). It only does bookkeeping, so it can be used without a GL
+    context.'''
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+        self.allocations = {}
+        self._free = [(0, capacity)] if capacity else []
+
+    @property
+    def used(self):
+        return sum(self.allocations.values())
+
+    @property
+    def end(self):
+        '''One past the last allocated unit'''
+        if not self.allocations:
+            return 0
+        offset = max(self.allocations)
+        return offset + self.allocations[offset]
+
+    def allocate(self, size):
+        '''Returns the offset of the new range or None if it does not fit.
+        Empty ranges still take one unit so every offset stays unique.'''
+        size = max(size, 1)
+        for i, (offset, free_size) in enumerate(self._free):
+            if free_size >= size:
+                if free_size == size:
+                    del self._free[i]
+                else:
+                    self._free[i] = (offset + size, free_size - size)
+                self.allocations[offset] = size
+                return offset
+        return None
+
+    def free(self, offset):
+        size = self.allocations.pop(offset)
+        i = bisect.bisect(self._free, (offset, size))
+        self._free.insert(i, (offset, size))
+
+        # Merge with the following and preceding blocks
+        if i + 1 < len(self._free) and offset + size == self._free[i + 1][0]:
+            size += self._free.pop(i + 1)[1]
+            self._free[i] = (offset, size)
+        if i > 0 and self._free[i - 1][0] + self._free[i - 1][1] == offset:
+            prev_offset, prev_size = self._free.pop(i - 1)
+            self._free[i - 1] = (prev_offset, prev_size + size)
+
+    def grow(self, min_capacity):
+        '''Grows geometrically until at least min_capacity units fit'''
+        capacity = max(self.capacity, 1)
+        while capacity < min_capacity:
+            capacity *= 2
+        if capacity == self.capacity:
+            return
+
+        extra = capacity - self.capacity
+        if self._free and sum(self._free[-1]) == self.capacity:
+            offset, size = self._free[-1]
+            self._free[-1] = (offset, size + extra)
+        else:
+            self._free.append((self.capacity, extra))
+        self.capacity = capacity
+
+    def fragmentation(self):
+        '''Fraction of the space below the last allocation that is unused'''
+        end = self.end
+        if end == 0:
+            return 0.0
+        return (end - self.used) / end
+
+    def compact(self, budget=None):
+        '''Packs allocations to the start of the range, lowest first, and
+        returns a dict mapping old offsets to new offsets for the ranges that
+        moved. With a budget it stops before moving more than budget units,
+        though at least one range moves, so repeated calls finish the job.'''
+        moves = {}
+        allocations = {}
+        moved = 0
+        offset = 0
+        for old_offset in sorted(self.allocations):
+            size = self.allocations[old_offset]
+            if offset is None:
+                allocations[old_offset] = size
+                continue
+            if old_offset != offset:
+                if budget is not None and moves and moved + size > budget:
+                    # This range and everything above it stay where they are
+                    allocations[old_offset] = size
+                    offset = None
+                    continue
+                moves[old_offset] = offset
+                moved += size
+            allocations[offset] = size
+            offset += size
+
+        self.allocations = allocations
+        self._free = []
+        offset = 0
+        for start in sorted(allocations):
+            if start > offset:
+                self._free.append((offset, start - offset))
+            offset = start + allocations[start]
+        if offset < self.capacity:
+            self._free.append((offset, self.capacity - offset))
+        return moves
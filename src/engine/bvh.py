@@ -0,0 +1,176 @@
+import numpy
+
+
+BINS = 16
+MAX_LEAF_SIZE = 4
+# Nodes at this depth are always leaves so fsq.frag's traversal stack (one
+# entry per level) can never overflow
+MAX_DEPTH = 32
+TRAVERSAL_COST = 1.0
+INTERSECTION_COST = 1.0
+
+# Matches BVH_NODE in gpu_types.py: inner nodes store the index of their
+# first child in first (the second child follows it) and a count of 0,
+# leaves store a range of the triangle order array
+BVH_NODE_DTYPE = numpy.dtype([
+    ("lower", numpy.float32, 3),
+    ("first", numpy.uint32),
+    ("upper", numpy.float32, 3),
+    ("count", numpy.uint32),
+])
+
+
+def _half_area(lower, upper):
+    extent = numpy.maximum(upper - lower, 0.0)
+    return (extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] +
+            extent[..., 2] * extent[..., 0])
+
+
+def _segment_bounds(lower, upper, starts):
+    '''Per segment bounds of contiguous runs of boxes beginning at starts'''
+    return (numpy.minimum.reduceat(lower, starts, axis=0),
+            numpy.maximum.reduceat(upper, starts, axis=0))
+
+
+def _best_splits(centroids, tri_lower, tri_upper, segment, starts, counts):
+    '''Evaluates the binned SAH for every open node at once. Returns the split
+    axis, the last bin going left, the bin of every triangle on each axis and
+    the split cost (inf where no split separates the triangles).'''
+    nodes = len(starts)
+    cmin, cmax = _segment_bounds(centroids, centroids, starts)
+    extent = cmax - cmin
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        scale = numpy.where(extent > 0, BINS / extent, 0.0)
+    bins = ((centroids - cmin[segment]) * scale[segment]).astype(numpy.int64)
+    bins = numpy.clip(bins, 0, BINS - 1)
+
+    # One (count, lower, upper) accumulator per node, axis and bin
+    keys = (segment[:, numpy.newaxis] * 3 + numpy.arange(3)) * BINS + bins
+    size = nodes * 3 * BINS
+    bin_counts = numpy.bincount(keys.ravel(), minlength=size).reshape(nodes, 3, BINS)
+    bin_lower = numpy.full((size, 3), numpy.inf, numpy.float32)
+    bin_upper = numpy.full((size, 3), -numpy.inf, numpy.float32)
+    for axis in range(3):
+        numpy.minimum.at(bin_lower, keys[:, axis], tri_lower)
+        numpy.maximum.at(bin_upper, keys[:, axis], tri_upper)
+    bin_lower = bin_lower.reshape(nodes, 3, BINS, 3)
+    bin_upper = bin_upper.reshape(nodes, 3, BINS, 3)
+
+    # Sweep from both ends; split i sends bins [0, i] to the left child
+    left_count = numpy.cumsum(bin_counts, axis=2)[..., :-1]
+    right_count = numpy.cumsum(bin_counts[..., ::-1], axis=2)[..., ::-1][..., 1:]
+    left_area = _half_area(numpy.minimum.accumulate(bin_lower, axis=2),
+                           numpy.maximum.accumulate(bin_upper, axis=2))[..., :-1]
+    right_area = _half_area(numpy.minimum.accumulate(bin_lower[:, :, ::-1], axis=2)[:, :, ::-1],
+                            numpy.maximum.accumulate(bin_upper[:, :, ::-1], axis=2)[:, :, ::-1])[..., 1:]
+
+    cost = left_count * left_area + right_count * right_area
+    cost = numpy.where((left_count > 0) & (right_count > 0), cost, numpy.inf)
+    cost = cost.reshape(nodes, -1)
+    best = cost.argmin(axis=1)
+    axis, split = numpy.divmod(best, BINS - 1)
+    return axis, split, bins, cost[numpy.arange(nodes), best]
+
+
+def build_bvh(positions, indices):
+    '''Builds a binned SAH BVH over the triangles of a mesh. Nodes are split
+    breadth first and every open node of a level is handled by the same
+    NumPy operations. Returns the BVH_NODE_DTYPE node array (root first)
+    and the uint32 triangle order that leaves index into.'''
+    positions = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+    triangles = numpy.asarray(indices).reshape(-1, 3)
+    verts = positions[triangles]
+    all_lower = verts.min(axis=1)
+    all_upper = verts.max(axis=1)
+    all_centroids = (all_lower + all_upper) * 0.5
+
+    count = len(triangles)
+    order = numpy.arange(count, dtype=numpy.int64)
+    nodes = numpy.zeros(max(2 * count - 1, 1), BVH_NODE_DTYPE)
+    node_count = 1
+
+    # Open nodes of the current level
+    ids = numpy.zeros(1, numpy.int64)
+    starts = numpy.zeros(1, numpy.int64)
+    counts = numpy.array([count], numpy.int64)
+    depth = 0
+
+    if not count:
+        # An inverted box that no ray can enter
+        nodes["lower"][0] = numpy.inf
+        nodes["upper"][0] = -numpy.inf
+
+    while len(ids) and count:
+        # Triangles of the open nodes, grouped per node
+        segment = numpy.repeat(numpy.arange(len(ids)), counts)
+        slots = numpy.repeat(starts, counts) + numpy.arange(len(segment)) - \
+            numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        tris = order[slots]
+        tri_lower = all_lower[tris]
+        tri_upper = all_upper[tris]
+        local_starts = numpy.cumsum(counts) - counts
+
+        lower, upper = _segment_bounds(tri_lower, tri_upper, local_starts)
+        nodes["lower"][ids] = lower
+        nodes["upper"][ids] = upper
+
+        axis, split, bins, cost = _best_splits(all_centroids[tris], tri_lower, tri_upper,
+                                               segment, local_starts, counts)
+        leaf_cost = counts * INTERSECTION_COST
+        split_cost = TRAVERSAL_COST + INTERSECTION_COST * cost / numpy.maximum(_half_area(lower, upper), 1e-30)
+        do_split = (counts > MAX_LEAF_SIZE) & (split_cost < leaf_cost) & numpy.isfinite(cost)
+        # Oversized nodes are split even when the SAH prefers a leaf
+        do_split |= (counts > MAX_LEAF_SIZE * 4) & numpy.isfinite(cost)
+        if depth >= MAX_DEPTH - 1:
+            do_split[:] = False
+
+        leaves = ~do_split
+        nodes["first"][ids[leaves]] = starts[leaves]
+        nodes["count"][ids[leaves]] = counts[leaves]
+
+        # Stable partition of every split node's range into left and right
+        goes_right = bins[numpy.arange(len(tris)), axis[segment]] > split[segment]
+        moving = do_split[segment]
+        partition = numpy.lexsort((goes_right[moving], segment[moving]))
+        order[slots[moving]] = tris[moving][partition]
+
+        left_counts = numpy.bincount(segment[moving & ~goes_right], minlength=len(ids))
+        split_ids = ids[do_split]
+        children = node_count + 2 * numpy.arange(len(split_ids))
+        node_count += 2 * len(split_ids)
+        nodes["first"][split_ids] = children
+        nodes["count"][split_ids] = 0
+
+        left = left_counts[do_split]
+        ids = numpy.stack([children, children + 1], axis=1).ravel()
+        starts = numpy.stack([starts[do_split], starts[do_split] + left], axis=1).ravel()
+        counts = numpy.stack([left, counts[do_split] - left], axis=1).ravel()
+        depth += 1
+
+    return nodes[:node_count], order.astype(numpy.uint32)
+
+
+def build_mesh_bvh(mesh):
+    return build_bvh(mesh.buf_positions, mesh.buf_indices)
+
+
+def tree_depth(nodes):
+    '''Number of levels in the tree'''
+    levels = 0
+    current = numpy.zeros(1, numpy.int64)
+    while len(current):
+        levels += 1
+        # Children never point back at the root, which an empty tree is
+        inner = current[(nodes["count"][current] == 0) & (nodes["first"][current] > 0)]
+        first = nodes["first"][inner].astype(numpy.int64)
+        current = numpy.stack([first, first + 1], axis=1).ravel()
+    return levels
+
+
+def sah_cost(nodes):
+    '''Expected traversal cost of the tree relative to its root box'''
+    area = _half_area(nodes["lower"], nodes["upper"]).astype(numpy.float64)
+    root = max(area[0], 1e-30)
+    inner = nodes["count"] == 0
+    return (TRAVERSAL_COST * area[inner].sum() +
+            INTERSECTION_COST * (area[~inner] * nodes["count"][~inner]).sum()) / root
@@ -0,0 +1,300 @@
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+from . import bvh
+from . import cpu_voxelizer
+from .cpu_tracer import CpuTracer
+from .instance import Instance
+from .mesh_cache import MeshCache
+from .mesh_data import MeshData, interleave
+from .profiler import Profiler
+
+
+class SharedArrays:
+    '''Named NumPy arrays backed by one shared memory block each'''
+    def __init__(self):
+        self.blocks = {}
+        self.arrays = {}
+
+    def create(self, name, data):
+        block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        array = numpy.ndarray(data.shape, data.dtype, block.buf)
+        array[...] = data
+        self.blocks[name] = block
+        self.arrays[name] = array
+        return array
+
+    def attach(self, name, block_name, dtype, shape):
+        block = shared_memory.SharedMemory(name=block_name)
+        self.blocks[name] = block
+        self.arrays[name] = numpy.ndarray(shape, dtype, block.buf)
+        return self.arrays[name]
+
+    def describe(self):
+        return {
+            name: (self.blocks[name].name, array.dtype, array.shape)
+            for name, array in self.arrays.items()
+        }
+
+    def close(self, unlink=False):
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks.clear()
+
+
+class _SceneMesh:
+    def __init__(self, arrays, info):
+        vertices = arrays["vertices"][slice(*info["vertices"])]
+        self.buf_positions = vertices[:, 0:3]
+        self.buf_normals = vertices[:, 4:7]
+        self.buf_indices = arrays["indices"][slice(*info["indices"])]
+        self.aabb = info["aabb"]
+        self.voxel_resolution = info["resolution"]
+        # CSR offsets or BVH nodes, plus the triangle ids they index
+        self.accel = (arrays["nodes"][slice(*info["nodes"])],
+                      arrays["tri_ids"][slice(*info["tri_ids"])])
+
+
+def publish_scene(meshes, acceleration="grid", overlap="aabb"):
+    '''Packs the interleaved vertices, indices and the CSR voxel grid or BVH
+    of every mesh into shared memory. Returns the arrays and a small
+    picklable descriptor that workers use to attach to them.'''
+    parts = {"vertices": [], "indices": [], "nodes": [], "tri_ids": []}
+    infos = []
+    for mesh in meshes:
+        if acceleration == "bvh":
+            nodes, tri_ids = bvh.build_mesh_bvh(mesh)
+        else:
+            nodes, tri_ids = cpu_voxelizer.voxelize_mesh(mesh, csr=True, overlap=overlap)
+        info = {"aabb": mesh.aabb, "resolution": mesh.voxel_resolution}
+        for name, data in (("vertices", interleave(mesh.buf_positions, mesh.buf_normals)),
+                           ("indices", mesh.buf_indices.astype(numpy.uint32)),
+                           ("nodes", nodes), ("tri_ids", tri_ids)):
+            start = sum(len(part) for part in parts[name])
+            parts[name].append(data)
+            info[name] = (start, start + len(data))
+        infos.append(info)
+
+    arrays = SharedArrays()
+    arrays.create("vertices", numpy.concatenate(parts["vertices"] or [numpy.zeros((0, 8), numpy.float32)]))
+    empty_nodes = numpy.zeros(0, bvh.BVH_NODE_DTYPE if acceleration == "bvh" else numpy.uint32)
+    arrays.create("nodes", numpy.concatenate(parts["nodes"] or [empty_nodes]))
+    for name in ("indices", "tri_ids"):
+        arrays.create(name, numpy.concatenate(parts[name] or [numpy.zeros(0, numpy.uint32)]))
+    return arrays, {"arrays": arrays.describe(), "meshes": infos,
+                    "acceleration": acceleration, "overlap": overlap}
+
+
+def publish_instances(instances, meshes):
+    '''Shares the matrices of the instances and the index into meshes of
+    the mesh each one places. Kept apart from publish_scene so moving
+    instances never copies or revoxelizes geometry.'''
+    mesh_index = {id(mesh): index for index, mesh in enumerate(meshes)}
+    matrices = numpy.array([instance.matrix for instance in instances], numpy.float64)
+    arrays = SharedArrays()
+    arrays.create("matrices", matrices.reshape(-1, 4, 4))
+    arrays.create("mesh_ids", numpy.array(
+        [mesh_index[id(instance.mesh)] for instance in instances], numpy.int64))
+    return arrays, arrays.describe()
+
+
+# Per worker process state
+_worker = {
+    "scene": None, "scene_key": None,
+    "instances": None, "instances_key": None,
+    "image": None, "image_key": None,
+}
+
+
+def _attach(descriptor):
+    arrays = SharedArrays()
+    for name, (block_name, dtype, shape) in descriptor.items():
+        arrays.attach(name, block_name, dtype, shape)
+    return arrays
+
+
+def _render_tile(task):
+    scene, instances, image, width, height, view_mat, proj_mat, tile = task
+
+    if _worker["scene_key"] != scene["arrays"]["vertices"][0]:
+        if _worker["scene"] is not None:
+            _worker["scene"][0].close()
+        arrays = _attach(scene["arrays"])
+        meshes = [_SceneMesh(arrays.arrays, info) for info in scene["meshes"]]
+        tracer = CpuTracer(scene["acceleration"], scene["overlap"])
+        for mesh in meshes:
+            if tracer.acceleration == "bvh":
+                tracer.set_bvh(mesh, *mesh.accel)
+            else:
+                tracer.set_grid(mesh, *mesh.accel)
+        _worker["scene"] = (arrays, meshes, tracer)
+        _worker["scene_key"] = scene["arrays"]["vertices"][0]
+        _worker["instances_key"] = None
+
+    if _worker["instances_key"] != instances["matrices"][0]:
+        if _worker["instances"] is not None:
+            _worker["instances"][0].close()
+        arrays = _attach(instances)
+        meshes = _worker["scene"][1]
+        placed = [
+            Instance(None, meshes[mesh_id], matrix)
+            for mesh_id, matrix in zip(arrays.arrays["mesh_ids"], arrays.arrays["matrices"])
+        ]
+        _worker["instances"] = (arrays, placed)
+        _worker["instances_key"] = instances["matrices"][0]
+
+    if _worker["image_key"] != image["image"][0]:
+        if _worker["image"] is not None:
+            _worker["image"].close()
+        _worker["image"] = _attach(image)
+        _worker["image_key"] = image["image"][0]
+
+    tracer = _worker["scene"][2]
+    x0, y0, x1, y1 = tile
+    pixels = tracer.render(_worker["instances"][1], width, height, view_mat, proj_mat, tile)[0]
+    _worker["image"].arrays["image"][y0:y1, x0:x1] = pixels
+    return tile
+
+
+class CpuRenderer:
+    '''Traces frames in tiles across a process pool. The scene is published
+    once through shared memory and every worker writes its tiles straight
+    into the shared output image.'''
+    def __init__(self, workers=None, tile_size=64, acceleration="grid", overlap="aabb"):
+        self.acceleration = acceleration
+        self.overlap = overlap
+        self.workers = workers or multiprocessing.cpu_count()
+        self.tile_size = tile_size
+        # Workers must share the parent's tracker or each of them would
+        # unlink the blocks it attached to when it exits
+        resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(self.workers)
+        self._scene = None
+        self._scene_meshes = None
+        self._instances = None
+        self._instance_state = None
+        self._image = None
+        self.width = 0
+        self.height = 0
+
+    @property
+    def image(self):
+        '''The shared output image, None until the first resize'''
+        if self._image is None:
+            return None
+        return self._image.arrays["image"]
+
+    def resize(self, width, height):
+        '''Reallocates the shared (height, width, 3) output image and returns it'''
+        if self._image is not None:
+            self._image.close(unlink=True)
+        self.width = width
+        self.height = height
+        self._image = SharedArrays()
+        self._image.create("image", numpy.full((height, width, 3), 128, numpy.uint8))
+        return self.image
+
+    def publish(self, instances):
+        '''Shares the unique meshes of the instances, then the instances'''
+        instances = list(instances)
+        meshes = list({id(i.mesh): i.mesh for i in instances}.values())
+        if self._scene_meshes is None or len(meshes) != len(self._scene_meshes) or \
+                any(a is not b for a, b in zip(meshes, self._scene_meshes)):
+            if self._scene is not None:
+                self._scene[0].close(unlink=True)
+            self._scene = publish_scene(meshes, self.acceleration, self.overlap)
+            self._scene_meshes = meshes
+            self._instance_state = None
+
+        state = [(id(i.mesh), i.matrix.tobytes()) for i in instances]
+        if state == self._instance_state:
+            return
+        if self._instances is not None:
+            self._instances[0].close(unlink=True)
+        self._instances = publish_instances(instances, meshes)
+        self._instance_state = state
+
+    def tiles(self, width, height):
+        for y in range(0, height, self.tile_size):
+            for x in range(0, width, self.tile_size):
+                yield (x, y, min(x + self.tile_size, width), min(y + self.tile_size, height))
+
+    def render(self, instances, width, height, view_mat, proj_mat):
+        '''Smaller sizes than the image are traced into its top left corner'''
+        if width > self.width or height > self.height or self._image is None:
+            self.resize(width, height)
+        self.publish(instances)
+
+        image = self._image.describe()
+        tasks = [(self._scene[1], self._instances[1], image, width, height, view_mat, proj_mat, tile)
+                 for tile in self.tiles(width, height)]
+        self._pool.map(_render_tile, tasks, chunksize=1)
+        return self.image
+
+    def close(self):
+        self._pool.terminate()
+        if self._scene is not None:
+            self._scene[0].close(unlink=True)
+        if self._instances is not None:
+            self._instances[0].close(unlink=True)
+        if self._image is not None:
+            self._image.close(unlink=True)
+
+
+class CpuEngine:
+    '''Stand-in for Engine on machines without a GPU'''
+    def __init__(self, workers=None, acceleration="grid", profiler=None, overlap="aabb"):
+        self._meshes = {}
+        self._instances = {}
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.mesh_cache = MeshCache()
+        self.renderer = CpuRenderer(workers, acceleration=acceleration, overlap=overlap)
+
+    def get_mesh(self, positions, normals, indices):
+        key = MeshCache.key(positions, normals, indices)
+        mesh = self.mesh_cache.get(key)
+        if mesh is None:
+            mesh = MeshData(positions, normals, indices)
+            self.mesh_cache.put(key, mesh, self._meshes.values())
+        return mesh
+
+    def add_or_update_mesh(self, name, mesh):
+        self._meshes[name] = mesh
+        for instance in self._instances.values():
+            if instance.mesh_name == name:
+                instance.set_mesh(mesh)
+
+    def remove_mesh(self, name):
+        mesh = self._meshes.pop(name, None)
+        if mesh is None:
+            return
+        for instance_name, instance in list(self._instances.items()):
+            if instance.mesh_name == name:
+                del self._instances[instance_name]
+        if all(m is not mesh for m in self._meshes.values()):
+            self.mesh_cache.discard(mesh)
+
+    def add_or_update_instance(self, name, mesh_name, matrix=None):
+        self._instances[name] = Instance(mesh_name, self._meshes[mesh_name], matrix)
+
+    def set_instance_matrix(self, name, matrix):
+        self._instances[name].set_matrix(matrix)
+
+    def remove_instance(self, name):
+        self._instances.pop(name, None)
+
+    def resize(self, width, height):
+        return self.renderer.resize(width, height)
+
+    def draw(self, width, height, view_mat, proj_mat):
+        if not self._instances:
+            return self.renderer.image
+        with self.profiler.scope("trace"):
+            image = self.renderer.render(self._instances.values(), width, height, view_mat, proj_mat)
+        self.profiler.end_frame()
+        return image
@@ -0,0 +1,401 @@
+import numpy
+
+from . import bvh
+from . import cpu_voxelizer
+
+
+EPSILON = numpy.float32(0.00001)
+LIGHT_POSITION = numpy.array([3.0, -4.0, 6.0], numpy.float32)
+BACKGROUND = 0.2
+
+RAY_HIT_DTYPE = numpy.dtype([
+    ("t", numpy.float32),
+    ("tri_id", numpy.int32),
+    ("u", numpy.float32),
+    ("v", numpy.float32),
+    ("instance_id", numpy.int32),
+])
+
+
+def _matrix(values):
+    # GL matrices arrive as flat column-major lists
+    return numpy.asarray(values, numpy.float64).reshape(4, 4).T
+
+
+def generate_rays(width, height, view_mat, proj_mat, tile=None):
+    '''Same rays as fsq.vert interpolated at the pixel centers, ordered
+    bottom row first like gl_FragCoord. tile optionally restricts them to
+    the (x0, y0, x1, y1) pixel rectangle.'''
+    inv_view = numpy.linalg.inv(_matrix(view_mat))
+    inv_proj = numpy.linalg.inv(_matrix(proj_mat))
+    x0, y0, x1, y1 = tile if tile is not None else (0, 0, width, height)
+
+    x = (numpy.arange(x0, x1) + 0.5) / width * 2.0 - 1.0
+    y = (numpy.arange(y0, y1) + 0.5) / height * 2.0 - 1.0
+    ndc = numpy.zeros((len(y), len(x), 4))
+    ndc[..., 0] = x[numpy.newaxis, :]
+    ndc[..., 1] = y[:, numpy.newaxis]
+    ndc[..., 3] = 1.0
+    ndc = ndc.reshape(-1, 4)
+
+    ray_d = ndc @ inv_proj.T
+    ray_d[:, 3] = 0.0
+    ray_d = (ray_d @ inv_view.T)[:, :3]
+    ray_d /= numpy.linalg.norm(ray_d, axis=1)[:, numpy.newaxis]
+
+    ray_o = numpy.broadcast_to(inv_view[:3, 3], ray_d.shape)
+    return ray_o.astype(numpy.float32), ray_d.astype(numpy.float32)
+
+
+def scene_bounds(instances):
+    '''Mirrors the scene AABB computed in Voxelizer.voxelize_scene'''
+    return cpu_voxelizer.scene_bounds([instance.aabb for instance in instances])
+
+
+def object_rays(instance, ray_o, ray_d):
+    '''Moves rays into an instance's object space like fsq.frag. Directions
+    are not renormalized, so t values stay world space distances.'''
+    inverse = instance.inverse.astype(numpy.float32)
+    return ray_o @ inverse[:3, :3].T + inverse[:3, 3], ray_d @ inverse[:3, :3].T
+
+
+def ray_to_bounds(aabb, ray_o, ray_d, ray_inv):
+    '''Vectorized dda_ray_to_bounds. Returns a hit mask, tmin and the ray
+    origins moved onto the box.'''
+    sign = (ray_inv <= 0).astype(numpy.float32)
+    bounds = aabb[1] * sign + aabb[0] * (1 - sign)
+    t_vmin = (bounds - ray_o) * ray_inv
+    bounds = aabb[0] * sign + aabb[1] * (1 - sign)
+    t_vmax = (bounds - ray_o) * ray_inv
+
+    miss = ((t_vmin[:, 0] > t_vmax[:, 1]) | (t_vmin[:, 1] > t_vmax[:, 0]) |
+            (t_vmin[:, 0] > t_vmax[:, 2]) | (t_vmin[:, 2] > t_vmax[:, 0]))
+    tmin = t_vmin.max(axis=1)
+    tmax = t_vmax.min(axis=1)
+    hit = ~miss & (tmax > tmin)
+
+    origin = ray_o + ray_d * (tmin + EPSILON)[:, numpy.newaxis]
+    return hit, tmin, origin
+
+
+class DDA:
+    '''Vectorized DDAData traversal over a batch of rays'''
+    def __init__(self, aabb, resolution, ray_o, ray_d, ray_inv):
+        self.aabb = numpy.asarray(aabb, numpy.float32)
+        self.resolution = numpy.asarray(resolution, numpy.int64)
+        cell_size = (self.aabb[1] - self.aabb[0]) / self.resolution.astype(numpy.float32)
+
+        self.coord = numpy.floor((ray_o - self.aabb[0]) / cell_size).astype(numpy.int64)
+        sign = (ray_inv <= 0).astype(numpy.float32)
+        cell_min = self.coord * cell_size + self.aabb[0]
+        cell_max = (self.coord + 1) * cell_size + self.aabb[0]
+        bounds = cell_min * sign + cell_max * (1 - sign)
+        self.tmax = ((bounds - ray_o) * ray_inv).astype(numpy.float32)
+        self.coord_step = numpy.sign(ray_d).astype(numpy.int64)
+        self.tstep = (cell_size * self.coord_step * ray_inv).astype(numpy.float32)
+
+        # Axis-parallel rays never cross planes on that axis
+        parallel = self.coord_step == 0
+        self.tmax[parallel] = numpy.inf
+        self.tstep[parallel] = numpy.inf
+        self.t = self.tmax.min(axis=1)
+
+    def select(self, mask):
+        for name in ("coord", "tmax", "coord_step", "tstep", "t"):
+            setattr(self, name, getattr(self, name)[mask])
+
+    def step(self):
+        mask = self.tmax <= self.t[:, numpy.newaxis]
+        self.coord += mask * self.coord_step
+        self.tmax = numpy.where(mask, self.tmax + self.tstep, self.tmax)
+        self.t = self.tmax.min(axis=1)
+
+    def in_bounds(self):
+        inside = numpy.all((self.coord >= 0) & (self.coord < self.resolution), axis=1)
+        return inside & numpy.isfinite(self.t)
+
+
+def intersect(ray_o, ray_d, v0, v1, v2, closest_t):
+    '''Batched version of the Moller-Trumbore test in trace_list, including
+    its backface culling. Returns a hit mask and t, u, v.'''
+    e0 = v1 - v0
+    e1 = v2 - v0
+    P = numpy.cross(ray_d, e1)
+    det = numpy.einsum("ij,ij->i", e0, P)
+    T = ray_o - v0
+    u = numpy.einsum("ij,ij->i", T, P)
+    Q = numpy.cross(T, e0)
+    v = numpy.einsum("ij,ij->i", ray_d, Q)
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        inv_det = 1.0 / det
+        t = numpy.einsum("ij,ij->i", e1, Q) * inv_det
+        u *= inv_det
+        v *= inv_det
+        hit = ((det >= EPSILON) & (u >= 0.0) & (u <= 1.0) & (v >= 0.0) & (u + v <= 1.0) &
+               (t >= 0) & (t < closest_t))
+    return hit, t, u, v
+
+
+def box_hit(lower, upper, ray_o, ray_inv, closest_t):
+    '''Slab test of one box per ray, rejecting boxes behind the ray or past
+    closest_t'''
+    with numpy.errstate(invalid="ignore"):
+        t0 = (lower - ray_o) * ray_inv
+        t1 = (upper - ray_o) * ray_inv
+    # fmin/fmax skip the NaN of a ray lying in a slab plane
+    t_near = numpy.fmin(t0, t1).max(axis=1)
+    t_far = numpy.fmax(t0, t1).min(axis=1)
+    return (t_near <= t_far) & (t_far >= 0) & (t_near < closest_t)
+
+
+def _expand_ranges(starts, counts):
+    '''Concatenates arange(start, start + count) for every pair'''
+    total = int(counts.sum())
+    local = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return numpy.repeat(starts, counts) + local
+
+
+class CpuTracer:
+    '''Headless ray tracer that follows fsq.frag: rays are moved into each
+    instance's object space for a DDA walk through its mesh's uniform grid
+    (or a walk down its BVH) followed by Moller-Trumbore over the triangles
+    found. Whole ray packets are traced at once.'''
+    def __init__(self, acceleration="grid", overlap="aabb"):
+        if acceleration not in ("grid", "bvh"):
+            raise ValueError("Unknown acceleration structure: " + acceleration)
+        if overlap not in cpu_voxelizer.OVERLAP_MODES:
+            raise ValueError("Unknown overlap mode: " + overlap)
+        self.acceleration = acceleration
+        self.overlap = overlap
+        self._grids = {}
+        self._bvhs = {}
+
+    def _grid(self, mesh):
+        grid = self._grids.get(mesh)
+        if grid is None:
+            grid = cpu_voxelizer.voxelize_mesh(mesh, csr=True, overlap=self.overlap)
+            self._grids[mesh] = grid
+        return grid
+
+    def _bvh(self, mesh):
+        tree = self._bvhs.get(mesh)
+        if tree is None:
+            tree = bvh.build_mesh_bvh(mesh)
+            self._bvhs[mesh] = tree
+        return tree
+
+    def trace(self, instances, ray_o, ray_d):
+        '''Returns a RAY_HIT array with the instance and triangle hit by
+        each ray (instance_id -1 for misses)'''
+        instances = list(instances)
+        meshes = list({id(i.mesh): i.mesh for i in instances}.values())
+        count = len(ray_o)
+        closest_t = numpy.full(count, 1000.0, numpy.float32)
+        closest_tri = numpy.full(count, -1, numpy.int64)
+        closest_instance = numpy.full(count, -1, numpy.int64)
+        closest_uv = numpy.zeros((count, 2), numpy.float32)
+
+        self._grids = {mesh: self._grids[mesh] for mesh in meshes if mesh in self._grids}
+        self._bvhs = {mesh: self._bvhs[mesh] for mesh in meshes if mesh in self._bvhs}
+        if not instances:
+            return self._results(closest_t, closest_tri, closest_instance, closest_uv)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            ray_inv = numpy.float32(1.0) / ray_d
+            in_scene = numpy.flatnonzero(
+                ray_to_bounds(scene_bounds(instances), ray_o, ray_d, ray_inv)[0])
+
+        trace_mesh = self._trace_mesh_bvh if self.acceleration == "bvh" else self._trace_mesh
+        for instance_id, instance in enumerate(instances):
+            # Only rays entering the instance's world box are moved into
+            # its object space
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                aabb = numpy.asarray(instance.aabb, numpy.float32)
+                hit = ray_to_bounds(aabb, ray_o[in_scene], ray_d[in_scene], ray_inv[in_scene])[0]
+                rays = in_scene[hit]
+                object_o, object_d = object_rays(instance, ray_o[rays], ray_d[rays])
+                object_inv = numpy.float32(1.0) / object_d
+            trace_mesh(instance_id, instance, rays, object_o, object_d, object_inv,
+                       closest_t, closest_tri, closest_instance, closest_uv)
+
+        return self._results(closest_t, closest_tri, closest_instance, closest_uv)
+
+    def _trace_mesh(self, instance_id, instance, rays, ray_o, ray_d, ray_inv,
+                    closest_t, closest_tri, closest_instance, closest_uv):
+        '''Traces the object space rays ray_o, ray_d and ray_inv, which
+        belong to the ray indices rays, through the instance's mesh'''
+        mesh = instance.mesh
+        offsets, cell_tris = self._grid(mesh)
+        positions = mesh.buf_positions
+        triangles = mesh.buf_indices.reshape(-1, 3).astype(numpy.int64)
+        resolution = numpy.asarray(mesh.voxel_resolution, numpy.int64)
+        aabb = numpy.asarray(mesh.aabb, numpy.float32)
+
+        with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            hit, tmin, origin = ray_to_bounds(aabb, ray_o, ray_d, ray_inv)
+            rays, tmin, origin = rays[hit], tmin[hit], origin[hit]
+            ray_d, ray_inv = ray_d[hit], ray_inv[hit]
+            dda = DDA(aabb, resolution, origin, ray_d, ray_inv)
+
+            while len(rays):
+                inside = dda.in_bounds()
+                rays, tmin, origin, ray_d = rays[inside], tmin[inside], origin[inside], ray_d[inside]
+                dda.select(inside)
+                if not len(rays):
+                    break
+
+                cells = numpy.ravel_multi_index(dda.coord.T, tuple(resolution))
+                starts = offsets[cells].astype(numpy.int64)
+                counts = offsets[cells + 1].astype(numpy.int64) - starts
+                pair_ray = numpy.repeat(numpy.arange(len(rays)), counts)
+                pair_tri = cell_tris[_expand_ranges(starts, counts)].astype(numpy.int64)
+
+                verts = positions[triangles[pair_tri]]
+                hit, t, u, v = intersect(origin[pair_ray], ray_d[pair_ray],
+                                         verts[:, 0], verts[:, 1], verts[:, 2],
+                                         dda.t[pair_ray])
+
+                # Closest hit per ray inside this cell
+                pair_ray, pair_tri, t, u, v = (a[hit] for a in (pair_ray, pair_tri, t, u, v))
+                order = numpy.lexsort((t, pair_ray))
+                first = numpy.ones(len(order), bool)
+                first[1:] = pair_ray[order][1:] != pair_ray[order][:-1]
+                best = order[first]
+
+                local = pair_ray[best]
+                dist = t[best] + tmin[local] + EPSILON
+                target = rays[local]
+                better = (dist > 0) & (dist < closest_t[target])
+                target = target[better]
+                best = best[better]
+                closest_t[target] = dist[better]
+                closest_tri[target] = pair_tri[best]
+                closest_instance[target] = instance_id
+                closest_uv[target, 0] = u[best]
+                closest_uv[target, 1] = v[best]
+
+                # A hit in a cell ends this mesh's traversal, as in fsq.frag
+                done = numpy.zeros(len(rays), bool)
+                done[local] = True
+                rays, tmin, origin, ray_d = rays[~done], tmin[~done], origin[~done], ray_d[~done]
+                dda.select(~done)
+                dda.step()
+
+    def _trace_mesh_bvh(self, instance_id, instance, rays, ray_o, ray_d, ray_inv,
+                        closest_t, closest_tri, closest_instance, closest_uv):
+        '''Depth first walk with one stack per ray, the same as trace_bvh in
+        fsq.frag. Unlike the grid walk this always finds the closest hit.'''
+        mesh = instance.mesh
+        nodes, tri_order = self._bvh(mesh)
+        positions = mesh.buf_positions
+        triangles = mesh.buf_indices.reshape(-1, 3).astype(numpy.int64)
+        lower = nodes["lower"]
+        upper = nodes["upper"]
+        center = (lower + upper) * 0.5
+        first = nodes["first"].astype(numpy.int64)
+        tri_count = nodes["count"].astype(numpy.int64)
+
+        # Rows of ray_o, ray_d and ray_inv still being walked
+        local = numpy.arange(len(rays))
+        stack = numpy.zeros((len(rays), bvh.MAX_DEPTH), numpy.int64)
+        top = numpy.ones(len(rays), numpy.int64)
+
+        while len(rays):
+            top -= 1
+            node = stack[numpy.arange(len(rays)), top]
+            hit = box_hit(lower[node], upper[node], ray_o[local], ray_inv[local], closest_t[rays])
+
+            leaf = numpy.flatnonzero(hit & (tri_count[node] > 0))
+            counts = tri_count[node[leaf]]
+            pair_ray = numpy.repeat(leaf, counts)
+            pair_tri = tri_order[_expand_ranges(first[node[leaf]], counts)].astype(numpy.int64)
+            target = rays[pair_ray]
+            row = local[pair_ray]
+            verts = positions[triangles[pair_tri]]
+            found, t, u, v = intersect(ray_o[row], ray_d[row],
+                                       verts[:, 0], verts[:, 1], verts[:, 2],
+                                       closest_t[target])
+
+            target, pair_tri, t, u, v = (a[found] for a in (target, pair_tri, t, u, v))
+            order = numpy.lexsort((t, target))
+            best = order[numpy.r_[True, target[order][1:] != target[order][:-1]]] \
+                if len(order) else order
+            target = target[best]
+            closest_t[target] = t[best]
+            closest_tri[target] = pair_tri[best]
+            closest_instance[target] = instance_id
+            closest_uv[target, 0] = u[best]
+            closest_uv[target, 1] = v[best]
+
+            # Push the far child first so the near one is visited next
+            inner = numpy.flatnonzero(hit & (tri_count[node] == 0))
+            child = first[node[inner]]
+            toward = numpy.einsum("ij,ij->i", center[child + 1] - center[child], ray_d[local[inner]])
+            near = numpy.where(toward >= 0, child, child + 1)
+            stack[inner, top[inner]] = 2 * child + 1 - near
+            stack[inner, top[inner] + 1] = near
+            top[inner] += 2
+
+            keep = top > 0
+            rays, local, stack, top = rays[keep], local[keep], stack[keep], top[keep]
+
+    @staticmethod
+    def _results(closest_t, closest_tri, closest_instance, closest_uv):
+        hits = numpy.zeros(len(closest_t), RAY_HIT_DTYPE)
+        found = closest_instance >= 0
+        hits["t"] = numpy.where(found, closest_t, -1.0)
+        hits["tri_id"] = numpy.where(found, closest_tri, 0)
+        hits["u"] = numpy.where(found, closest_uv[:, 0], 0.0)
+        hits["v"] = numpy.where(found, closest_uv[:, 1], 0.0)
+        hits["instance_id"] = closest_instance
+        return hits
+
+    def shade(self, instances, hits):
+        '''Same diffuse shading as output_results in fsq.frag'''
+        instances = list(instances)
+        color = numpy.full(len(hits), BACKGROUND, numpy.float32)
+        for instance_id, instance in enumerate(instances):
+            rays = numpy.flatnonzero(hits["instance_id"] == instance_id)
+            if not len(rays):
+                continue
+
+            mesh = instance.mesh
+
+            tris = mesh.buf_indices.reshape(-1, 3)[hits["tri_id"][rays]]
+            u = hits["u"][rays, numpy.newaxis]
+            v = hits["v"][rays, numpy.newaxis]
+            weights = (1 - u - v, u, v)
+            pos = sum(w * mesh.buf_positions[tris[:, i]] for i, w in enumerate(weights))
+            norm = sum(w * mesh.buf_normals[tris[:, i]] for i, w in enumerate(weights))
+            # World space, normals by the inverse transpose
+            pos = pos @ instance.matrix[:3, :3].T + instance.matrix[:3, 3]
+            norm = norm @ instance.inverse[:3, :3]
+
+            L = LIGHT_POSITION - pos
+            L /= numpy.linalg.norm(L, axis=1)[:, numpy.newaxis]
+            N = norm / numpy.linalg.norm(norm, axis=1)[:, numpy.newaxis]
+            color[rays] = numpy.einsum("ij,ij->i", N, L) * 0.8
+
+        return color
+
+    def render(self, instances, width, height, view_mat, proj_mat, tile=None):
+        '''Returns an RGB8 image (bottom row first, like glReadPixels) and
+        the RAY_HIT buffer for the whole frame or the given tile'''
+        instances = list(instances)
+        ray_o, ray_d = generate_rays(width, height, view_mat, proj_mat, tile)
+        hits = self.trace(instances, ray_o, ray_d)
+        color = self.shade(instances, hits)
+
+        x0, y0, x1, y1 = tile if tile is not None else (0, 0, width, height)
+        image = numpy.round(numpy.clip(color, 0.0, 1.0) * 255).astype(numpy.uint8)
+        image = numpy.repeat(image[:, numpy.newaxis], 3, axis=1)
+        return image.reshape(y1 - y0, x1 - x0, 3), hits
+
+    def set_grid(self, mesh, offsets, tri_ids):
+        '''Supplies a prebuilt CSR voxel grid for a mesh'''
+        self._grids[mesh] = (offsets, tri_ids)
+
+    def set_bvh(self, mesh, nodes, tri_order):
+        '''Supplies a prebuilt BVH for a mesh'''
+        self._bvhs[mesh] = (nodes, tri_order)
@@ -0,0 +1,330 @@
+import numpy
+
+
+LIST_END = 0xFFFFFFFF
+# Upper bound per axis of the scene level grid
+MAX_SCENE_RESOLUTION = 32
+
+# How triangles are assigned to cells: every cell of their bounding box, or
+# only the cells they actually overlap by the separating axis test
+OVERLAP_MODES = ("aabb", "sat")
+# Cells are grown by this many voxels in the overlap test so triangles on a
+# cell boundary are kept in both cells, as in comp_voxelize.glsl
+OVERLAP_EPSILON = 1e-4
+
+
+def voxel_triangles(positions, indices, aabb, dimensions, resolution):
+    '''Returns the (T, 3, 3) corners of every triangle in voxel units'''
+    positions = numpy.asarray(positions, numpy.float32).reshape(-1, 3)
+    triangles = numpy.asarray(indices).reshape(-1, 3)
+    res = numpy.asarray(resolution, numpy.float32)
+    origin = numpy.asarray(aabb[0], numpy.float32)
+    size = numpy.asarray(dimensions, numpy.float32)
+    return res * (positions[triangles] - origin) / size
+
+
+def voxel_ranges(verts):
+    bb_min = numpy.floor(verts.min(axis=1)).astype(numpy.int64)
+    bb_max = numpy.ceil(verts.max(axis=1)).astype(numpy.int64)
+    return bb_min, bb_max
+
+
+def triangle_bounds(positions, indices, aabb, dimensions, resolution):
+    '''Returns the [min, max) voxel ranges of every triangle as two (T, 3)
+    int arrays, computed the same way as comp_voxelize.glsl'''
+    return voxel_ranges(voxel_triangles(positions, indices, aabb, dimensions, resolution))
+
+
+def triangle_box_overlap(verts, centers, half_size=0.5 + OVERLAP_EPSILON):
+    '''Separating axis test of (N, 3, 3) triangles against the N cubes
+    around centers (Akenine-Moller). Returns a boolean mask.'''
+    verts = verts - centers[:, None, :]
+    v0, v1, v2 = verts[:, 0], verts[:, 1], verts[:, 2]
+    overlap = numpy.all((verts.min(axis=1) <= half_size) & (verts.max(axis=1) >= -half_size), axis=1)
+
+    def separates(axis):
+        p0 = numpy.einsum("ij,ij->i", v0, axis)
+        p1 = numpy.einsum("ij,ij->i", v1, axis)
+        p2 = numpy.einsum("ij,ij->i", v2, axis)
+        radius = half_size * numpy.abs(axis).sum(axis=1)
+        return (numpy.minimum(numpy.minimum(p0, p1), p2) > radius) | \
+            (numpy.maximum(numpy.maximum(p0, p1), p2) < -radius)
+
+    edges = (v1 - v0, v2 - v1, v0 - v2)
+    for edge in edges:
+        for unit in numpy.eye(3, dtype=verts.dtype):
+            overlap &= ~separates(numpy.cross(edge, unit))
+
+    normal = numpy.cross(edges[0], edges[1])
+    distance = numpy.abs(numpy.einsum("ij,ij->i", normal, v0))
+    overlap &= distance <= half_size * numpy.abs(normal).sum(axis=1)
+    return overlap
+
+
+def reference_count(bb_min, bb_max):
+    '''Number of links the voxelizer appends for the given ranges, including
+    the ones for cells outside the grid'''
+    return int(numpy.maximum(bb_max - bb_min, 0).prod(axis=1).sum())
+
+
+def box_bounds(aabbs, aabb, dimensions, resolution):
+    '''Voxel ranges of whole boxes as computed in comp_voxelize_scene.glsl'''
+    res = numpy.asarray(resolution, numpy.float32)
+    origin = numpy.asarray(aabb[0], numpy.float32)
+    size = numpy.asarray(dimensions, numpy.float32)
+    aabbs = numpy.asarray(aabbs, numpy.float32).reshape(-1, 2, 3)
+
+    bb_min = numpy.floor(res * (aabbs[:, 0] - origin) / size).astype(numpy.int64)
+    bb_max = numpy.ceil(res * (aabbs[:, 1] - origin) / size).astype(numpy.int64)
+    return bb_min, bb_max
+
+
+def scene_bounds(aabbs):
+    '''Box around all mesh boxes, padded by 5% of its size on each side'''
+    aabbs = numpy.asarray(aabbs, numpy.float32).reshape(-1, 2, 3)
+    if not len(aabbs):
+        return numpy.zeros((2, 3), numpy.float32)
+
+    lower = aabbs[:, 0].min(axis=0)
+    upper = aabbs[:, 1].max(axis=0)
+    # Keep flat scenes from producing a zero sized grid
+    pad = numpy.maximum((upper - lower) * 0.05, 1e-3)
+    return numpy.array([lower - pad, upper + pad], numpy.float32)
+
+
+def scene_resolution(count, aabb):
+    '''Picks a grid with roughly one cell per mesh shaped like the scene
+    box, the same density heuristic MeshData uses for triangles'''
+    size = numpy.subtract(aabb[1], aabb[0]).astype(numpy.float64)
+    if count == 0:
+        return (1, 1, 1)
+    factor = (count / numpy.prod(size)) ** (1 / 3)
+    resolution = numpy.clip(numpy.ceil(size * factor), 1, MAX_SCENE_RESOLUTION)
+    return tuple(resolution.astype(int).tolist())
+
+
+def _new_grid(resolution):
+    return numpy.full(tuple(resolution), LIST_END, numpy.uint32)
+
+
+def voxelize_loop(positions, indices, aabb, dimensions, resolution, overlap="aabb"):
+    '''Straight port of comp_voxelize.glsl run one triangle after another.
+    Returns the head pointer grid indexed [x, y, z] and the (tri_id, next)
+    link list. Slot 0 of the list is never used, as on the GPU.'''
+    verts = voxel_triangles(positions, indices, aabb, dimensions, resolution)
+    bb_min, bb_max = voxel_ranges(verts)
+    voxels = _new_grid(resolution)
+    links = [(0, 0)]
+
+    for tri_id in range(len(bb_min)):
+        for z in range(bb_min[tri_id][2], bb_max[tri_id][2]):
+            for y in range(bb_min[tri_id][1], bb_max[tri_id][1]):
+                for x in range(bb_min[tri_id][0], bb_max[tri_id][0]):
+                    if overlap == "sat":
+                        center = numpy.array([[x, y, z]], numpy.float32) + 0.5
+                        if not triangle_box_overlap(verts[tri_id:tri_id + 1], center)[0]:
+                            continue
+                    end = len(links)
+                    # Out of range image accesses are dropped and return 0
+                    old_ptr = 0
+                    if 0 <= x < resolution[0] and 0 <= y < resolution[1] and 0 <= z < resolution[2]:
+                        old_ptr = voxels[x, y, z]
+                        voxels[x, y, z] = end
+                    links.append((tri_id, old_ptr))
+
+    return voxels, numpy.array(links, numpy.uint32)
+
+
+def cell_references(bb_min, bb_max, verts=None):
+    '''Expands triangle ranges into one (tri_id, x, y, z) row per referenced
+    cell in the order comp_voxelize.glsl visits them. With verts, cells the
+    triangle does not overlap are left out.'''
+    extent = numpy.maximum(bb_max - bb_min, 0)
+    counts = extent.prod(axis=1)
+    total = int(counts.sum())
+
+    tri_ids = numpy.repeat(numpy.arange(len(counts)), counts)
+    local = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    ext = extent[tri_ids]
+
+    coords = numpy.empty((total, 3), numpy.int64)
+    coords[:, 0] = local % ext[:, 0]
+    coords[:, 1] = (local // ext[:, 0]) % ext[:, 1]
+    coords[:, 2] = local // (ext[:, 0] * ext[:, 1])
+    coords += bb_min[tri_ids]
+
+    if verts is not None:
+        keep = triangle_box_overlap(verts[tri_ids], coords.astype(verts.dtype) + 0.5)
+        tri_ids = tri_ids[keep]
+        coords = coords[keep]
+    return tri_ids, coords
+
+
+def mesh_references(positions, indices, aabb, dimensions, resolution, overlap="aabb"):
+    '''cell_references of every triangle of a mesh for an overlap mode'''
+    if overlap not in OVERLAP_MODES:
+        raise ValueError("Unknown overlap mode: " + overlap)
+    verts = voxel_triangles(positions, indices, aabb, dimensions, resolution)
+    bb_min, bb_max = voxel_ranges(verts)
+    return cell_references(bb_min, bb_max, verts if overlap == "sat" else None)
+
+
+def voxelize(positions, indices, aabb, dimensions, resolution, overlap="aabb"):
+    '''Vectorized equivalent of voxelize_loop producing identical output'''
+    tri_ids, coords = mesh_references(positions, indices, aabb, dimensions, resolution, overlap)
+    return _link_references(tri_ids, coords, resolution)
+
+
+def voxelize_scene(aabbs):
+    '''Mirror of Voxelizer.voxelize_scene. Returns the scene box, its
+    resolution and the head pointer grid and link list of mesh ids.'''
+    aabb = scene_bounds(aabbs)
+    resolution = scene_resolution(len(aabbs), aabb)
+    dimensions = aabb[1] - aabb[0]
+    bb_min, bb_max = box_bounds(aabbs, aabb, dimensions, resolution)
+    return (aabb, resolution) + link_lists(bb_min, bb_max, resolution)
+
+
+def link_lists(bb_min, bb_max, resolution):
+    '''Builds the head pointer grid and link list that inserting every item
+    into its [bb_min, bb_max) cell range in order produces'''
+    return _link_references(*cell_references(bb_min, bb_max), resolution)
+
+
+def _link_references(tri_ids, coords, resolution):
+    voxels = _new_grid(resolution)
+
+    slots = numpy.arange(1, len(tri_ids) + 1, dtype=numpy.uint32)
+    links = numpy.zeros((len(tri_ids) + 1, 2), numpy.uint32)
+    links[1:, 0] = tri_ids
+
+    inside = numpy.all((coords >= 0) & (coords < numpy.asarray(resolution)), axis=1)
+    cells = numpy.ravel_multi_index(coords[inside].T, tuple(resolution))
+    slots = slots[inside]
+
+    # Within a cell each insertion points at the one before it
+    order = numpy.argsort(cells, kind="stable")
+    cells = cells[order]
+    slots = slots[order]
+    first = numpy.ones(len(cells), bool)
+    first[1:] = cells[1:] != cells[:-1]
+    next_ptr = numpy.empty(len(slots), numpy.uint32)
+    next_ptr[first] = LIST_END
+    next_ptr[~first] = slots[:-1][~first[1:]]
+    links[slots, 1] = next_ptr
+
+    last = numpy.ones(len(cells), bool)
+    last[:-1] = first[1:]
+    voxels.flat[cells[last]] = slots[last]
+
+    return voxels, links
+
+
+def to_csr(voxels, links):
+    '''Converts a head pointer grid and link list into per-cell offsets and a
+    cell-sorted array of triangle ids. Cells use the C order of voxels.'''
+    lengths = list_lengths(voxels, links).ravel()
+    offsets = numpy.zeros(lengths.size + 1, numpy.uint32)
+    numpy.cumsum(lengths, out=offsets[1:])
+
+    # Walk all lists together, one link per cell and step
+    tri_ids = numpy.empty(int(offsets[-1]), numpy.uint32)
+    ptrs = numpy.array(voxels, numpy.uint32).ravel()
+    active = numpy.flatnonzero(ptrs != LIST_END)
+    step = 0
+    while len(active):
+        tri_ids[offsets[active].astype(numpy.int64) + step] = links[ptrs[active], 0]
+        ptrs[active] = links[ptrs[active], 1]
+        active = active[ptrs[active] != LIST_END]
+        step += 1
+    return offsets, sort_cells(offsets, tri_ids)
+
+
+def from_csr(offsets, tri_ids, resolution):
+    '''Converts the compact layout back into a head pointer grid and link
+    list, inserting each cell's triangles in ascending order'''
+    lengths = numpy.diff(numpy.asarray(offsets, numpy.int64))
+    cells = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    coords = numpy.array(numpy.unravel_index(cells, tuple(resolution))).T
+    return _link_references(numpy.asarray(tri_ids), coords.reshape(-1, 3), resolution)
+
+
+def sort_cells(offsets, tri_ids):
+    '''Sorts the triangle ids within every cell, since GPU builds fill
+    cells in no particular order'''
+    lengths = numpy.diff(numpy.asarray(offsets, numpy.int64))
+    cells = numpy.repeat(numpy.arange(len(lengths)), lengths)
+    return numpy.asarray(tri_ids, numpy.uint32)[numpy.lexsort((tri_ids, cells))]
+
+
+def validate_csr(offsets, tri_ids, voxels, links):
+    '''Raises ValueError unless the compact layout and the link lists hold
+    the same triangles in every cell'''
+    expected_offsets, expected_ids = to_csr(voxels, links)
+    offsets = numpy.asarray(offsets, numpy.uint32)
+    if offsets.shape != expected_offsets.shape:
+        raise ValueError("Expected %d offsets, got %d" % (len(expected_offsets), len(offsets)))
+
+    bad = numpy.flatnonzero(offsets != expected_offsets)
+    if len(bad):
+        raise ValueError("Offset %d is %d instead of %d" % (
+            bad[0], offsets[bad[0]], expected_offsets[bad[0]]))
+
+    tri_ids = sort_cells(offsets, numpy.asarray(tri_ids)[:int(offsets[-1])])
+    bad = numpy.flatnonzero(tri_ids != expected_ids)
+    if len(bad):
+        cell = numpy.searchsorted(offsets, bad[0], side="right") - 1
+        raise ValueError("Cell %d holds triangle %d instead of %d" % (
+            cell, tri_ids[bad[0]], expected_ids[bad[0]]))
+
+
+def voxelize_csr(positions, indices, aabb, dimensions, resolution, overlap="aabb"):
+    '''Builds the compact layout directly: offsets has one entry per cell plus
+    one, and the triangle ids of each cell are sorted ascending'''
+    tri_ids, coords = mesh_references(positions, indices, aabb, dimensions, resolution, overlap)
+
+    inside = numpy.all((coords >= 0) & (coords < numpy.asarray(resolution)), axis=1)
+    cells = numpy.ravel_multi_index(coords[inside].T, tuple(resolution))
+    tri_ids = tri_ids[inside]
+
+    order = numpy.lexsort((tri_ids, cells))
+    counts = numpy.bincount(cells, minlength=int(numpy.prod(resolution)))
+    offsets = numpy.zeros(len(counts) + 1, numpy.uint32)
+    numpy.cumsum(counts, out=offsets[1:])
+    return offsets, tri_ids[order].astype(numpy.uint32)
+
+
+def voxelize_mesh(mesh, csr=False, overlap="aabb"):
+    args = (mesh.buf_positions, mesh.buf_indices, mesh.aabb, mesh.dimensions,
+            mesh.voxel_resolution, overlap)
+    if csr:
+        return voxelize_csr(*args)
+    return voxelize(*args)
+
+
+def list_lengths(voxels, links):
+    '''Walks every cell's link list at once and returns the list lengths in
+    the shape of voxels'''
+    ptrs = numpy.array(voxels, numpy.uint32).ravel()
+    lengths = numpy.zeros(ptrs.size, numpy.int64)
+    active = numpy.flatnonzero(ptrs != LIST_END)
+    while len(active):
+        lengths[active] += 1
+        ptrs[active] = links[ptrs[active], 1]
+        active = active[ptrs[active] != LIST_END]
+    return lengths.reshape(numpy.shape(voxels))
+
+
+def list_stats(lengths):
+    '''Summarizes per-cell list lengths, from list_lengths or the
+    differences of CSR offsets'''
+    lengths = numpy.asarray(lengths).ravel()
+    occupied = lengths[lengths > 0]
+    return {
+        "references": int(lengths.sum()),
+        "cells": int(lengths.size),
+        "occupied": int(occupied.size),
+        "mean": float(lengths.mean()) if lengths.size else 0.0,
+        "mean_occupied": float(occupied.mean()) if occupied.size else 0.0,
+        "max": int(lengths.max()) if lengths.size else 0,
+    }
@@ -0,0 +1,51 @@
+import math
+
+import numpy
+
+
+# Must match local_size_x in the batched compute shaders
+LOCAL_SIZE = 64
+# Smallest GL_MAX_COMPUTE_WORK_GROUP_COUNT the GL spec allows per dimension
+MAX_GROUPS = 65535
+
+
+def plan_dispatch(invocations, local_size=LOCAL_SIZE, max_groups=MAX_GROUPS):
+    '''Returns the (x, y, z) work group counts for a 1D range of invocations.
+    Ranges too large for one dimension are tiled over x and y; shaders
+    rebuild the linear index as (group.y * groups.x + group.x) * local_size
+    + local id and drop indices past the end.'''
+    groups = math.ceil(invocations / local_size)
+    if groups <= max_groups:
+        return (groups, 1, 1)
+
+    rows = math.ceil(groups / max_groups)
+    if rows > max_groups:
+        raise ValueError("Too many invocations for one dispatch: %d" % invocations)
+    return (math.ceil(groups / rows), rows, 1)
+
+
+def plan_batch(meshes):
+    '''Lays the triangles and voxel cells of several meshes out as two
+    contiguous ranges. Returns a (len(meshes), 2) uint32 array of the first
+    triangle and first cell of every mesh, and the triangle and cell totals.'''
+    tris = numpy.array([mesh.count for mesh in meshes], numpy.int64)
+    cells = numpy.array([int(numpy.prod(mesh.voxel_resolution)) for mesh in meshes], numpy.int64)
+
+    jobs = numpy.zeros((len(meshes), 2), numpy.uint32)
+    jobs[:, 0] = numpy.cumsum(tris) - tris
+    jobs[:, 1] = numpy.cumsum(cells) - cells
+    return jobs, int(tris.sum()), int(cells.sum())
+
+
+def find_job(starts, index):
+    '''The job an index of a batched range belongs to, by the same binary
+    search the shaders use'''
+    low = 0
+    high = len(starts) - 1
+    while low < high:
+        mid = (low + high + 1) // 2
+        if starts[mid] <= index:
+            low = mid
+        else:
+            high = mid - 1
+    return low
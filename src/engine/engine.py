@@ -9,6 +9,8 @@ import sys
 path = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(path)
 
+import numpy
+
 import OpenGL
 OpenGL.ERROR_CHECKING = False
 from OpenGL.GL import *
@@ -16,77 +18,37 @@ from OpenGL.GL import shaders
 from OpenGL.GL.ARB.bindless_texture import *
 
 from .shaders import Shader
+from . import bvh
+from . import cpu_voxelizer
+from .cpu_tracer import CpuTracer
 from .gpu_types import *
-from .voxelizer import Voxelizer
+from .instance import Instance
+from .mesh_cache import MeshCache
+from .mesh_data import MeshData, voxel_bytes, voxel_list_shape
+from .profiler import Profiler
+from .voxelizer import (
+    VOXEL_LAYOUTS, Voxelizer, create_voxel_buffer, create_voxel_grid, create_voxel_list,
+    delete_voxel_buffer, delete_voxel_texture,
+)
 from .vertex_buffer import VertexBuffer
 
 
-class Node:
-    def __init__(self, model_matrix):
-        self.model_matrix = model_matrix
-        self.meshes = []
-
-
-class Mesh:
-    def __init__(self, vert_count, element_count, positions, normals, indices):
-        self.buf_positions = positions
-        self.buf_normals = normals
-        self.buf_indices = indices
-        self.vert_count = vert_count
+class Mesh(MeshData):
+    def __init__(self, positions, normals, indices, voxel_layout="lists", acceleration="grid"):
+        MeshData.__init__(self, positions, normals, indices)
 
         self.is_dirty = True
-
-        self.aabb = [
-            [0, 0, 0],
-            [0, 0, 0]
-        ]
-
-        self.aabb[0][0] = min(positions, key=lambda p: p.x).x * 1.001
-        self.aabb[0][1] = min(positions, key=lambda p: p.y).y * 1.001
-        self.aabb[0][2] = min(positions, key=lambda p: p.z).z * 1.001
-        self.aabb[1][0] = max(positions, key=lambda p: p.x).x * 1.001
-        self.aabb[1][1] = max(positions, key=lambda p: p.y).y * 1.001
-        self.aabb[1][2] = max(positions, key=lambda p: p.z).z * 1.001
-
-        self.dimensions = (
-            self.aabb[1][0] - self.aabb[0][0],
-            self.aabb[1][1] - self.aabb[0][1],
-            self.aabb[1][2] - self.aabb[0][2]
-        )
-
-        self.element_count = element_count
-        self.count = element_count // 3
-
-        # Voxels
-        res_factor = self.count / (self.dimensions[0] * self.dimensions[1] * self.dimensions[2])
-        res_factor = res_factor ** (1/3)
-        self.voxel_resolution = (
-            math.ceil(self.dimensions[0] * res_factor),
-            math.ceil(self.dimensions[1] * res_factor),
-            math.ceil(self.dimensions[2] * res_factor),
-        )
-        self.tex_voxel_data, self.tex_voxel_list = glGenTextures(2)
-
-        glBindTexture(GL_TEXTURE_3D, self.tex_voxel_data)
-        glTexImage3D(GL_TEXTURE_3D, 0, GL_R32UI,
-                    self.voxel_resolution[0], self.voxel_resolution[1],
-                    self.voxel_resolution[2], 0, GL_RED_INTEGER, GL_UNSIGNED_INT,
-                    None)
-        glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        self.hnd_voxel_data = glGetImageHandleARB(self.tex_voxel_data, 0,
-                                                GL_FALSE, 0, GL_R32UI)
-        glMakeImageHandleResidentARB(self.hnd_voxel_data, GL_READ_WRITE)
-
-        glBindTexture(GL_TEXTURE_2D, self.tex_voxel_list)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RG32UI, 1024, 1024, 0, GL_RG_INTEGER,
-                        GL_UNSIGNED_INT, None)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glBindTexture(GL_TEXTURE_2D, 0)
-        self.hnd_voxel_list = glGetImageHandleARB(self.tex_voxel_list, 0,
-                                                GL_FALSE, 0, GL_RG32UI)
-        glMakeImageHandleResidentARB(self.hnd_voxel_list, GL_READ_WRITE)
+        self.is_deleted = False
+        self.bvh = None
+        self.voxel_layout = voxel_layout
+        self.tex_voxel_data, self.hnd_voxel_data = 0, 0
+        self.hnd_voxel_offsets = 0
+        if voxel_layout == "csr":
+            cells = int(numpy.prod(self.voxel_resolution))
+            self.vbo_voxel_offsets, self.tbo_voxel_offsets, self.hnd_voxel_offsets = \
+                create_voxel_buffer(cells + 1)
+        else:
+            self.tex_voxel_data, self.hnd_voxel_data = create_voxel_grid(self.voxel_resolution)
 
         # Vertex Data
         self.vao = glGenVertexArrays(1)
@@ -95,19 +57,19 @@ class Mesh:
         self.vbo_positions, self.vbo_normals, self.vbo_indices = glGenBuffers(3)
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo_positions)
-        glBufferData(GL_ARRAY_BUFFER, ctypes.sizeof(self.buf_positions),
+        glBufferData(GL_ARRAY_BUFFER, self.buf_positions.nbytes,
             self.buf_positions, GL_STATIC_DRAW)
         glEnableClientState(GL_VERTEX_ARRAY)
         glVertexPointer(3, GL_FLOAT, 0, ctypes.c_void_p(0))
 
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo_normals)
-        glBufferData(GL_ARRAY_BUFFER, ctypes.sizeof(self.buf_normals),
+        glBufferData(GL_ARRAY_BUFFER, self.buf_normals.nbytes,
             self.buf_normals, GL_STATIC_DRAW)
         glEnableClientState(GL_NORMAL_ARRAY)
         glNormalPointer(GL_FLOAT, 0, ctypes.c_void_p(0))
 
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.vbo_indices)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, ctypes.sizeof(self.buf_indices),
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.buf_indices.nbytes,
             self.buf_indices, GL_STATIC_DRAW)
 
         glBindVertexArray(0)
@@ -125,7 +87,8 @@ class Mesh:
         glMakeTextureHandleResidentARB(self.hnd_normals)
 
         glBindTexture(GL_TEXTURE_BUFFER, self.tbo_indices)
-        glTexBuffer(GL_TEXTURE_BUFFER, GL_R16UI, self.vbo_indices)
+        index_format = GL_R32UI if self.buf_indices.itemsize == 4 else GL_R16UI
+        glTexBuffer(GL_TEXTURE_BUFFER, index_format, self.vbo_indices)
         self.hnd_indices = glGetTextureHandleARB(self.tbo_indices)
         glMakeTextureHandleResidentARB(self.hnd_indices)
 
@@ -141,41 +104,204 @@ class Mesh:
         self.gpu_data.aabb[0] = VEC4(*self.aabb[0])
         self.gpu_data.aabb[1] = VEC4(*self.aabb[1])
         self.gpu_data.voxel_data = self.hnd_voxel_data
-        self.gpu_data.voxel_list = self.hnd_voxel_list
         self.gpu_data.tri_buffer = self.hnd_indices
         self.gpu_data.vert_buffer = self.hnd_positions
         self.gpu_data.norm_buffer = self.hnd_normals
+        self.gpu_data.bvh_nodes = 0
+        self.gpu_data.bvh_tris = 0
+        self.gpu_data.voxel_offsets = self.hnd_voxel_offsets
+        self.gpu_data.voxel_tris = 0
         self.gpu_data.vert_offset = 0
         self.gpu_data.element_offset = 0
 
-    def update_voxels(self):
-        if self.is_dirty:
-            Voxelizer.voxelize_mesh(self)
-            self.is_dirty = False
+        # Size the link list from a CPU count until the voxelizer's own
+        # counting pass runs. BVH meshes are never voxelized.
+        self.tex_voxel_list = 0
+        self.vbo_voxel_tris = 0
+        self.voxel_list_shape = (0, 0)
+        self.voxel_list_used = 0
+        if acceleration == "grid":
+            self.voxel_list_used = cpu_voxelizer.reference_count(*cpu_voxelizer.triangle_bounds(
+                self.buf_positions, self.buf_indices, self.aabb, self.dimensions,
+                self.voxel_resolution))
+            self.resize_voxel_list(self.voxel_list_used)
+
+    @property
+    def voxel_list_capacity(self):
+        return self.voxel_list_shape[0] * self.voxel_list_shape[1]
+
+    def resize_voxel_list(self, entries):
+        '''Returns whether the list was reallocated'''
+        shape = voxel_list_shape(entries)
+        if shape == self.voxel_list_shape:
+            return False
+
+        if self.voxel_layout == "csr":
+            # Same capacity buckets, but one triangle id per entry
+            if self.vbo_voxel_tris:
+                delete_voxel_buffer(self.vbo_voxel_tris, self.tbo_voxel_tris, self.hnd_voxel_tris)
+            self.vbo_voxel_tris, self.tbo_voxel_tris, self.hnd_voxel_tris = \
+                create_voxel_buffer(shape[0] * shape[1])
+            self.voxel_list_shape = shape
+            self.gpu_data.voxel_tris = self.hnd_voxel_tris
+            self.is_dirty = True
+            return True
+
+        if self.tex_voxel_list:
+            delete_voxel_texture(self.tex_voxel_list, self.hnd_voxel_list)
+        self.tex_voxel_list, self.hnd_voxel_list = create_voxel_list(*shape)
+        self.voxel_list_shape = shape
+        self.gpu_data.voxel_list = self.hnd_voxel_list
+        self.is_dirty = True
+        return True
+
+    def clear_voxel_offsets(self):
+        glBindBuffer(GL_TEXTURE_BUFFER, self.vbo_voxel_offsets)
+        glClearBufferData(GL_TEXTURE_BUFFER, GL_R32UI, GL_RED_INTEGER, GL_UNSIGNED_INT, None)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    @property
+    def voxel_bytes(self):
+        '''GPU memory of the grid or offsets and of the lists'''
+        return voxel_bytes(self.voxel_resolution, self.voxel_list_capacity, self.voxel_layout)
+
+    def gpu_size(self):
+        cells = int(numpy.prod(self.voxel_resolution))
+        return MeshData.gpu_size(self) - cells * 4 + self.voxel_bytes
+
+    def update_bvh(self):
+        '''Builds and uploads the BVH once and returns whether it did'''
+        if self.bvh is not None:
+            return False
+
+        self.bvh = bvh.build_mesh_bvh(self)
+        nodes, tri_order = self.bvh
+
+        self.vbo_bvh_nodes, self.vbo_bvh_tris = glGenBuffers(2)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.vbo_bvh_nodes)
+        glBufferData(GL_TEXTURE_BUFFER, nodes.nbytes, nodes.view(numpy.uint32),
+            GL_STATIC_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.vbo_bvh_tris)
+        glBufferData(GL_TEXTURE_BUFFER, tri_order.nbytes, tri_order, GL_STATIC_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+        # Each BVH_NODE is read as two RGBA32F texels
+        self.tbo_bvh_nodes, self.tbo_bvh_tris = glGenTextures(2)
+
+        glBindTexture(GL_TEXTURE_BUFFER, self.tbo_bvh_nodes)
+        glTexBuffer(GL_TEXTURE_BUFFER, GL_RGBA32F, self.vbo_bvh_nodes)
+        self.hnd_bvh_nodes = glGetTextureHandleARB(self.tbo_bvh_nodes)
+        glMakeTextureHandleResidentARB(self.hnd_bvh_nodes)
+
+        glBindTexture(GL_TEXTURE_BUFFER, self.tbo_bvh_tris)
+        glTexBuffer(GL_TEXTURE_BUFFER, GL_R32UI, self.vbo_bvh_tris)
+        self.hnd_bvh_tris = glGetTextureHandleARB(self.tbo_bvh_tris)
+        glMakeTextureHandleResidentARB(self.hnd_bvh_tris)
+
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+        self.gpu_data.bvh_nodes = self.hnd_bvh_nodes
+        self.gpu_data.bvh_tris = self.hnd_bvh_tris
+        return True
+
+    def delete(self):
+        '''Frees the GL resources now instead of whenever the mesh happens to
+        be collected'''
+        if self.is_deleted:
+            return
+        self.is_deleted = True
 
-    def __del__(self):
         print("Delete mesh")
+        for handle in (self.hnd_positions, self.hnd_normals, self.hnd_indices):
+            glMakeTextureHandleNonResidentARB(handle)
+        glDeleteTextures([self.tbo_positions, self.tbo_normals, self.tbo_indices])
         glDeleteBuffers((
             self.vbo_positions,
             self.vbo_normals,
             self.vbo_indices,
         ))
+        glDeleteVertexArrays(1, [self.vao])
+        if self.bvh is not None:
+            for handle in (self.hnd_bvh_nodes, self.hnd_bvh_tris):
+                glMakeTextureHandleNonResidentARB(handle)
+            glDeleteTextures([self.tbo_bvh_nodes, self.tbo_bvh_tris])
+            glDeleteBuffers((self.vbo_bvh_nodes, self.vbo_bvh_tris))
+        if self.voxel_layout == "csr":
+            delete_voxel_buffer(self.vbo_voxel_offsets, self.tbo_voxel_offsets, self.hnd_voxel_offsets)
+            if self.vbo_voxel_tris:
+                delete_voxel_buffer(self.vbo_voxel_tris, self.tbo_voxel_tris, self.hnd_voxel_tris)
+        else:
+            delete_voxel_texture(self.tex_voxel_data, self.hnd_voxel_data)
+            if self.tex_voxel_list:
+                delete_voxel_texture(self.tex_voxel_list, self.hnd_voxel_list)
+
+    def __del__(self):
+        self.delete()
 
 
 def _mat_to_gl(matrix):
     return [i for col in matrix.col for i in col]
 
 
+def _gpu_instance(instance, mesh_index):
+    data = GPU_INSTANCE()
+    # mat4 members are column major
+    data.world_to_object[:] = instance.inverse.T.ravel().tolist()
+    data.object_to_world[:] = instance.matrix.T.ravel().tolist()
+    data.aabb[0] = VEC4(*instance.aabb[0])
+    data.aabb[1] = VEC4(*instance.aabb[1])
+    data.mesh_index = mesh_index
+    return data
+
+
 class Engine:
-    def __init__(self):
+    def __init__(self, acceleration="grid", profiler=None, overlap="aabb", voxel_layout="lists",
+                 primary="trace"):
+        '''acceleration selects the per-mesh structure traced by fsq.frag,
+        either "grid" (uniform voxel grids) or "bvh". overlap picks how grids
+        assign triangles to cells, see cpu_voxelizer.OVERLAP_MODES, and
+        voxel_layout how they store them, see voxelizer.VOXEL_LAYOUTS.
+        primary is "trace" to trace every pixel, or "raster" to rasterize
+        first hits into a visibility buffer and only trace pixels it
+        leaves empty.'''
+        if primary not in ("trace", "raster"):
+            raise ValueError("Unknown primary visibility mode: " + primary)
+        if acceleration not in ("grid", "bvh"):
+            raise ValueError("Unknown acceleration structure: " + acceleration)
+        if overlap not in cpu_voxelizer.OVERLAP_MODES:
+            raise ValueError("Unknown overlap mode: " + overlap)
+        if voxel_layout not in VOXEL_LAYOUTS:
+            raise ValueError("Unknown voxel layout: " + voxel_layout)
+        self.acceleration = acceleration
+        self.overlap = overlap
+        self.voxel_layout = voxel_layout
+        self.primary = primary
+        self.profiler = profiler if profiler is not None else Profiler(gpu=True)
         self.mesh_buffer = glGenBuffers(1)
+        self.instance_buffer = glGenBuffers(1)
         self.vertex_buffer = VertexBuffer()
 
         self.draw_width = 1
         self.draw_height = 1
+        self._ray_hit_capacity = 0
 
         self._objects = {}
         self._meshes = {}
+        self._instances = {}
+        self._scene_dirty = True
+        # Instances whose matrix alone changed since the last draw; they are
+        # rewritten in place unless the scene is dirty anyway
+        self._moved_instances = set()
+        # Unique meshes in mesh buffer order and instances in instance
+        # buffer order, refreshed whenever the scene is dirty
+        self._scene_meshes = []
+        self._instance_order = []
+        self._mesh_slots = {}
+        self._instance_slots = {}
+        # (mesh, first instance, instance count, winding) per raster draw
+        self._raster_batches = []
+        self.mesh_cache = MeshCache()
+        self.cpu_tracer = CpuTracer(acceleration, overlap)
 
         Voxelizer.init()
 
@@ -183,31 +309,203 @@ class Engine:
         self._shader_fsq = Shader("fsq.vert", "fsq.frag")
         self.ray_hit_buffer = glGenBuffers(1)
 
+        # Visibility buffer, grown like the ray hit buffer
+        self._shader_raster = None
+        self._visibility_size = (0, 0)
+        if primary == "raster":
+            self._shader_raster = Shader("raster.vert", "raster.frag")
+            self.visibility_fbo = glGenFramebuffers(1)
+            self.tex_visibility_hits, self.tex_visibility_instances = glGenTextures(2)
+            self.visibility_depth = glGenRenderbuffers(1)
+
     def __del__(self):
         glDeleteTextures([self._scene_texid])
         glDeleteBuffers(2, [self._scene_tri_buffer, self._scene_vert_buffer])
 
     def resize(self, width, height):
+        '''The ray hit buffer only grows, so adaptive resolution can change
+        the draw size every frame without reallocating it'''
         self.draw_width = width
         self.draw_height = height
+        if self.primary == "raster":
+            self._resize_visibility(width, height)
+        if width * height <= self._ray_hit_capacity:
+            return
 
+        self._ray_hit_capacity = width * height
         glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.ray_hit_buffer)
         glBufferData(GL_SHADER_STORAGE_BUFFER, width*height*ctypes.sizeof(RAY_HIT),
             None, GL_STREAM_DRAW)
 
         print("Resizing to {} x {}".format(width, height))
 
+    def _resize_visibility(self, width, height):
+        width = max(width, self._visibility_size[0])
+        height = max(height, self._visibility_size[1])
+        if (width, height) == self._visibility_size:
+            return
+        self._visibility_size = (width, height)
+
+        for texture, internal_format, pixel_format in (
+                (self.tex_visibility_hits, GL_RGBA32UI, GL_RGBA_INTEGER),
+                (self.tex_visibility_instances, GL_R32UI, GL_RED_INTEGER)):
+            glBindTexture(GL_TEXTURE_2D, texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, internal_format, width, height, 0, pixel_format,
+                GL_UNSIGNED_INT, None)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.visibility_depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT32F, width, height)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        previous_fbo = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.visibility_fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D,
+            self.tex_visibility_hits, 0)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT1, GL_TEXTURE_2D,
+            self.tex_visibility_instances, 0)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER,
+            self.visibility_depth)
+        glDrawBuffers(2, [GL_COLOR_ATTACHMENT0, GL_COLOR_ATTACHMENT1])
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_fbo)
+
+    def get_mesh(self, positions, normals, indices):
+        '''Returns the cached mesh with identical contents or builds one'''
+        key = MeshCache.key(positions, normals, indices)
+        mesh = self.mesh_cache.get(key)
+        if mesh is None:
+            mesh = Mesh(positions, normals, indices, self.voxel_layout, self.acceleration)
+            self.mesh_cache.put(key, mesh, self._meshes.values())
+        return mesh
+
     def add_or_update_mesh(self, name, mesh):
+        old_mesh = self._meshes.get(name)
+        if old_mesh is mesh:
+            return
+
         self._meshes[name] = mesh
+        self._scene_dirty = True
+        if old_mesh is not None and all(m is not old_mesh for m in self._meshes.values()):
+            self.vertex_buffer.remove_mesh(old_mesh)
         self.vertex_buffer.add_mesh(mesh)
+        for instance in self._instances.values():
+            if instance.mesh_name == name:
+                instance.set_mesh(mesh)
+
+    def remove_mesh(self, name):
+        '''Removes the mesh and the instances placing it. Once no other name
+        refers to it, its GPU resources and VertexBuffer range are freed.'''
+        mesh = self._meshes.pop(name, None)
+        if mesh is None:
+            return
+
+        for instance_name, instance in list(self._instances.items()):
+            if instance.mesh_name == name:
+                del self._instances[instance_name]
+        self._scene_dirty = True
+        if all(m is not mesh for m in self._meshes.values()):
+            self.vertex_buffer.remove_mesh(mesh)
+            self.mesh_cache.discard(mesh)
+            mesh.delete()
+
+    def add_or_update_instance(self, name, mesh_name, matrix=None):
+        '''Places the mesh added as mesh_name with a 4x4 object to world
+        matrix, the identity if None. Instances share their mesh's geometry,
+        voxel grid and BVH.'''
+        instance = self._instances.get(name)
+        if instance is not None and instance.mesh_name == mesh_name:
+            self.set_instance_matrix(name, numpy.identity(4) if matrix is None else matrix)
+            return
+
+        self._instances[name] = Instance(mesh_name, self._meshes[mesh_name], matrix)
+        self._scene_dirty = True
+
+    def set_instance_matrix(self, name, matrix):
+        '''Moves an instance. Only its instance buffer entry and the scene
+        grid are updated; its mesh is left untouched.'''
+        instance = self._instances[name]
+        winding = instance.winding
+        instance.set_matrix(matrix)
+        if instance.winding != winding:
+            # Regroups the raster pass' draws
+            self._scene_dirty = True
+        else:
+            self._moved_instances.add(instance)
+
+    def remove_instance(self, name):
+        if self._instances.pop(name, None) is not None:
+            self._scene_dirty = True
+
+    def _scene_layout(self):
+        '''Returns the meshes used by instances, each once, and the instances
+        grouped by mesh and then by winding'''
+        meshes = list({id(i.mesh): i.mesh for i in self._instances.values()}.values())
+        mesh_index = {id(mesh): index for index, mesh in enumerate(meshes)}
+        instances = sorted(self._instances.values(),
+                           key=lambda instance: (mesh_index[id(instance.mesh)], instance.winding))
+        return meshes, instances
+
+    def update_voxels(self, meshes):
+        '''Voxelizes the meshes that need it and returns whether any did'''
+        dirty = [mesh for mesh in meshes if mesh.is_dirty]
+        if not dirty:
+            return False
+
+        for mesh, used in zip(dirty, Voxelizer.voxelize_meshes(dirty, self.overlap, self.voxel_layout)):
+            mesh.voxel_list_used = used
+            mesh.is_dirty = False
+        return True
+
+    def voxel_stats(self):
+        '''Returns the (links used, link capacity) of every mesh's voxel list
+        and the bytes held by all voxel grids and lists, the scene's included'''
+        usage = {
+            name: (mesh.voxel_list_used, mesh.voxel_list_capacity)
+            for name, mesh in self._meshes.items()
+        }
+
+        total = int(numpy.prod(Voxelizer.scene_resolution)) * 4
+        total += Voxelizer.scene_list_shape[0] * Voxelizer.scene_list_shape[1] * 8
+        for mesh in {id(m): m for m in self._meshes.values()}.values():
+            total += mesh.voxel_bytes
+        return usage, total
+
+    def list_stats(self):
+        '''Per mesh cpu_voxelizer.list_stats of the voxelized grids, read back
+        from the GPU'''
+        stats = {}
+        for name, mesh in self._meshes.items():
+            if mesh.is_dirty:
+                continue
+            if self.voxel_layout == "csr":
+                lengths = numpy.diff(Voxelizer.read_csr(mesh)[0].astype(numpy.int64))
+            else:
+                lengths = cpu_voxelizer.list_lengths(*Voxelizer.read_lists(mesh))
+            stats[name] = cpu_voxelizer.list_stats(lengths)
+        return stats
+
+    def render_cpu(self, width, height, view_mat, proj_mat):
+        '''Traces the current scene on the CPU and returns the RGB8 image and
+        RAY_HIT buffer fsq.frag would produce'''
+        instances = self._scene_layout()[1]
+        return self.cpu_tracer.render(instances, width, height, view_mat, proj_mat)
 
     def draw(self, width, height, view_mat, proj_mat):
+        profiler = self.profiler
         if self.draw_width != width or self.draw_height != height:
             self.resize(width, height)
+        # Set every frame: the client resets the viewport to the full target
+        # on viewport messages even when the render size stays the same
+        glViewport(0, 0, width, height)
 
         glClearColor(0.2, 0.2, 0.2, 1.0)
         glClear(GL_COLOR_BUFFER_BIT)
-        self.vertex_buffer.update()
+        with profiler.scope("upload", gpu=True):
+            # Meshes moved by compaction get new GPU_MESH offsets, so the
+            # mesh buffer has to be written again
+            if self.vertex_buffer.update():
+                self._scene_dirty = True
 
         glMatrixMode(GL_MODELVIEW)
         glLoadMatrixf(view_mat)
@@ -217,24 +515,118 @@ class Engine:
 
         self.vertex_buffer.bind(3, 4)
 
-        for mesh in self._meshes.values():
-            mesh.update_voxels()
-            glBindVertexArray(mesh.vao)
-            # glDrawElements(GL_TRIANGLES, mesh.count, GL_UNSIGNED_SHORT, ctypes.c_void_p(0))
-
-        mesh_count = len(self._meshes.values())
-        mesh_data = (GPU_MESH * mesh_count)(
-            *[m.gpu_data for m in self._meshes.values()]
-        )
-        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.mesh_buffer)
-        glBufferData(GL_SHADER_STORAGE_BUFFER, ctypes.sizeof(GPU_MESH) * mesh_count,
-                    mesh_data, GL_STREAM_READ)
+        # Only unique meshes are voxelized and uploaded, however many
+        # instances share them
+        if self._scene_dirty:
+            self._scene_meshes, self._instance_order = self._scene_layout()
+        meshes = self._scene_meshes
+        with profiler.scope("voxelize meshes", gpu=True):
+            if self.acceleration == "bvh":
+                if any([mesh.update_bvh() for mesh in meshes]):
+                    self._scene_dirty = True
+            elif self.update_voxels(meshes):
+                self._scene_dirty = True
+
+        if self._scene_dirty:
+            with profiler.scope("upload scene", gpu=True):
+                self._upload_scene()
+        elif self._moved_instances:
+            with profiler.scope("upload instances", gpu=True):
+                self._upload_instances(self._moved_instances)
 
         glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 0, self.mesh_buffer)
         glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 1, self.ray_hit_buffer)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 2, self.instance_buffer)
+
+        # The mesh and instance buffers and the scene grid persist while
+        # nothing changes
+        if self._scene_dirty or self._moved_instances:
+            with profiler.scope("voxelize scene", gpu=True):
+                Voxelizer.voxelize_scene(self._instance_order)
+            self._scene_dirty = False
+            self._moved_instances.clear()
+
+        if self.primary == "raster":
+            with profiler.scope("raster", gpu=True):
+                self._raster(view_mat, proj_mat)
+
+        with profiler.scope("trace", gpu=True):
+            self._trace(len(self._instance_order), view_mat, proj_mat)
+        profiler.end_frame()
+
+    def _upload_scene(self):
+        meshes = self._scene_meshes
+        mesh_data = (GPU_MESH * len(meshes))(*[m.gpu_data for m in meshes])
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.mesh_buffer)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, ctypes.sizeof(mesh_data), mesh_data, GL_STATIC_DRAW)
+
+        self._mesh_slots = {id(mesh): index for index, mesh in enumerate(meshes)}
+        self._instance_slots = {}
+        instance_data = (GPU_INSTANCE * len(self._instance_order))()
+        self._raster_batches = []
+        for index, instance in enumerate(self._instance_order):
+            instance_data[index] = _gpu_instance(instance, self._mesh_slots[id(instance.mesh)])
+            self._instance_slots[id(instance)] = index
+
+            batch = self._raster_batches[-1] if self._raster_batches else None
+            if batch is not None and batch[0] is instance.mesh and batch[3] == instance.winding:
+                batch[2] += 1
+            else:
+                self._raster_batches.append([instance.mesh, index, 1, instance.winding])
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.instance_buffer)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, ctypes.sizeof(instance_data), instance_data,
+            GL_STATIC_DRAW)
+
+    def _upload_instances(self, instances):
+        '''Rewrites the instance buffer entries of moved instances'''
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, self.instance_buffer)
+        for instance in instances:
+            data = _gpu_instance(instance, self._mesh_slots[id(instance.mesh)])
+            glBufferSubData(GL_SHADER_STORAGE_BUFFER,
+                self._instance_slots[id(instance)] * ctypes.sizeof(GPU_INSTANCE),
+                ctypes.sizeof(data), data)
+
+    def _raster(self, view_mat, proj_mat):
+        '''Draws every instance through the shared VertexBuffer into the
+        visibility buffer, one instanced call per mesh and winding'''
+        previous_fbo = glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.visibility_fbo)
+        glClearBufferuiv(GL_COLOR, 1, (GLuint * 4)(0, 0, 0, 0))
+        glClearBufferfv(GL_DEPTH, 0, (GLfloat * 1)(1.0))
+        glEnable(GL_DEPTH_TEST)
+        # fsq.frag culls back faces too
+        glEnable(GL_CULL_FACE)
+
+        shader = self._shader_raster
+        glUseProgram(shader.program)
+        glUniformMatrix4fv(shader.get_location("view_matrix"), 1, GL_FALSE, view_mat)
+        glUniformMatrix4fv(shader.get_location("proj_matrix"), 1, GL_FALSE, proj_mat)
+        # Inverting the column major matrices as row major ones yields their
+        # inverses' transposes, which is what GL_FALSE expects
+        glUniformMatrix4fv(shader.get_location("inv_view_matrix"), 1, GL_FALSE,
+            numpy.linalg.inv(numpy.reshape(view_mat, (4, 4))).astype(numpy.float32))
+        glUniformMatrix4fv(shader.get_location("inv_proj_matrix"), 1, GL_FALSE,
+            numpy.linalg.inv(numpy.reshape(proj_mat, (4, 4))).astype(numpy.float32))
+        glUniform2f(shader.get_location("out_size"), self.draw_width, self.draw_height)
+
+        glBindVertexArray(self.vertex_buffer.vao)
+        for mesh, first, count, winding in self._raster_batches:
+            glUniform1i(shader.get_location("first_instance"), first)
+            glUniform1i(shader.get_location("base_vertex"), mesh.gpu_data.vert_offset)
+            glUniform1i(shader.get_location("base_element"), mesh.gpu_data.element_offset)
+            # Mirrored instances wind their front faces clockwise on screen
+            glFrontFace(GL_CCW if winding > 0 else GL_CW)
+            glDrawElementsInstancedBaseVertex(GL_TRIANGLES, mesh.element_count, GL_UNSIGNED_INT,
+                ctypes.c_void_p(mesh.gpu_data.element_offset * 4), count, mesh.gpu_data.vert_offset)
+        glFrontFace(GL_CCW)
+        glBindVertexArray(0)
 
-        Voxelizer.voxelize_scene(self._meshes.values())
+        glUseProgram(0)
+        glDisable(GL_CULL_FACE)
+        glDisable(GL_DEPTH_TEST)
+        glBindFramebuffer(GL_FRAMEBUFFER, previous_fbo)
 
+    def _trace(self, instance_count, view_mat, proj_mat):
         glUseProgram(self._shader_fsq.program)
 
         loc = self._shader_fsq.get_location("out_width")
@@ -246,8 +638,25 @@ class Engine:
         loc = self._shader_fsq.get_location("proj_matrix")
         glUniformMatrix4fv(loc, 1, GL_FALSE, proj_mat)
 
-        loc = self._shader_fsq.get_location("num_meshes")
-        glUniform1i(loc, mesh_count)
+        loc = self._shader_fsq.get_location("num_instances")
+        glUniform1i(loc, instance_count)
+
+        loc = self._shader_fsq.get_location("use_bvh")
+        glUniform1i(loc, self.acceleration == "bvh")
+
+        loc = self._shader_fsq.get_location("use_csr")
+        glUniform1i(loc, self.voxel_layout == "csr")
+
+        loc = self._shader_fsq.get_location("use_visibility")
+        glUniform1i(loc, self.primary == "raster")
+        if self.primary == "raster":
+            glActiveTexture(GL_TEXTURE0)
+            glBindTexture(GL_TEXTURE_2D, self.tex_visibility_hits)
+            glUniform1i(self._shader_fsq.get_location("visibility_hits"), 0)
+            glActiveTexture(GL_TEXTURE1)
+            glBindTexture(GL_TEXTURE_2D, self.tex_visibility_instances)
+            glUniform1i(self._shader_fsq.get_location("visibility_instances"), 1)
+            glActiveTexture(GL_TEXTURE0)
 
         loc = self._shader_fsq.get_location("scene_aabb[0]")
         glUniform3f(loc, *Voxelizer.scene_aabb[0])
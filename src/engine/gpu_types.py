@@ -98,6 +98,21 @@ class RAY_HIT(ctypes.Structure):
         ("tri_id", ctypes.c_int32),
         ("u", ctypes.c_float),
         ("v", ctypes.c_float),
+        ("instance_id", ctypes.c_int32),
+    ]
+
+
+class BVH_NODE(ctypes.Structure):
+    _fields_ = [
+        ("lx", ctypes.c_float),
+        ("ly", ctypes.c_float),
+        ("lz", ctypes.c_float),
+        ("first", ctypes.c_uint32),
+
+        ("ux", ctypes.c_float),
+        ("uy", ctypes.c_float),
+        ("uz", ctypes.c_float),
+        ("count", ctypes.c_uint32),
     ]
 
 
@@ -110,6 +125,21 @@ class GPU_MESH(ctypes.Structure):
         ("tri_buffer", ctypes.c_uint64),
         ("vert_buffer", ctypes.c_uint64),
         ("norm_buffer", ctypes.c_uint64),
+        ("bvh_nodes", ctypes.c_uint64),
+        ("bvh_tris", ctypes.c_uint64),
+        ("voxel_offsets", ctypes.c_uint64),
+        ("voxel_tris", ctypes.c_uint64),
         ("vert_offset", ctypes.c_uint32),
         ("element_offset", ctypes.c_uint32),
     ]
+
+
+class GPU_INSTANCE(ctypes.Structure):
+    _fields_ = [
+        # Column major mat4s
+        ("world_to_object", ctypes.c_float * 16),
+        ("object_to_world", ctypes.c_float * 16),
+        ("aabb", (VEC4 * 2)),
+        ("mesh_index", ctypes.c_uint32),
+        ("pad", ctypes.c_uint32 * 3),
+    ]
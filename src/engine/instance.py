@@ -0,0 +1,36 @@
+import numpy
+
+
+def transform_aabb(aabb, matrix):
+    '''Box around the eight corners of aabb moved by a 4x4 matrix'''
+    lower, upper = numpy.asarray(aabb, numpy.float64)
+    corners = numpy.array([
+        (x, y, z) for x in (lower[0], upper[0])
+        for y in (lower[1], upper[1])
+        for z in (lower[2], upper[2])
+    ])
+    corners = corners @ matrix[:3, :3].T + matrix[:3, 3]
+    return [corners.min(axis=0).tolist(), corners.max(axis=0).tolist()]
+
+
+class Instance:
+    '''Places a shared mesh in the scene with a 4x4 object to world matrix
+    acting on column vectors. Rays are moved into object space instead of
+    transforming the mesh, so its vertices and voxel grid exist once no
+    matter how many instances use it.'''
+    def __init__(self, mesh_name, mesh, matrix=None):
+        self.mesh_name = mesh_name
+        self.mesh = mesh
+        self.set_matrix(numpy.identity(4) if matrix is None else matrix)
+
+    def set_matrix(self, matrix):
+        self.matrix = numpy.array(matrix, numpy.float64).reshape(4, 4)
+        self.inverse = numpy.linalg.inv(self.matrix)
+        # Mirroring transforms make front faces wind clockwise on screen,
+        # which only the raster pass has to know about
+        self.winding = 1.0 if numpy.linalg.det(self.matrix[:3, :3]) >= 0 else -1.0
+        self.aabb = transform_aabb(self.mesh.aabb, self.matrix)
+
+    def set_mesh(self, mesh):
+        self.mesh = mesh
+        self.aabb = transform_aabb(mesh.aabb, self.matrix)
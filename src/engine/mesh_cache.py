@@ -0,0 +1,63 @@
+import collections
+import hashlib
+
+import numpy
+
+
+class MeshCache:
+    '''Content-addressed LRU cache of meshes bounded by an estimate of the
+    GPU memory they hold'''
+    def __init__(self, budget=512 * 2**20):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(*arrays):
+        digest = hashlib.blake2b(digest_size=16)
+        for array in arrays:
+            array = numpy.ascontiguousarray(array)
+            digest.update(("%s%s" % (array.dtype.str, array.shape)).encode())
+            digest.update(array)
+        return digest.digest()
+
+    def get(self, key):
+        mesh = self._entries.get(key)
+        if mesh is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return mesh
+
+    def put(self, key, mesh, in_use=()):
+        '''Adds a mesh and evicts least recently used meshes that are not in
+        in_use until the cache fits its budget again'''
+        if key in self._entries:
+            self.size -= self._entries.pop(key).gpu_size()
+        self._entries[key] = mesh
+        self.size += mesh.gpu_size()
+
+        in_use = {id(m) for m in in_use}
+        in_use.add(id(mesh))
+        for old_key in list(self._entries):
+            if self.size <= self.budget:
+                break
+            old_mesh = self._entries[old_key]
+            if id(old_mesh) not in in_use:
+                del self._entries[old_key]
+                self.size -= old_mesh.gpu_size()
+
+    def discard(self, mesh):
+        '''Drops a mesh that is being freed, if it is cached'''
+        for key, cached in self._entries.items():
+            if cached is mesh:
+                del self._entries[key]
+                self.size -= mesh.gpu_size()
+                return
@@ -0,0 +1,102 @@
+import ctypes
+
+import numpy
+
+from .gpu_types import VERTEX
+
+
+def _as_array(data, dtype, columns=None):
+    if not isinstance(data, numpy.ndarray):
+        data = numpy.asarray(memoryview(data))
+        # Structs and raw bytes carry no usable element type
+        if data.dtype.fields is not None or data.dtype == numpy.uint8:
+            data = numpy.frombuffer(data, dtype)
+    if columns is not None:
+        data = data.astype(dtype, copy=False).reshape(-1, columns)
+    elif data.dtype not in (numpy.uint16, numpy.uint32):
+        data = data.astype(numpy.uint32 if data.itemsize > 2 else numpy.uint16)
+    return numpy.ascontiguousarray(data)
+
+
+# Smallest size of a mesh bounding box along any axis
+MIN_EXTENT = 1e-3
+# Bounding boxes grow by this fraction of their largest extent on each side
+BOUNDS_MARGIN = 5e-4
+
+VOXEL_LIST_WIDTH = 1024
+VOXEL_LIST_MIN_CAPACITY = 64
+VOXEL_LIST_MAX_CAPACITY = VOXEL_LIST_WIDTH * 16384
+
+
+def voxel_list_shape(entries):
+    '''Returns the (width, height) of a link list texture with room for
+    entries links plus the unused slot 0. Capacities are rounded up to a
+    power of two so lists of similar meshes share a size bucket.'''
+    capacity = VOXEL_LIST_MIN_CAPACITY
+    while capacity < entries + 1 and capacity < VOXEL_LIST_MAX_CAPACITY:
+        capacity *= 2
+    width = min(capacity, VOXEL_LIST_WIDTH)
+    return width, capacity // width
+
+
+def voxel_bytes(resolution, capacity, layout):
+    '''GPU memory of a mesh grid in the given voxel layout, with room for
+    capacity triangle references. Lists hold a head per cell and a
+    (triangle, next) link per reference, CSR an offset per cell plus one
+    and a triangle id per reference.'''
+    cells = int(numpy.prod(resolution))
+    if layout == "csr":
+        return (cells + 1) * 4 + capacity * 4
+    return cells * 4 + capacity * 8
+
+
+def interleave(positions, normals):
+    '''Packs positions and normals into an (N, 8) float32 array matching
+    the VERTEX layout'''
+    vertices = numpy.zeros((len(positions), 8), numpy.float32)
+    vertices[:, 0:3] = positions
+    vertices[:, 4:7] = normals
+    return vertices
+
+
+class MeshData:
+    '''The GL-free part of a mesh: vertex data, bounds and voxel resolution'''
+    def __init__(self, positions, normals, indices):
+        '''Accepts NumPy arrays or any buffer-protocol object (e.g. ctypes
+        VEC3 and index arrays) for the vertex and index data'''
+        self.buf_positions = _as_array(positions, numpy.float32, 3)
+        self.buf_normals = _as_array(normals, numpy.float32, 3)
+        self.buf_indices = _as_array(indices, numpy.uint16)
+        self.vert_count = len(self.buf_positions)
+
+        lower = self.buf_positions.min(axis=0).astype(numpy.float64)
+        upper = self.buf_positions.max(axis=0).astype(numpy.float64)
+        # Grown on every side by a fraction of the largest extent, so
+        # triangles on the boundary stay inside wherever the mesh sits
+        margin = BOUNDS_MARGIN * max(float((upper - lower).max()), MIN_EXTENT)
+        lower -= margin
+        upper += margin
+        # Flat meshes such as a plane still get a thin box, so no axis of the
+        # grid has zero size
+        pad = numpy.maximum(MIN_EXTENT - (upper - lower), 0.0) / 2
+        self.aabb = [(lower - pad).tolist(), (upper + pad).tolist()]
+
+        self.dimensions = tuple(numpy.subtract(self.aabb[1], self.aabb[0]).tolist())
+
+        self.element_count = len(self.buf_indices)
+        self.count = self.element_count // 3
+
+        # Voxels
+        res_factor = self.count / numpy.prod(self.dimensions)
+        res_factor = res_factor ** (1/3)
+        self.voxel_resolution = tuple(
+            numpy.maximum(numpy.ceil(numpy.multiply(self.dimensions, res_factor)), 1).astype(int).tolist()
+        )
+
+    def gpu_size(self):
+        '''Estimate of the memory held by this mesh in bytes'''
+        size = self.buf_positions.nbytes + self.buf_normals.nbytes + self.buf_indices.nbytes
+        size += int(numpy.prod(self.voxel_resolution)) * 4
+        # Copy held in the shared vertex buffer
+        size += self.vert_count * ctypes.sizeof(VERTEX) + self.element_count * 4
+        return size
@@ -0,0 +1,126 @@
+import collections
+import contextlib
+import json
+import os
+import time
+
+import numpy
+
+try:
+    from OpenGL import GL
+except ImportError:
+    # Only GPU scopes need it
+    GL = None
+
+
+PERCENTILES = (50, 90, 99)
+
+
+class Profiler:
+    '''Records named CPU spans and, for GPU work, GL_TIME_ELAPSED queries.
+    Query results are only read once the driver reports them available, so
+    profiling never stalls the pipeline. Keeps the last history samples of
+    every scope and optionally Chrome trace events.'''
+    def __init__(self, gpu=False, history=240, trace=False, max_events=10**6):
+        self.gpu = gpu and GL is not None
+        self.history = history
+        self.frame = 0
+        self.samples = {
+            "cpu": collections.defaultdict(self._new_history),
+            "gpu": collections.defaultdict(self._new_history),
+        }
+        self.events = [] if trace else None
+        self.max_events = max_events
+
+        self._pending = collections.deque()
+        self._free_queries = []
+        # Name of the GPU scope whose query is running
+        self._gpu_scope = None
+        self._origin = time.perf_counter()
+
+    def _new_history(self):
+        return collections.deque(maxlen=self.history)
+
+    def _query(self):
+        if self._free_queries:
+            return self._free_queries.pop()
+        return GL.glGenQueries(1)
+
+    def _add_event(self, name, category, start, duration):
+        if self.events is None or len(self.events) >= self.max_events:
+            return
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": duration * 1e6,
+            "pid": os.getpid(),
+            "tid": category,
+            "args": {"frame": self.frame},
+        })
+
+    @contextlib.contextmanager
+    def scope(self, name, gpu=False):
+        '''Times the enclosed block. With gpu the GL commands it issues are
+        timed as well; GL_TIME_ELAPSED queries cannot nest, so opening a GPU
+        scope inside another raises RuntimeError.'''
+        query = None
+        if gpu and self.gpu:
+            if self._gpu_scope is not None:
+                raise RuntimeError("GPU scope %r opened inside %r" % (name, self._gpu_scope))
+            query = self._query()
+            GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+            self._gpu_scope = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if query is not None:
+                GL.glEndQuery(GL.GL_TIME_ELAPSED)
+                self._gpu_scope = None
+                self._pending.append((name, query, start))
+            self.samples["cpu"][name].append((end - start) * 1000)
+            self._add_event(name, "cpu", start, end - start)
+
+    def collect(self):
+        '''Picks up the GPU timings that have finished, oldest first'''
+        while self._pending:
+            name, query, start = self._pending[0]
+            available = GL.GLint(0)
+            GL.glGetQueryObjectiv(query, GL.GL_QUERY_RESULT_AVAILABLE, available)
+            if not available.value:
+                break
+            self._pending.popleft()
+            result = GL.GLuint64(0)
+            GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT, result)
+            elapsed = result.value / 1e9
+            self._free_queries.append(query)
+            self.samples["gpu"][name].append(elapsed * 1000)
+            # GPU spans are placed at the time their commands were issued
+            self._add_event(name, "gpu", start, elapsed)
+
+    def end_frame(self):
+        self.collect()
+        self.frame += 1
+
+    def summary(self):
+        '''Rolling percentiles in milliseconds per kind and scope'''
+        stats = {"frame": self.frame}
+        for kind, scopes in self.samples.items():
+            stats[kind] = {}
+            for name, samples in scopes.items():
+                if not samples:
+                    continue
+                values = numpy.percentile(list(samples), PERCENTILES)
+                entry = {"p%d" % p: float(v) for p, v in zip(PERCENTILES, values)}
+                entry["count"] = len(samples)
+                stats[kind][name] = entry
+        return stats
+
+    def dump_trace(self, path):
+        '''Writes the recorded events in Chrome's trace event format, which
+        chrome://tracing and Perfetto load directly'''
+        with open(path, 'w') as fout:
+            json.dump({"traceEvents": self.events or [], "displayTimeUnit": "ms"}, fout)
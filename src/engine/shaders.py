@@ -1,31 +1,159 @@
+import ctypes
+import hashlib
 import os
+import struct
+import time
 
 from OpenGL.GL import *
 from OpenGL.GL import shaders
+from OpenGL.error import GLError
+
+
+SHADER_DIR = os.path.dirname(os.path.realpath(__file__)) + "/shaders/"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fafnir", "programs")
+USE_PROGRAM_CACHE = True
+
+STAGES = (
+	("vertex", GL_VERTEX_SHADER),
+	("fragment", GL_FRAGMENT_SHADER),
+	("compute", GL_COMPUTE_SHADER),
+)
+
+
+class ProgramCache:
+	'''Stores linked programs as glGetProgramBinary blobs, keyed by their
+	sources and the driver that produced them'''
+	def __init__(self, directory=CACHE_DIR):
+		self.directory = directory
+		self.hits = 0
+		self.misses = 0
+		self._driver = None
+
+	def driver(self):
+		if self._driver is None:
+			self._driver = b"\n".join(
+				glGetString(name) or b"" for name in (GL_VENDOR, GL_RENDERER, GL_VERSION)
+			)
+		return self._driver
+
+	def key(self, sources):
+		digest = hashlib.sha256(self.driver())
+		for stage, src in sources:
+			digest.update(stage.encode())
+			digest.update(src.encode())
+		return digest.hexdigest()
+
+	def _path(self, key):
+		return os.path.join(self.directory, key + ".bin")
+
+	def load(self, key):
+		'''Returns a linked program or None if there is no usable binary.
+		Truncated or rejected entries are deleted so they get rewritten.'''
+		try:
+			with open(self._path(key), 'rb') as fin:
+				data = fin.read()
+		except OSError:
+			self.misses += 1
+			return None
+
+		program = None
+		try:
+			# Left truncated by a crash while writing
+			if len(data) <= 4:
+				raise ValueError("truncated program binary")
+			binary_format, = struct.unpack_from("<I", data)
+			binary = data[4:]
+			program = glCreateProgram()
+			glProgramBinary(program, binary_format, binary, len(binary))
+			# Rejected after a driver update the key did not catch
+			if not glGetProgramiv(program, GL_LINK_STATUS):
+				raise ValueError("program binary rejected by the driver")
+		except (ValueError, struct.error, GLError) as error:
+			print("Discarding cached program %s: %s" % (key, error))
+			if program is not None:
+				glDeleteProgram(program)
+			self.discard(key)
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		return program
+
+	def discard(self, key):
+		try:
+			os.remove(self._path(key))
+		except OSError:
+			pass
+
+	def store(self, key, program):
+		if not glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS):
+			return
+
+		size = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+		binary = (ctypes.c_ubyte * size)()
+		length = GLsizei(0)
+		binary_format = GLenum(0)
+		glGetProgramBinary(program, size, length, binary_format, binary)
+
+		path = self._path(key)
+		try:
+			os.makedirs(self.directory, exist_ok=True)
+			with open(path + ".tmp", 'wb') as fout:
+				fout.write(struct.pack("<I", binary_format.value))
+				fout.write(bytes(binary)[:length.value])
+			os.replace(path + ".tmp", path)
+		except OSError as error:
+			print("Could not cache program binary:", error)
+
+
+program_cache = ProgramCache()
+
+
+def _link(stages):
+	program = glCreateProgram()
+	for stage in stages:
+		glAttachShader(program, stage)
+	glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+	glLinkProgram(program)
+	for stage in stages:
+		glDetachShader(program, stage)
+		glDeleteShader(stage)
+
+	if not glGetProgramiv(program, GL_LINK_STATUS):
+		log = glGetProgramInfoLog(program)
+		glDeleteProgram(program)
+		raise RuntimeError("Link failure: %s" % log)
+	return program
 
 
 class Shader:
-	def __init__(self, vsrc, fsrc, csrc = None):
-		path = os.path.dirname(os.path.realpath(__file__)) + "/shaders/"
-
-		with open(path+fsrc, 'r') as fin:
-			src = fin.read()
-		fragment = shaders.compileShader(src, GL_FRAGMENT_SHADER)
-		with open(path+vsrc, 'r') as fin:
-			src = fin.read()
-		vertex = shaders.compileShader(src, GL_VERTEX_SHADER)
-		if csrc:
-			with open(path+csrc, 'r') as fin:
-				src = fin.read()
-				print(src)
-			compute = shaders.compileShader(src, GL_COMPUTE_SHADER)
-			self.program = shaders.compileProgram(fragment, vertex, compute)
-			glDeleteShader(compute)
-		else:
-			self.program = shaders.compileProgram(fragment, vertex)
-
-		glDeleteShader(fragment)
-		glDeleteShader(vertex)
+	'''A program built from the given files in the shaders directory. The
+	linked program comes from the on-disk binary cache when possible, and
+	uniform locations are looked up once.'''
+	def __init__(self, vsrc=None, fsrc=None, csrc=None):
+		start = time.perf_counter()
+
+		sources = []
+		for (stage, gl_stage), name in zip(STAGES, (vsrc, fsrc, csrc)):
+			if name:
+				with open(SHADER_DIR + name, 'r') as fin:
+					sources.append((stage, gl_stage, fin.read()))
+
+		key = None
+		self.program = None
+		if USE_PROGRAM_CACHE:
+			key = program_cache.key([(stage, src) for stage, _, src in sources])
+			self.program = program_cache.load(key)
+
+		self.from_cache = self.program is not None
+		if self.program is None:
+			self.program = _link([
+				shaders.compileShader(src, gl_stage) for _, gl_stage, src in sources
+			])
+			if key is not None:
+				program_cache.store(key, self.program)
+
+		self.load_time = time.perf_counter() - start
 
 		self._delete_prog = glDeleteProgram
 
@@ -41,4 +169,4 @@ class Shader:
 		location = glGetUniformLocation(self.program, name.encode())
 		self.locations[name] = location
 
-		return location
\ No newline at end of file
+		return location
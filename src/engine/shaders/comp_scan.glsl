@@ -0,0 +1,62 @@
+#version 440
+#extension GL_ARB_bindless_texture: enable
+
+// Turns the per cell counts of the "csr" layout into inclusive prefix sums,
+// one work group per mesh of the batch. Each invocation sums a contiguous
+// chunk, the chunk totals are scanned in shared memory and the chunks are
+// then rewritten with their running sums.
+const uint SCAN_SIZE = 1024;
+
+struct MeshData{
+	vec4 voxel_resolution;
+	vec4 aabb[2];
+	layout(r32ui) uimage3D voxel_data;
+	layout(rg32ui) uimage2D voxel_list;
+	usamplerBuffer tri_buffer;
+	samplerBuffer vert_buffer;
+	samplerBuffer norm_buffer;
+	samplerBuffer bvh_nodes;
+	usamplerBuffer bvh_tris;
+	layout(r32ui) uimageBuffer voxel_offsets;
+	layout(r32ui) uimageBuffer voxel_tris;
+	uint base_vertex;
+	uint base_element;
+};
+
+layout(std430, binding=5) buffer BatchMeshBuffer {
+	MeshData batch_meshes[];
+};
+
+shared uint chunk_sums[SCAN_SIZE];
+
+layout (local_size_x = SCAN_SIZE, local_size_y = 1, local_size_z = 1) in;
+void main()
+{
+	MeshData mesh = batch_meshes[gl_WorkGroupID.x];
+	ivec3 res = ivec3(mesh.voxel_resolution.xyz);
+	// The extra last entry starts at zero and ends up holding the total
+	uint size = uint(res.x * res.y * res.z) + 1;
+	uint chunk = (size + SCAN_SIZE - 1) / SCAN_SIZE;
+	uint local_id = gl_LocalInvocationID.x;
+	uint begin = min(local_id * chunk, size);
+	uint end = min(begin + chunk, size);
+
+	uint sum = 0;
+	for (uint i = begin; i < end; ++i)
+		sum += imageLoad(mesh.voxel_offsets, int(i)).r;
+	chunk_sums[local_id] = sum;
+	barrier();
+
+	for (uint stride = 1; stride < SCAN_SIZE; stride *= 2) {
+		uint other = local_id >= stride ? chunk_sums[local_id - stride] : 0;
+		barrier();
+		chunk_sums[local_id] += other;
+		barrier();
+	}
+
+	uint running = chunk_sums[local_id] - sum;
+	for (uint i = begin; i < end; ++i) {
+		running += imageLoad(mesh.voxel_offsets, int(i)).r;
+		imageStore(mesh.voxel_offsets, int(i), uvec4(running));
+	}
+}
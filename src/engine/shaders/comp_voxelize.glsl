@@ -1,62 +1,220 @@
 #version 440
+#extension GL_ARB_bindless_texture: enable
 const uint LIST_END = 0xFFFFFFFF;
 
-layout(r32ui) uniform uimage3D voxels;
-layout(rg32ui) uniform uimage2D link_list;
-layout(r32ui, binding = 2) uniform uimage2D counter;
+// Passes over every mesh of a batch at once
+const int PASS_CLEAR = 0;
+const int PASS_COUNT = 1;
+const int PASS_FILL = 2;
+uniform int u_pass;
+// Triangles (count and fill) or voxel cells (clear) in the whole batch
+uniform uint u_total;
 
-uniform usamplerBuffer tri_buffer;
-uniform samplerBuffer vert_buffer;
+// Cells a triangle is added to, see cpu_voxelizer.OVERLAP_MODES
+const int OVERLAP_AABB = 0;
+const int OVERLAP_SAT = 1;
+uniform int u_overlap;
+// Keeps triangles on a cell boundary in both cells
+const float OVERLAP_EPSILON = 1e-4;
 
-uniform vec3 u_size;
-uniform vec3 u_res;
-uniform vec3 u_aabb[2];
-uniform int u_count;
+// Storage of the cells, see voxelizer.VOXEL_LAYOUTS
+const int LAYOUT_LISTS = 0;
+const int LAYOUT_CSR = 1;
+uniform int u_layout;
+
+struct MeshData{
+	vec4 voxel_resolution;
+	vec4 aabb[2];
+	layout(r32ui) uimage3D voxel_data;
+	layout(rg32ui) uimage2D voxel_list;
+	usamplerBuffer tri_buffer;
+	samplerBuffer vert_buffer;
+	samplerBuffer norm_buffer;
+	samplerBuffer bvh_nodes;
+	usamplerBuffer bvh_tris;
+	layout(r32ui) uimageBuffer voxel_offsets;
+	layout(r32ui) uimageBuffer voxel_tris;
+	uint base_vertex;
+	uint base_element;
+};
+
+layout(std430, binding=5) buffer BatchMeshBuffer {
+	MeshData batch_meshes[];
+};
+
+// First triangle and first cell of every mesh in the batch
+layout(std430, binding=6) buffer BatchJobBuffer {
+	uvec2 batch_jobs[];
+};
+
+// One link counter per mesh
+layout(std430, binding=7) buffer BatchCounterBuffer {
+	uint batch_counters[];
+};
 
 struct Triangle {
 	int v0, v1, v2, pad;
 };
 
-void fetch_triangle(int i, inout Triangle triangle)
+void fetch_triangle(MeshData mesh, int i, inout Triangle triangle)
 {
-	triangle.v0 = int(texelFetch(tri_buffer, i * 3 + 0).x);
-	triangle.v1 = int(texelFetch(tri_buffer, i * 3 + 1).x);
-	triangle.v2 = int(texelFetch(tri_buffer, i * 3 + 2).x);
+	triangle.v0 = int(texelFetch(mesh.tri_buffer, i * 3 + 0).x);
+	triangle.v1 = int(texelFetch(mesh.tri_buffer, i * 3 + 1).x);
+	triangle.v2 = int(texelFetch(mesh.tri_buffer, i * 3 + 2).x);
 	triangle.pad = 0;
 }
 
-layout (local_size_x = 1, local_size_y = 1, local_size_z = 1) in;
-void main()
+bool axis_separates(vec3 axis, vec3 v0, vec3 v1, vec3 v2, vec3 half_size)
 {
-	int work_id = int(gl_WorkGroupID.y * gl_NumWorkGroups.x + gl_WorkGroupID.x);
-	if (work_id >= u_count)
-		return;
+	float p0 = dot(v0, axis);
+	float p1 = dot(v1, axis);
+	float p2 = dot(v2, axis);
+	float radius = dot(half_size, abs(axis));
+	return min(min(p0, p1), p2) > radius || max(max(p0, p1), p2) < -radius;
+}
+
+// Separating axis test (Akenine-Moller), matches cpu_voxelizer.triangle_box_overlap
+bool triangle_box_overlap(vec3 center, vec3 half_size, vec3 v0, vec3 v1, vec3 v2)
+{
+	v0 -= center;
+	v1 -= center;
+	v2 -= center;
+
+	if (any(greaterThan(min(min(v0, v1), v2), half_size)) ||
+			any(lessThan(max(max(v0, v1), v2), -half_size)))
+		return false;
+
+	vec3 edges[3] = vec3[3](v1 - v0, v2 - v1, v0 - v2);
+	for (int i = 0; i < 3; ++i) {
+		if (axis_separates(cross(edges[i], vec3(1, 0, 0)), v0, v1, v2, half_size) ||
+				axis_separates(cross(edges[i], vec3(0, 1, 0)), v0, v1, v2, half_size) ||
+				axis_separates(cross(edges[i], vec3(0, 0, 1)), v0, v1, v2, half_size))
+			return false;
+	}
+
+	vec3 normal = cross(edges[0], edges[1]);
+	return abs(dot(normal, v0)) <= dot(half_size, abs(normal));
+}
+
+// Last job starting at or before index, matching dispatch.find_job
+int find_job(uint index, int component)
+{
+	int low = 0;
+	int high = batch_jobs.length() - 1;
+	while (low < high) {
+		int mid = (low + high + 1) / 2;
+		if (batch_jobs[mid][component] <= index)
+			low = mid;
+		else
+			high = mid - 1;
+	}
+	return low;
+}
+
+void clear_cell(uint index)
+{
+	int job = find_job(index, 1);
+	MeshData mesh = batch_meshes[job];
+	ivec3 res = ivec3(mesh.voxel_resolution.xyz);
+	int cell = int(index - batch_jobs[job].y);
+	ivec3 coord = ivec3(cell % res.x, (cell / res.x) % res.y, cell / (res.x * res.y));
+	imageStore(mesh.voxel_data, coord, uvec4(LIST_END));
+}
+
+void voxelize_triangle(uint index)
+{
+	int job = find_job(index, 0);
+	MeshData mesh = batch_meshes[job];
+	int tri_id = int(index - batch_jobs[job].x);
+
+	vec3 u_res = mesh.voxel_resolution.xyz;
+	vec3 u_size = mesh.aabb[1].xyz - mesh.aabb[0].xyz;
 
 	Triangle triangle;
-	fetch_triangle(work_id, triangle);
+	fetch_triangle(mesh, tri_id, triangle);
 
-	vec3 v0 = texelFetch(vert_buffer, triangle.v0).xyz;
-	vec3 v1 = texelFetch(vert_buffer, triangle.v1).xyz;
-	vec3 v2 = texelFetch(vert_buffer, triangle.v2).xyz;
+	vec3 v0 = texelFetch(mesh.vert_buffer, triangle.v0).xyz;
+	vec3 v1 = texelFetch(mesh.vert_buffer, triangle.v1).xyz;
+	vec3 v2 = texelFetch(mesh.vert_buffer, triangle.v2).xyz;
 
-	v0 = u_res * (v0 - u_aabb[0]) / u_size;
-	v1 = u_res * (v1 - u_aabb[0]) / u_size;
-	v2 = u_res * (v2 - u_aabb[0]) / u_size;
+	v0 = u_res * (v0 - mesh.aabb[0].xyz) / u_size;
+	v1 = u_res * (v1 - mesh.aabb[0].xyz) / u_size;
+	v2 = u_res * (v2 - mesh.aabb[0].xyz) / u_size;
 
 	ivec3 bb_min = ivec3(floor(min(min(v0, v1), v2)));
 	ivec3 bb_max = ivec3(ceil(max(max(v0, v1), v2)));
 
-	uint width = uint(imageSize(link_list).x);
+	// Offsets only exist for cells inside the grid
+	bool csr = u_layout == LAYOUT_CSR;
+	ivec3 res = ivec3(u_res);
+	if (csr) {
+		bb_min = max(bb_min, ivec3(0));
+		bb_max = min(bb_max, res);
+	}
 
+	if (u_pass == PASS_COUNT && u_overlap == OVERLAP_AABB && !csr) {
+		ivec3 extent = max(bb_max - bb_min, ivec3(0));
+		atomicAdd(batch_counters[job], uint(extent.x * extent.y * extent.z));
+		return;
+	}
+
+	uint width = uint(imageSize(mesh.voxel_list).x);
+	uint capacity = width * uint(imageSize(mesh.voxel_list).y);
+	vec3 half_size = vec3(0.5 + OVERLAP_EPSILON);
+	uint count = 0;
 
 	for (int z = bb_min.z; z < bb_max.z; ++z) {
 		for (int y = bb_min.y; y < bb_max.y; ++y) {
 			for (int x = bb_min.x; x < bb_max.x; ++x) {
-				uint end = imageAtomicAdd(counter, ivec2(0, 0), 1) + 1;
-				uint old_ptr = imageAtomicExchange(voxels, ivec3(x, y, z), end).r;
+				if (u_overlap == OVERLAP_SAT &&
+						!triangle_box_overlap(vec3(x, y, z) + 0.5, half_size, v0, v1, v2))
+					continue;
+				if (csr) {
+					// Cells in the order of cpu_voxelizer.voxelize_csr
+					int cell = (x * res.y + y) * res.z + z;
+					if (u_pass == PASS_COUNT) {
+						imageAtomicAdd(mesh.voxel_offsets, cell, 1u);
+						++count;
+						continue;
+					}
+					// Offsets hold each cell's end after the scan and its
+					// start once every triangle has taken its slot
+					uint slot = imageAtomicAdd(mesh.voxel_offsets, cell, 0xFFFFFFFFu) - 1u;
+					if (slot < uint(imageSize(mesh.voxel_tris)))
+						imageStore(mesh.voxel_tris, int(slot), uvec4(tri_id));
+					continue;
+				}
+				if (u_pass == PASS_COUNT) {
+					++count;
+					continue;
+				}
+				uint end = atomicAdd(batch_counters[job], 1) + 1;
+				// Links past the end are still counted so the overflow
+				// can be detected, but are not stored
+				if (end >= capacity)
+					continue;
+				uint old_ptr = imageAtomicExchange(mesh.voxel_data, ivec3(x, y, z), end).r;
 				ivec2 end_idx = ivec2(end%width, end/width);
-				imageStore(link_list, end_idx, uvec4(work_id, old_ptr, 0, 0));
+				imageStore(mesh.voxel_list, end_idx, uvec4(tri_id, old_ptr, 0, 0));
 			}
 		}
 	}
+
+	if (u_pass == PASS_COUNT)
+		atomicAdd(batch_counters[job], count);
+}
+
+layout (local_size_x = 64, local_size_y = 1, local_size_z = 1) in;
+void main()
+{
+	// Large batches are tiled over x and y, see dispatch.plan_dispatch
+	uint group = gl_WorkGroupID.y * gl_NumWorkGroups.x + gl_WorkGroupID.x;
+	uint index = group * gl_WorkGroupSize.x + gl_LocalInvocationID.x;
+	if (index >= u_total)
+		return;
+
+	if (u_pass == PASS_CLEAR)
+		clear_cell(index);
+	else
+		voxelize_triangle(index);
 }
@@ -5,6 +5,8 @@
 
 const float epsilon = 0.00001;
 const uint LIST_END = 0xFFFFFFFF;
+// Matches MAX_DEPTH in bvh.py
+const int BVH_STACK_SIZE = 32;
 
 layout(pixel_center_integer) in vec4 gl_FragCoord;
 
@@ -16,15 +18,29 @@ struct MeshData{
 	usamplerBuffer tri_buffer;
 	samplerBuffer vert_buffer;
 	samplerBuffer norm_buffer;
+	samplerBuffer bvh_nodes;
+	usamplerBuffer bvh_tris;
+	layout(r32ui) uimageBuffer voxel_offsets;
+	layout(r32ui) uimageBuffer voxel_tris;
 	uint base_vertex;
 	uint base_element;
 };
 
+// Places a mesh in the world. Meshes are traced in object space.
+struct InstanceData {
+	mat4 world_to_object;
+	mat4 object_to_world;
+	vec4 aabb[2];
+	uint mesh_index;
+	uint pad[3];
+};
+
 struct RayHit {
 	float t;
-	float tri_id;
+	int tri_id;
 	float u;
 	float v;
+	int instance_id;
 };
 
 layout(std430, binding=1) buffer RayHitBuffer {
@@ -39,7 +55,19 @@ int num_triangles;
 layout(std430, binding=0) buffer MeshBuffer {
 	MeshData mesh_buffer[];
 };
-uniform int num_meshes;
+
+layout(std430, binding=2) buffer InstanceBuffer {
+	InstanceData instance_buffer[];
+};
+uniform int num_instances;
+uniform bool use_bvh;
+// Grids store cells as offsets into one array instead of link lists
+uniform bool use_csr;
+
+// Primary hits rasterized by raster.frag, traced where visibility_instances is 0
+uniform bool use_visibility;
+uniform usampler2D visibility_hits;
+uniform usampler2D visibility_instances;
 
 struct Triangle {
 	int v0, v1, v2, pad;
@@ -78,14 +106,49 @@ void fetch_triangle(int i, inout Triangle triangle)
 	triangle.pad = 0;
 }
 
+bool intersect_triangle(int tri_index, vec3 ray_o, vec3 ray_d, out float t, out float u, out float v)
+{
+	Triangle triangle;
+	fetch_triangle(tri_index, triangle);
+
+	vec3 v0p = vertex_buffer[triangle.v0 + current_mesh.base_vertex].position.xyz;
+	vec3 v1p = vertex_buffer[triangle.v1 + current_mesh.base_vertex].position.xyz;
+	vec3 v2p = vertex_buffer[triangle.v2 + current_mesh.base_vertex].position.xyz;
+
+	vec3 e0 = v1p - v0p;
+	vec3 e1 = v2p - v0p;
+
+	vec3 P = cross(ray_d, e1);
+	float det = dot(e0, P);
+
+	t = u = v = 0.0;
+	if (det < epsilon) return false;
+
+	vec3 T = ray_o - v0p;
+
+	u = dot(T, P);
+	if (u < 0.0 || u > det) return false;
+
+	vec3 Q = cross(T, e0);
+
+	v = dot(ray_d, Q);
+	if (v < 0.0 || u + v > det) return false;
+
+
+	float inv_det = 1.0 / det;
+
+	t = dot(e1, Q) * inv_det;
+	u *= inv_det;
+	v *= inv_det;
+
+	return t >= 0;
+}
+
 bool trace_list(uint ptr, layout(rg32ui) uimage2D link_list, int list_width,
 	vec3 ray_o, vec3 ray_d, float closest_t, out int index, out vec3 hit)
 {
-	vec3 v0p, v1p, v2p;
-	Triangle triangle;
-	Vertex v0, v1, v2;
-	vec3 e0, e1, T, P, Q;
-	float det=1.0, inv_det, t, u=1.0, v=1.0;
+	int tri_index;
+	float t, u, v;
 
 	float closest_u, closest_v;
 	int closest_tri = -1;
@@ -93,54 +156,110 @@ bool trace_list(uint ptr, layout(rg32ui) uimage2D link_list, int list_width,
 #ifdef VOXEL
 	while (ptr != LIST_END) {
 		uvec2 link = imageLoad(link_list, ivec2(ptr % list_width, ptr / list_width)).rg;
-		fetch_triangle(int(link.x), triangle);
+		tri_index = int(link.x);
 		ptr = link.y;
 #else
-	int i = 0;
-	for (; i < num_triangles; ++i) {
-		fetch_triangle(i, triangle);
+	for (tri_index = 0; tri_index < num_triangles; ++tri_index) {
 #endif
-		v0 = vertex_buffer[triangle.v0 + current_mesh.base_vertex];
-		v1 = vertex_buffer[triangle.v1 + current_mesh.base_vertex];
-		v2 = vertex_buffer[triangle.v2 + current_mesh.base_vertex];
-		v0p = v0.position.xyz;
-		v1p = v1.position.xyz;
-		v2p = v2.position.xyz;
+		if (intersect_triangle(tri_index, ray_o, ray_d, t, u, v) && t < closest_t) {
+			closest_t = t;
+			closest_u = u;
+			closest_v = v;
+			closest_tri = tri_index;
+		}
+	}
 
-		e0 = v1p - v0p;
-		e1 = v2p - v0p;
+	if (closest_tri != -1) {
+		index = closest_tri;
+		hit = vec3(closest_t, closest_u, closest_v);
+		return true;
+	}
 
-		P = cross(ray_d, e1);
-		det = dot(e0, P);
+	index = -1;
+	hit = vec3(0.0);
+	return false;
+}
+
+// Reads a cell's triangle ids from consecutive entries of the "csr" layout
+bool trace_range(uint begin, uint end, layout(r32ui) uimageBuffer cell_tris,
+	vec3 ray_o, vec3 ray_d, float closest_t, out int index, out vec3 hit)
+{
+	float t, u, v;
 
-		if (det < epsilon) continue;
+	float closest_u, closest_v;
+	int closest_tri = -1;
 
-		T = ray_o - v0p;
+	for (uint i = begin; i < end; ++i) {
+		int tri_index = int(imageLoad(cell_tris, int(i)).r);
+		if (intersect_triangle(tri_index, ray_o, ray_d, t, u, v) && t < closest_t) {
+			closest_t = t;
+			closest_u = u;
+			closest_v = v;
+			closest_tri = tri_index;
+		}
+	}
 
-		u = dot(T, P);
-		if (u < 0.0 || u > det) continue;
+	if (closest_tri != -1) {
+		index = closest_tri;
+		hit = vec3(closest_t, closest_u, closest_v);
+		return true;
+	}
 
-		Q = cross(T, e0);
+	index = -1;
+	hit = vec3(0.0);
+	return false;
+}
 
-		v = dot(ray_d, Q);
-		if (v < 0.0 || u + v > det) continue;
+bool bvh_hit_box(vec3 lower, vec3 upper, vec3 ray_o, vec3 ray_inv, float closest_t)
+{
+	vec3 t0 = (lower - ray_o) * ray_inv;
+	vec3 t1 = (upper - ray_o) * ray_inv;
+	vec3 t_near = min(t0, t1);
+	vec3 t_far = max(t0, t1);
+	float t_enter = max(max(t_near.x, t_near.y), t_near.z);
+	float t_exit = min(min(t_far.x, t_far.y), t_far.z);
+	return t_enter <= t_exit && t_exit >= 0 && t_enter < closest_t;
+}
 
+bool trace_bvh(vec3 ray_o, vec3 ray_d, vec3 ray_inv, float closest_t, out int index, out vec3 hit)
+{
+	int stack[BVH_STACK_SIZE];
+	int top = 0;
+	stack[top++] = 0;
 
-		inv_det = 1.0 / det;
+	int tri_index;
+	float t, u, v;
 
-		t = dot(e1, Q) * inv_det;
+	float closest_u, closest_v;
+	int closest_tri = -1;
 
-		if (t < 0) continue;
+	while (top > 0) {
+		int node = stack[--top];
+		vec4 lower = texelFetch(current_mesh.bvh_nodes, node * 2);
+		vec4 upper = texelFetch(current_mesh.bvh_nodes, node * 2 + 1);
+		if (!bvh_hit_box(lower.xyz, upper.xyz, ray_o, ray_inv, closest_t))
+			continue;
+
+		int first = int(floatBitsToUint(lower.w));
+		int count = int(floatBitsToUint(upper.w));
+		if (count == 0) {
+			// Visit the child nearer along the ray first
+			vec4 c0 = texelFetch(current_mesh.bvh_nodes, first * 2) + texelFetch(current_mesh.bvh_nodes, first * 2 + 1);
+			vec4 c1 = texelFetch(current_mesh.bvh_nodes, first * 2 + 2) + texelFetch(current_mesh.bvh_nodes, first * 2 + 3);
+			int near_child = dot(c1.xyz - c0.xyz, ray_d) >= 0 ? first : first + 1;
+			stack[top++] = 2 * first + 1 - near_child;
+			stack[top++] = near_child;
+			continue;
+		}
 
-		if (t < closest_t) {
-			closest_t = t;
-			closest_u = u * inv_det;
-			closest_v = v * inv_det;
-#ifdef VOXEL
-			closest_tri = int(link.x);
-#else
-			closest_tri = i;
-#endif
+		for (int i = first; i < first + count; ++i) {
+			tri_index = int(texelFetch(current_mesh.bvh_tris, i).r);
+			if (intersect_triangle(tri_index, ray_o, ray_d, t, u, v) && t < closest_t) {
+				closest_t = t;
+				closest_u = u;
+				closest_v = v;
+				closest_tri = tri_index;
+			}
 		}
 	}
 
@@ -155,20 +274,21 @@ bool trace_list(uint ptr, layout(rg32ui) uimage2D link_list, int list_width,
 	return false;
 }
 
-void output_results(int mesh_id, int tri_index, vec3 hit)
+void output_results(int instance_id, int tri_index, vec3 hit)
 {
 	int out_idx = int(gl_FragCoord.y) * out_width + int(gl_FragCoord.x);
-	if (mesh_id == -1) {
+	if (instance_id == -1) {
 		out_color = vec3(0.2);
 
 		ray_hit_buffer[out_idx].t = -1.0;
 		ray_hit_buffer[out_idx].tri_id = 0;
 		ray_hit_buffer[out_idx].u = 0.0;
 		ray_hit_buffer[out_idx].v = 0.0;
+		ray_hit_buffer[out_idx].instance_id = -1;
 	}
 	else {
-		MeshData mesh = mesh_buffer[mesh_id];
-		current_mesh = mesh;
+		InstanceData instance = instance_buffer[instance_id];
+		current_mesh = mesh_buffer[instance.mesh_index];
 
 		float u = hit.y;
 		float v = hit.z;
@@ -188,15 +308,20 @@ void output_results(int mesh_id, int tri_index, vec3 hit)
 		norm += v1.normal.xyz * u;
 		norm += v2.normal.xyz* v;
 
+		// Shade in world space, normals by the inverse transpose
+		pos = (instance.object_to_world * vec4(pos, 1.0)).xyz;
+		norm = transpose(mat3(instance.world_to_object)) * norm;
+
 		vec3 L = normalize(vec3(3.0, -4.0, 6.0) - pos);
 		vec3 N = normalize(norm);
 
 		out_color = vec3(dot(N, L) * 0.8);
 
 		ray_hit_buffer[out_idx].t = hit.x;
-		ray_hit_buffer[out_idx].tri_id = (mesh_id << 16) & (tri_index & 0xFFFF);
+		ray_hit_buffer[out_idx].tri_id = tri_index;
 		ray_hit_buffer[out_idx].u = hit.y;
 		ray_hit_buffer[out_idx].v = hit.z;
+		ray_hit_buffer[out_idx].instance_id = instance_id;
 	}
 }
 
@@ -268,18 +393,28 @@ bool dda_in_bounds(DDAData dda)
 
 void main()
 {
+	if (use_visibility) {
+		ivec2 pixel = ivec2(gl_FragCoord.xy);
+		uint visible_instance = texelFetch(visibility_instances, pixel, 0).r;
+		if (visible_instance != 0) {
+			uvec4 visible = texelFetch(visibility_hits, pixel, 0);
+			output_results(int(visible_instance) - 1, int(visible.w), uintBitsToFloat(visible.xyz));
+			return;
+		}
+	}
+
 	vec3 ray_d = normalize(in_ray_d);
 	vec3 ray_inv = vec3(1.0) / ray_d;
 
-	int closest_mesh_id = -1;
+	int closest_instance_id = -1;
 	int closest_tri_id = -1;
 	vec3 closest_hit = vec3(1000, 0, 0);
 
 	DDAData scene_dda;
 	dda_init(scene_dda, scene_aabb, scene_resolution);
-	float unused;
+	float scene_tmin;
 	vec3 ray_copy = vec3(in_ray_o);
-	if (!dda_ray_to_bounds(scene_dda, ray_copy, ray_d, ray_inv, unused)) {
+	if (!dda_ray_to_bounds(scene_dda, ray_copy, ray_d, ray_inv, scene_tmin)) {
 		output_results(-1, -1, vec3(0.0));
 		return;
 	}
@@ -289,42 +424,70 @@ void main()
 	while (dda_in_bounds(scene_dda)) {
 		uint scene_ptr = imageLoad(scene_voxels, scene_dda.coord).r;
 
-		// for (int i = 0; i < num_meshes; ++i) {
+		// for (int i = 0; i < num_instances; ++i) {
 		while (scene_ptr != LIST_END) {
 			uvec2 scene_link = imageLoad(scene_list, ivec2(scene_ptr % scene_width, scene_ptr / scene_width)).rg;
 			scene_ptr = scene_link.y;
 			int i = int(scene_link.x);
-			vec3 ray_o = in_ray_o;
-			MeshData mesh = mesh_buffer[i];
+			InstanceData instance = instance_buffer[i];
+			MeshData mesh = mesh_buffer[instance.mesh_index];
+
+			// The object space direction is not renormalized, so t values
+			// stay world space distances
+			vec3 ray_o = (instance.world_to_object * vec4(in_ray_o, 1.0)).xyz;
+			vec3 object_d = mat3(instance.world_to_object) * ray_d;
+			vec3 object_inv = vec3(1.0) / object_d;
 			vec3 aabb[2];
 			aabb[0] = mesh.aabb[0].xyz;
 			aabb[1] = mesh.aabb[1].xyz;
-			int list_width = imageSize(mesh.voxel_list).x;
+			int list_width = use_csr ? 0 : imageSize(mesh.voxel_list).x;
+			ivec3 mesh_res = ivec3(mesh.voxel_resolution.xyz);
 			current_mesh = mesh;
 			num_triangles = int(mesh.voxel_resolution.w);
 
+			if (use_bvh) {
+				int tri_index;
+				vec3 hit;
+				if (trace_bvh(ray_o, object_d, object_inv, closest_hit.x, tri_index, hit)) {
+					closest_instance_id = i;
+					closest_tri_id = tri_index;
+					closest_hit = hit;
+				}
+				continue;
+			}
+
 			DDAData mesh_dda;
 			dda_init(mesh_dda, aabb, mesh.voxel_resolution.xyz);
 
 			// Make sure we are in the voxel region
 			float tmin;
-			if (!dda_ray_to_bounds(mesh_dda, ray_o, ray_d, ray_inv, tmin))
+			if (!dda_ray_to_bounds(mesh_dda, ray_o, object_d, object_inv, tmin))
 				continue;
 
 			// Initialize DDA traversal variables
-			dda_traversal_init(mesh_dda, ray_o, ray_d, ray_inv);
+			dda_traversal_init(mesh_dda, ray_o, object_d, object_inv);
 
 			// Traverse voxel grid
 			while (dda_in_bounds(mesh_dda)) {
-				uint ptr = imageLoad(mesh.voxel_data, mesh_dda.coord).r;
-
 				int tri_index;
 				vec3 hit;
-				if (trace_list(ptr, mesh.voxel_list, list_width, ray_o, ray_d, mesh_dda.t, tri_index, hit)) {
+				bool found;
+				if (use_csr) {
+					ivec3 coord = mesh_dda.coord;
+					int cell = (coord.x * mesh_res.y + coord.y) * mesh_res.z + coord.z;
+					uint begin = imageLoad(mesh.voxel_offsets, cell).r;
+					uint end = imageLoad(mesh.voxel_offsets, cell + 1).r;
+					found = trace_range(begin, end, mesh.voxel_tris, ray_o, object_d, mesh_dda.t, tri_index, hit);
+				}
+				else {
+					uint ptr = imageLoad(mesh.voxel_data, mesh_dda.coord).r;
+					found = trace_list(ptr, mesh.voxel_list, list_width, ray_o, object_d, mesh_dda.t, tri_index, hit);
+				}
+				if (found) {
 					float dist = hit.x + tmin + epsilon;
 					if (dist > 0 && dist < closest_hit.x)
 					{
-						closest_mesh_id = i;
+						closest_instance_id = i;
 						closest_tri_id = tri_index;
 						closest_hit = vec3(dist, hit.yz);
 					}
@@ -334,8 +497,11 @@ void main()
 				dda_traversal_step(mesh_dda);
 			}
 		}
+		// Instances in later cells cannot be closer than a hit in this one
+		if (closest_instance_id != -1 && closest_hit.x <= scene_tmin + epsilon + scene_dda.t)
+			break;
 		dda_traversal_step(scene_dda);
 	}
 
-	output_results(closest_mesh_id, closest_tri_id, closest_hit);
+	output_results(closest_instance_id, closest_tri_id, closest_hit);
 }
@@ -0,0 +1,90 @@
+#version 440
+
+// Visibility buffer pass: every pixel keeps the nearest triangle with the
+// t, u and v fsq.frag would compute for its primary ray
+
+const float epsilon = 0.00001;
+
+struct InstanceData {
+	mat4 world_to_object;
+	mat4 object_to_world;
+	vec4 aabb[2];
+	uint mesh_index;
+	uint pad[3];
+};
+
+layout(std430, binding=2) buffer InstanceBuffer {
+	InstanceData instance_buffer[];
+};
+
+struct Vertex {
+	vec4 position;
+	vec4 normal;
+};
+
+layout(std430, binding=3) buffer VertexBuffer {
+	Vertex vertex_buffer[];
+};
+
+layout(std430, binding=4) buffer IndexBuffer {
+	uint index_buffer[];
+};
+
+uniform mat4 inv_view_matrix;
+uniform mat4 inv_proj_matrix;
+uniform vec2 out_size;
+uniform int base_vertex;
+uniform int base_element;
+
+// floatBitsToUint of t, u and v plus the triangle index
+layout(location=0) out uvec4 out_hit;
+// Instance index plus one, zero marks pixels left for tracing
+layout(location=1) out uint out_instance;
+
+flat in int instance_id;
+
+void main()
+{
+	// The same ray fsq.vert interpolates for this pixel
+	vec2 ndc = gl_FragCoord.xy / out_size * 2.0 - 1.0;
+	vec3 ray_o = (inv_view_matrix * vec4(0.0, 0.0, 0.0, 1.0)).xyz;
+	vec3 ray_d = (inv_proj_matrix * vec4(ndc, 0.0, 1.0)).xyz;
+	ray_d = normalize((inv_view_matrix * vec4(ray_d, 0.0)).xyz);
+
+	// Into object space like fsq.frag, without renormalizing so t stays a
+	// world space distance
+	InstanceData instance = instance_buffer[instance_id];
+	ray_o = (instance.world_to_object * vec4(ray_o, 1.0)).xyz;
+	ray_d = mat3(instance.world_to_object) * ray_d;
+
+	int tri_index = gl_PrimitiveID;
+	int element = base_element + tri_index * 3;
+	vec3 v0 = vertex_buffer[base_vertex + int(index_buffer[element + 0])].position.xyz;
+	vec3 v1 = vertex_buffer[base_vertex + int(index_buffer[element + 1])].position.xyz;
+	vec3 v2 = vertex_buffer[base_vertex + int(index_buffer[element + 2])].position.xyz;
+
+	// Moller-Trumbore as in fsq.frag, including its back face culling, so
+	// fragments the tracer would not report are dropped
+	vec3 e0 = v1 - v0;
+	vec3 e1 = v2 - v0;
+	vec3 P = cross(ray_d, e1);
+	float det = dot(e0, P);
+	if (det < epsilon)
+		discard;
+
+	vec3 T = ray_o - v0;
+	float u = dot(T, P);
+	vec3 Q = cross(T, e0);
+	float v = dot(ray_d, Q);
+	float inv_det = 1.0 / det;
+	float t = dot(e1, Q) * inv_det;
+	u *= inv_det;
+	v *= inv_det;
+
+	// Rasterized coverage and the ray test can disagree along edges
+	u = clamp(u, 0.0, 1.0);
+	v = clamp(v, 0.0, 1.0 - u);
+
+	out_hit = uvec4(floatBitsToUint(t), floatBitsToUint(u), floatBitsToUint(v), uint(tri_index));
+	out_instance = uint(instance_id + 1);
+}
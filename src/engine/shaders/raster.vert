@@ -0,0 +1,29 @@
+#version 440
+
+struct InstanceData {
+	mat4 world_to_object;
+	mat4 object_to_world;
+	vec4 aabb[2];
+	uint mesh_index;
+	uint pad[3];
+};
+
+layout(std430, binding=2) buffer InstanceBuffer {
+	InstanceData instance_buffer[];
+};
+
+uniform mat4 view_matrix;
+uniform mat4 proj_matrix;
+// Instances of one mesh are contiguous and drawn with one instanced call
+uniform int first_instance;
+
+layout(location=0) in vec3 position;
+
+flat out int instance_id;
+
+void main()
+{
+	instance_id = first_instance + gl_InstanceID;
+	vec4 world = instance_buffer[instance_id].object_to_world * vec4(position, 1.0);
+	gl_Position = proj_matrix * view_matrix * world;
+}
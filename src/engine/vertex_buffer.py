@@ -1,18 +1,31 @@
 import ctypes
 
+import numpy
 
 import OpenGL
 OpenGL.ERROR_CHECKING = False
 from OpenGL.GL import *
 
+from .allocator import RangeAllocator
 from .gpu_types import VERTEX
+from .mesh_data import interleave
 
 
 class VertexBuffer:
+    # Fraction of unused space below the last range that triggers compaction
+    compact_threshold = 0.25
+    # Vertices or elements moved per update while compacting, so the
+    # re-uploads of a large compaction are spread over several frames
+    compact_budget = 1 << 16
+
     def __init__(self,):
         self.vbo, self.ibo = glGenBuffers(2)
-        self.mesh_list = []
-        self.is_dirty = True
+        self.ranges = {}
+        self.dirty_meshes = set()
+        self.vertices = RangeAllocator()
+        self.elements = RangeAllocator()
+        # Allocators with a compaction in progress
+        self._compacting = set()
         self.vertex_count = 0
         self.element_count = 0
         self.vbo_size = 0
@@ -30,14 +43,67 @@ class VertexBuffer:
         glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, ctypes.sizeof(VERTEX), ctypes.c_void_p(16))
         glBindVertexArray(0)
 
+    @property
+    def is_dirty(self):
+        return bool(self.dirty_meshes)
+
     def add_mesh(self, mesh):
+        if mesh in self.ranges:
+            self.dirty_meshes.add(mesh)
+            return
+
+        self.ranges[mesh] = (
+            self._allocate(self.vertices, mesh.vert_count),
+            self._allocate(self.elements, mesh.element_count),
+        )
         self.vertex_count += mesh.vert_count
         self.element_count += mesh.element_count
-        self.mesh_list.append(mesh)
-        self.is_dirty = True
+        self.dirty_meshes.add(mesh)
 
     def remove_mesh(self, mesh):
-        pass
+        if mesh not in self.ranges:
+            return
+
+        vert_offset, element_offset = self.ranges.pop(mesh)
+        self.vertices.free(vert_offset)
+        self.elements.free(element_offset)
+        self.vertex_count -= mesh.vert_count
+        self.element_count -= mesh.element_count
+        self.dirty_meshes.discard(mesh)
+
+    def _allocate(self, allocator, size):
+        offset = allocator.allocate(size)
+        if offset is None:
+            # Storage is reallocated on growth, so everything is uploaded again
+            allocator.grow(allocator.capacity + size)
+            offset = allocator.allocate(size)
+            self.dirty_meshes.update(self.ranges)
+        return offset
+
+    def _compact_step(self, allocator):
+        '''Moves up to compact_budget units of a fragmented allocator and
+        keeps going on later updates until it is fully packed'''
+        if allocator.fragmentation() > self.compact_threshold:
+            self._compacting.add(allocator)
+        if allocator not in self._compacting:
+            return {}
+
+        moves = allocator.compact(self.compact_budget)
+        if allocator.fragmentation() == 0.0:
+            self._compacting.discard(allocator)
+        return moves
+
+    def _compact(self):
+        vertex_moves = self._compact_step(self.vertices)
+        element_moves = self._compact_step(self.elements)
+
+        for mesh, (vert_offset, element_offset) in self.ranges.items():
+            if vert_offset in vertex_moves or element_offset in element_moves:
+                self.ranges[mesh] = (
+                    vertex_moves.get(vert_offset, vert_offset),
+                    element_moves.get(element_offset, element_offset),
+                )
+                self.dirty_meshes.add(mesh)
 
     def _resize_vbo(self, size):
         self.vbo_size = size
@@ -52,45 +118,40 @@ class VertexBuffer:
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
     def update(self):
+        '''Uploads added and moved meshes and returns whether any mesh's
+        GPU_MESH offsets changed'''
+        self._compact()
         if not self.is_dirty:
-            return
+            return False
 
-        if self.vbo_size < self.vertex_count * ctypes.sizeof(VERTEX):
-            self._resize_vbo(self.vertex_count * ctypes.sizeof(VERTEX))
+        if self.vbo_size < self.vertices.capacity * ctypes.sizeof(VERTEX):
+            self._resize_vbo(self.vertices.capacity * ctypes.sizeof(VERTEX))
 
-        if self.ibo_size < self.element_count * ctypes.sizeof(ctypes.c_uint32):
-            self._resize_ibo(self.element_count * ctypes.sizeof(ctypes.c_uint32))
+        if self.ibo_size < self.elements.capacity * ctypes.sizeof(ctypes.c_uint32):
+            self._resize_ibo(self.elements.capacity * ctypes.sizeof(ctypes.c_uint32))
 
-        vert_index = 0
-        element_index = 0
+        moved = False
         glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
-        for mesh in self.mesh_list:
-            c_buffer = (VERTEX * mesh.vert_count)()
-            for i, data in enumerate(zip(mesh.buf_positions, mesh.buf_normals)):
-                c_buffer[i].vx = data[0].x
-                c_buffer[i].vy = data[0].y
-                c_buffer[i].vz = data[0].z
-                c_buffer[i].nx = data[1].x
-                c_buffer[i].ny = data[1].y
-                c_buffer[i].nz = data[1].z
-            glBufferSubData(GL_ARRAY_BUFFER, vert_index * ctypes.sizeof(VERTEX),
-                mesh.vert_count * ctypes.sizeof(VERTEX), c_buffer)
-            mesh.gpu_data.vert_offset = vert_index
-            vert_index += mesh.vert_count
-
-            c_buffer = (ctypes.c_uint32 * mesh.element_count)(
-                *[ctypes.c_uint32(i) for i in mesh.buf_indices]
-            )
-            glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, element_index * ctypes.sizeof(ctypes.c_uint32),
-                ctypes.sizeof(c_buffer), c_buffer)
-            mesh.gpu_data.element_offset = element_index;
-            element_index += mesh.element_count
+        for mesh in self.dirty_meshes:
+            vert_offset, element_offset = self.ranges[mesh]
+            moved |= (mesh.gpu_data.vert_offset, mesh.gpu_data.element_offset) != (vert_offset, element_offset)
+
+            vertices = interleave(mesh.buf_positions, mesh.buf_normals)
+            glBufferSubData(GL_ARRAY_BUFFER, vert_offset * ctypes.sizeof(VERTEX),
+                vertices.nbytes, vertices)
+            mesh.gpu_data.vert_offset = vert_offset
+
+            indices = mesh.buf_indices.astype(numpy.uint32)
+            glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, element_offset * ctypes.sizeof(ctypes.c_uint32),
+                indices.nbytes, indices)
+            mesh.gpu_data.element_offset = element_offset
 
         glBindBuffer(GL_ARRAY_BUFFER, 0)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
-        self.is_dirty = False
+        self.dirty_meshes.clear()
+        return moved
 
     def bind(self, vertex_location, element_location):
         glBindVertexArray(self.vao)
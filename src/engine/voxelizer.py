@@ -1,55 +1,129 @@
-import os
+import ctypes
 
+import numpy
 
 import OpenGL
 OpenGL.ERROR_CHECKING = False
 from OpenGL.GL import *
-from OpenGL.GL import shaders
 from OpenGL.GL.ARB.bindless_texture import *
 
+from . import cpu_voxelizer
+from .dispatch import plan_batch, plan_dispatch
+from .gpu_types import GPU_MESH
+from .mesh_data import voxel_list_shape
+from .shaders import Shader
+
+
+# Passes of comp_voxelize.glsl
+PASS_CLEAR = 0
+PASS_COUNT = 1
+PASS_FILL = 2
+# Values of u_overlap, indexed like cpu_voxelizer.OVERLAP_MODES
+OVERLAP_AABB = 0
+OVERLAP_SAT = 1
+# Values of u_layout, indexed like VOXEL_LAYOUTS
+LAYOUT_LISTS = 0
+LAYOUT_CSR = 1
+# Per cell link lists built with atomic exchanges, or per cell offsets into
+# one cell sorted array of triangle ids
+VOXEL_LAYOUTS = ("lists", "csr")
+
+
+def create_voxel_list(width, height):
+    '''Allocates a link list texture and returns it with its resident image
+    handle'''
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_2D, texture)
+    glTexImage2D(GL_TEXTURE_2D, 0, GL_RG32UI, width, height, 0, GL_RG_INTEGER,
+                    GL_UNSIGNED_INT, None)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    handle = glGetImageHandleARB(texture, 0, GL_FALSE, 0, GL_RG32UI)
+    glMakeImageHandleResidentARB(handle, GL_READ_WRITE)
+    return texture, handle
+
+
+def delete_voxel_texture(texture, handle):
+    glMakeImageHandleNonResidentARB(handle)
+    glDeleteTextures([texture])
+
+
+def create_voxel_buffer(entries):
+    '''Allocates an R32UI buffer texture of entries values and returns the
+    buffer, the texture and its resident image handle'''
+    buffer = glGenBuffers(1)
+    glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+    glBufferData(GL_TEXTURE_BUFFER, max(entries, 1) * 4, None, GL_DYNAMIC_COPY)
+    glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_BUFFER, texture)
+    glTexBuffer(GL_TEXTURE_BUFFER, GL_R32UI, buffer)
+    glBindTexture(GL_TEXTURE_BUFFER, 0)
+    handle = glGetImageHandleARB(texture, 0, GL_FALSE, 0, GL_R32UI)
+    glMakeImageHandleResidentARB(handle, GL_READ_WRITE)
+    return buffer, texture, handle
+
+
+def delete_voxel_buffer(buffer, texture, handle):
+    delete_voxel_texture(texture, handle)
+    glDeleteBuffers(1, [buffer])
+
+
+def read_voxel_buffer(buffer, entries):
+    glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+    data = numpy.empty(entries, numpy.uint32)
+    glGetBufferSubData(GL_TEXTURE_BUFFER, 0, data.nbytes, data)
+    glBindBuffer(GL_TEXTURE_BUFFER, 0)
+    return data
+
+
+def create_voxel_grid(resolution):
+    '''Allocates a grid of list head pointers and returns it with its
+    resident image handle'''
+    texture = glGenTextures(1)
+    glBindTexture(GL_TEXTURE_3D, texture)
+    glTexImage3D(GL_TEXTURE_3D, 0, GL_R32UI,
+                resolution[0], resolution[1], resolution[2], 0,
+                GL_RED_INTEGER, GL_UNSIGNED_INT, None)
+    glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+    glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+    glBindTexture(GL_TEXTURE_3D, 0)
+    handle = glGetImageHandleARB(texture, 0, GL_FALSE, 0, GL_R32UI)
+    glMakeImageHandleResidentARB(handle, GL_READ_WRITE)
+    return texture, handle
+
 
-class Voxelizer:
-    src_dir = os.path.dirname(os.path.realpath(__file__))
 
-    shader_clear = 0
-    shader_voxelize = 0
-    shader_voxelize_scene = 0
+class Voxelizer:
+    shader_clear = None
+    shader_voxelize = None
+    shader_voxelize_scene = None
+    shader_scan = None
 
     tex_counter = 0
     tex_scene_voxel_data = 0
+    hnd_scene_voxel_data = 0
     tex_scene_voxel_list = 0
+    hnd_scene_voxel_list = 0
+    scene_list_shape = (0, 0)
+    scene_list_used = 0
+
+    batch_mesh_buffer = 0
+    batch_job_buffer = 0
+    batch_counter_buffer = 0
 
     scene_aabb = [[0, 0, 0], [0, 0, 0]]
     scene_resolution = [1, 1, 1]
 
     @classmethod
     def init(cls):
-        # Setup voxel clear computer shader
-        cshader = glCreateShader(GL_COMPUTE_SHADER)
-        src = cls.src_dir + "/shaders/comp_clear_voxels.glsl"
-        with open(src, 'r') as fin:
-            src = fin.read()
-        comp = shaders.compileShader(src, GL_COMPUTE_SHADER)
-        cls.shader_clear = shaders.compileProgram(comp)
-        glDeleteShader(cshader)
-
-        # Setup voxelize computer shader
-        cshader = glCreateShader(GL_COMPUTE_SHADER)
-        src = cls.src_dir + "/shaders/comp_voxelize.glsl"
-        with open(src, 'r') as fin:
-            src = fin.read()
-        comp = shaders.compileShader(src, GL_COMPUTE_SHADER)
-        cls.shader_voxelize = shaders.compileProgram(comp)
-        glDeleteShader(cshader)
-
-        # Setup voxelize scene computer shader
-        cshader = glCreateShader(GL_COMPUTE_SHADER)
-        src = cls.src_dir + "/shaders/comp_voxelize_scene.glsl"
-        with open(src, 'r') as fin:
-            src = fin.read()
-        comp = shaders.compileShader(src, GL_COMPUTE_SHADER)
-        cls.shader_voxelize_scene = shaders.compileProgram(comp)
-        glDeleteShader(cshader)
+        cls.shader_clear = Shader(csrc="comp_clear_voxels.glsl")
+        cls.shader_voxelize = Shader(csrc="comp_voxelize.glsl")
+        cls.shader_voxelize_scene = Shader(csrc="comp_voxelize_scene.glsl")
+        cls.shader_scan = Shader(csrc="comp_scan.glsl")
+        cls.batch_mesh_buffer, cls.batch_job_buffer, cls.batch_counter_buffer = glGenBuffers(3)
 
         # Setup texture counter data
         cls.tex_counter = glGenTextures(1)
@@ -60,32 +134,33 @@ class Voxelizer:
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
         glBindTexture(GL_TEXTURE_2D, 0)
 
-        # Setup textures for scene voxel data
-        cls.tex_scene_voxel_data, cls.tex_scene_voxel_list = glGenTextures(2)
-
-        glBindTexture(GL_TEXTURE_3D, cls.tex_scene_voxel_data)
-        glTexImage3D(GL_TEXTURE_3D, 0, GL_R32UI,
-                    cls.scene_resolution[0], cls.scene_resolution[1],
-                    cls.scene_resolution[2], 0, GL_RED_INTEGER, GL_UNSIGNED_INT, None)
-        glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_3D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        cls.hnd_scene_voxel_data = glGetImageHandleARB(cls.tex_scene_voxel_data, 0,
-                                                GL_FALSE, 0, GL_R32UI)
-        glMakeImageHandleResidentARB(cls.hnd_scene_voxel_data, GL_READ_WRITE)
-
-        glBindTexture(GL_TEXTURE_2D, cls.tex_scene_voxel_list)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RG32UI, 1024, 1024, 0, GL_RG_INTEGER,
-                        GL_UNSIGNED_INT, None)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glBindTexture(GL_TEXTURE_2D, 0)
-        cls.hnd_scene_voxel_list = glGetImageHandleARB(cls.tex_scene_voxel_list, 0,
-                                                GL_FALSE, 0, GL_RG32UI)
-        glMakeImageHandleResidentARB(cls.hnd_scene_voxel_list, GL_READ_WRITE)
+        cls.resize_scene_grid(cls.scene_resolution)
+        cls.resize_scene_list(0)
+
+    @classmethod
+    def resize_scene_grid(cls, resolution):
+        resolution = tuple(resolution)
+        if cls.tex_scene_voxel_data and resolution == tuple(cls.scene_resolution):
+            return
+
+        if cls.tex_scene_voxel_data:
+            delete_voxel_texture(cls.tex_scene_voxel_data, cls.hnd_scene_voxel_data)
+        cls.tex_scene_voxel_data, cls.hnd_scene_voxel_data = create_voxel_grid(resolution)
+        cls.scene_resolution = list(resolution)
 
     @classmethod
-    def voxelize_scene(cls, meshes):
-        '''Assumes the mesh buffer is bound to buffer base 0'''
+    def resize_scene_list(cls, entries):
+        shape = voxel_list_shape(entries)
+        if shape == cls.scene_list_shape:
+            return
+
+        if cls.tex_scene_voxel_list:
+            delete_voxel_texture(cls.tex_scene_voxel_list, cls.hnd_scene_voxel_list)
+        cls.tex_scene_voxel_list, cls.hnd_scene_voxel_list = create_voxel_list(*shape)
+        cls.scene_list_shape = shape
+
+    @classmethod
+    def reset_counter(cls):
         glBindImageTexture(2, cls.tex_counter, 0, GL_FALSE, 0,
                             GL_READ_WRITE, GL_R32UI)
 
@@ -94,110 +169,174 @@ class Voxelizer:
         glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, 1, 1, GL_RED_INTEGER,
                         GL_UNSIGNED_INT, data)
 
-        glUseProgram(cls.shader_clear)
-
-        loc = glGetUniformLocation(cls.shader_clear, "voxels")
+    @classmethod
+    def voxelize_scene(cls, instances):
+        '''Rebuilds the scene grid of instance ids from their world space
+        boxes. Only needed when instances are added, removed, moved or
+        change meshes. Assumes the instance buffer is bound to buffer base 2
+        in the same order as instances.'''
+        instance_bounds = [instance.aabb for instance in instances]
+        aabb = cpu_voxelizer.scene_bounds(instance_bounds)
+        resolution = cpu_voxelizer.scene_resolution(len(instance_bounds), aabb)
+        dimensions = aabb[1] - aabb[0]
+        cls.scene_aabb = aabb.tolist()
+        cls.resize_scene_grid(resolution)
+
+        # Only a handful of boxes, so the links are counted on the CPU
+        # instead of with a second dispatch and a read back
+        bb_min, bb_max = cpu_voxelizer.box_bounds(instance_bounds, aabb, dimensions, resolution)
+        cls.scene_list_used = cpu_voxelizer.reference_count(bb_min, bb_max)
+        cls.resize_scene_list(cls.scene_list_used)
+
+        cls.reset_counter()
+
+        glUseProgram(cls.shader_clear.program)
+
+        loc = cls.shader_clear.get_location("voxels")
         glUniformHandleui64ARB(loc, cls.hnd_scene_voxel_data)
 
         glDispatchCompute(*cls.scene_resolution)
         glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
 
-        mesh_bounds = [mesh.aabb for mesh in meshes]
-        cls.scene_aabb[0][0] = min(mesh_bounds, key=lambda b: b[0][0])[0][0] * 1.1
-        cls.scene_aabb[0][1] = min(mesh_bounds, key=lambda b: b[0][1])[0][1] * 1.1
-        cls.scene_aabb[0][2] = min(mesh_bounds, key=lambda b: b[0][2])[0][2] * 1.1
-        cls.scene_aabb[1][0] = max(mesh_bounds, key=lambda b: b[1][0])[1][0] * 1.1
-        cls.scene_aabb[1][1] = max(mesh_bounds, key=lambda b: b[1][1])[1][1] * 1.1
-        cls.scene_aabb[1][2] = max(mesh_bounds, key=lambda b: b[1][2])[1][2] * 1.1
-
-        dimensions = (
-            cls.scene_aabb[1][0] - cls.scene_aabb[0][0],
-            cls.scene_aabb[1][1] - cls.scene_aabb[0][1],
-            cls.scene_aabb[1][2] - cls.scene_aabb[0][2]
-        )
-
-        glUseProgram(cls.shader_voxelize_scene)
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "u_res")
-        glUniform3f(loc, *cls.scene_resolution)
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "u_size")
-        glUniform3f(loc, *dimensions)
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "u_aabb[0]")
-        glUniform3f(loc, *cls.scene_aabb[0])
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "u_aabb[1]")
-        glUniform3f(loc, *cls.scene_aabb[1])
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "num_meshes")
-        glUniform1i(loc, len(meshes))
-
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "voxels")
-        glUniformHandleui64ARB(loc, cls.hnd_scene_voxel_data)
-
-        loc = glGetUniformLocation(cls.shader_voxelize_scene, "link_list")
-        glUniformHandleui64ARB(loc, cls.hnd_scene_voxel_list)
-
-        glDispatchCompute(len(meshes), 1, 1)
-        glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT)
-
-        # glBindTexture(GL_TEXTURE_3D, cls.tex_scene_voxel_data);
-        # data = (ctypes.c_uint32*8)()
-        # glGetTexImage(GL_TEXTURE_3D, 0, GL_RED_INTEGER, GL_UNSIGNED_INT, data)
-        # print('ures:', cls.scene_resolution)
-        # print('u_size:', dimensions)
-        # print('u_aabb', cls.scene_aabb)
-        # print(['END' if i == 4294967295 else i for i in data])
+        if instance_bounds:
+            shader = cls.shader_voxelize_scene
+            glUseProgram(shader.program)
+            glUniform3f(shader.get_location("u_res"), *cls.scene_resolution)
+            glUniform3f(shader.get_location("u_size"), *dimensions)
+            glUniform3f(shader.get_location("u_aabb[0]"), *cls.scene_aabb[0])
+            glUniform3f(shader.get_location("u_aabb[1]"), *cls.scene_aabb[1])
+            glUniform1i(shader.get_location("num_instances"), len(instance_bounds))
+            glUniformHandleui64ARB(shader.get_location("voxels"), cls.hnd_scene_voxel_data)
+            glUniformHandleui64ARB(shader.get_location("link_list"), cls.hnd_scene_voxel_list)
+
+            # One work group per instance, tiled over y past the per
+            # dimension group limit
+            glDispatchCompute(*plan_dispatch(len(instance_bounds), local_size=1))
+            glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT)
 
         glUseProgram(0)
 
-
     @classmethod
-    def voxelize_mesh(cls, mesh):
-        # start = time.perf_counter()
+    def _upload_batch(cls, meshes):
+        mesh_data = (GPU_MESH * len(meshes))(*[mesh.gpu_data for mesh in meshes])
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, cls.batch_mesh_buffer)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, ctypes.sizeof(mesh_data), mesh_data,
+                    GL_STREAM_DRAW)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 5, cls.batch_mesh_buffer)
 
-        glBindImageTexture(2, cls.tex_counter, 0, GL_FALSE, 0,
-                            GL_READ_WRITE, GL_R32UI)
-
-        glBindTexture(GL_TEXTURE_2D, cls.tex_counter)
-        data = (ctypes.c_uint32*1)(0)
-        glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, 1, 1, GL_RED_INTEGER,
-                        GL_UNSIGNED_INT, data)
+    @classmethod
+    def _reset_counters(cls, count):
+        counters = numpy.zeros(count, numpy.uint32)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, cls.batch_counter_buffer)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, counters.nbytes, counters, GL_STREAM_READ)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 7, cls.batch_counter_buffer)
 
-        glUseProgram(cls.shader_clear)
+    @classmethod
+    def _read_counters(cls, count):
+        glMemoryBarrier(GL_BUFFER_UPDATE_BARRIER_BIT)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, cls.batch_counter_buffer)
+        counters = (ctypes.c_uint32 * count)()
+        glGetBufferSubData(GL_SHADER_STORAGE_BUFFER, 0, ctypes.sizeof(counters), counters)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, 0)
+        return list(counters)
 
-        loc = glGetUniformLocation(cls.shader_clear, "voxels")
-        glUniformHandleui64ARB(loc, mesh.hnd_voxel_data)
+    @classmethod
+    def _dispatch(cls, voxel_pass, total):
+        glUniform1i(cls.shader_voxelize.get_location("u_pass"), voxel_pass)
+        glUniform1ui(cls.shader_voxelize.get_location("u_total"), total)
+        groups = plan_dispatch(total)
+        if groups[0]:
+            glDispatchCompute(*groups)
 
-        glDispatchCompute(*mesh.voxel_resolution)
+    @classmethod
+    def voxelize_meshes(cls, meshes, overlap="aabb", layout="lists"):
+        '''Voxelizes all meshes together: one dispatch counts the links every
+        mesh needs, then lists are resized from a single read back and one
+        dispatch each clears the grids and fills them. Returns the number of
+        links added to each mesh.
+
+        With the "csr" layout the count pass also counts per cell, a prefix
+        sum turns the counts into offsets and the fill pass scatters the
+        triangle ids into each cell's slice.'''
+        meshes = list(meshes)
+        if not meshes:
+            return []
+        overlap_mode = cpu_voxelizer.OVERLAP_MODES.index(overlap)
+        layout_mode = VOXEL_LAYOUTS.index(layout)
+        if layout_mode == LAYOUT_CSR:
+            for mesh in meshes:
+                mesh.clear_voxel_offsets()
+
+        jobs, tri_total, cell_total = plan_batch(meshes)
+        glBindBuffer(GL_SHADER_STORAGE_BUFFER, cls.batch_job_buffer)
+        glBufferData(GL_SHADER_STORAGE_BUFFER, jobs.nbytes, jobs, GL_STREAM_DRAW)
+        glBindBufferBase(GL_SHADER_STORAGE_BUFFER, 6, cls.batch_job_buffer)
+        cls._upload_batch(meshes)
+        cls._reset_counters(len(meshes))
+
+        glUseProgram(cls.shader_voxelize.program)
+        glUniform1i(cls.shader_voxelize.get_location("u_overlap"), overlap_mode)
+        glUniform1i(cls.shader_voxelize.get_location("u_layout"), layout_mode)
+        cls._dispatch(PASS_COUNT, tri_total)
+        counts = cls._read_counters(len(meshes))
+
+        # Lists are sized from the count, so the fill pass cannot overflow
+        resized = [mesh.resize_voxel_list(count) for mesh, count in zip(meshes, counts)]
+        if any(resized):
+            cls._upload_batch(meshes)
+
+        if layout_mode == LAYOUT_CSR:
+            # One work group scans the cell counts of each mesh
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+            glUseProgram(cls.shader_scan.program)
+            glDispatchCompute(len(meshes), 1, 1)
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+
+            glUseProgram(cls.shader_voxelize.program)
+            cls._dispatch(PASS_FILL, tri_total)
+            glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+            glUseProgram(0)
+            return counts
+
+        cls._reset_counters(len(meshes))
+
+        glUseProgram(cls.shader_voxelize.program)
+        cls._dispatch(PASS_CLEAR, cell_total)
         glMemoryBarrier(GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
-
-        glUseProgram(cls.shader_voxelize)
-        loc = glGetUniformLocation(cls.shader_voxelize, "u_res")
-        glUniform3f(loc, *mesh.voxel_resolution)
-        loc = glGetUniformLocation(cls.shader_voxelize, "u_size")
-        glUniform3f(loc, *mesh.dimensions)
-        loc = glGetUniformLocation(cls.shader_voxelize, "u_aabb[0]")
-        glUniform3f(loc, *mesh.aabb[0])
-        loc = glGetUniformLocation(cls.shader_voxelize, "u_aabb[1]")
-        glUniform3f(loc, *mesh.aabb[1])
-        loc = glGetUniformLocation(cls.shader_voxelize, "u_count")
-        glUniform1i(loc, mesh.count)
-
-        loc = glGetUniformLocation(cls.shader_voxelize, "tri_buffer")
-        glUniformHandleui64ARB(loc, mesh.hnd_indices)
-
-        loc = glGetUniformLocation(cls.shader_voxelize, "vert_buffer")
-        glUniformHandleui64ARB(loc, mesh.hnd_positions)
-
-        loc = glGetUniformLocation(cls.shader_voxelize, "voxels")
-        glUniformHandleui64ARB(loc, mesh.hnd_voxel_data)
-
-        loc = glGetUniformLocation(cls.shader_voxelize, "link_list")
-        glUniformHandleui64ARB(loc, mesh.hnd_voxel_list)
-
-        glDispatchCompute(mesh.count, 1, 1)
-        glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT)
+        cls._dispatch(PASS_FILL, tri_total)
+        glMemoryBarrier(GL_TEXTURE_FETCH_BARRIER_BIT | GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
 
         glUseProgram(0)
+        return counts
 
-        # glActiveTexture(GL_TEXTURE2)
-        # glGetTexImage(GL_TEXTURE_2D, 0, GL_RED_INTEGER, GL_UNSIGNED_INT, data)
-        # print("Voxelization time: %.2fms\n" % (time.perf_counter() - start) * 1000)
-        # print(data[0])
+    @classmethod
+    def voxelize_mesh(cls, mesh, overlap="aabb", layout="lists"):
+        return cls.voxelize_meshes([mesh], overlap, layout)[0]
+
+    @staticmethod
+    def read_csr(mesh):
+        '''Reads a "csr" mesh's offsets and triangle ids back from the GPU,
+        in the layout cpu_voxelizer.voxelize_csr builds'''
+        glMemoryBarrier(GL_BUFFER_UPDATE_BARRIER_BIT)
+        offsets = read_voxel_buffer(mesh.vbo_voxel_offsets, int(numpy.prod(mesh.voxel_resolution)) + 1)
+        tri_ids = read_voxel_buffer(mesh.vbo_voxel_tris, int(offsets[-1]))
+        return offsets, tri_ids
+
+    @staticmethod
+    def read_lists(mesh):
+        '''Reads a mesh's head pointer grid, indexed [x, y, z] like the CPU
+        voxelizer's, and its link list back from the GPU. Stalls, so only
+        meant for statistics and debugging.'''
+        glMemoryBarrier(GL_TEXTURE_UPDATE_BARRIER_BIT)
+        res = mesh.voxel_resolution
+        glBindTexture(GL_TEXTURE_3D, mesh.tex_voxel_data)
+        voxels = numpy.empty((res[2], res[1], res[0]), numpy.uint32)
+        glGetTexImage(GL_TEXTURE_3D, 0, GL_RED_INTEGER, GL_UNSIGNED_INT, voxels)
+        glBindTexture(GL_TEXTURE_3D, 0)
+
+        width, height = mesh.voxel_list_shape
+        glBindTexture(GL_TEXTURE_2D, mesh.tex_voxel_list)
+        links = numpy.empty((height, width, 2), numpy.uint32)
+        glGetTexImage(GL_TEXTURE_2D, 0, GL_RG_INTEGER, GL_UNSIGNED_INT, links)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return voxels.transpose(2, 1, 0), links.reshape(-1, 2)
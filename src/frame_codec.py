@@ -0,0 +1,167 @@
+import struct
+import zlib
+
+import numpy
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from socket_api import *
+
+
+TILE_HEADER = "II"
+
+
+def compress(codec, data):
+    if codec == FrameCodecs.zlib:
+        return zlib.compress(data, 1)
+    elif codec == FrameCodecs.lz4:
+        return lz4.frame.compress(data)
+    return data
+
+
+def decompress(codec, data):
+    if codec == FrameCodecs.zlib:
+        return zlib.decompress(data)
+    elif codec == FrameCodecs.lz4:
+        return lz4.frame.decompress(data)
+    return data
+
+
+def _tile_grid(height, width, tile_size):
+    return (-(-height // tile_size), -(-width // tile_size))
+
+
+def _tile_slices(index, grid_width, tile_size):
+    y, x = divmod(index, grid_width)
+    return (slice(y * tile_size, (y + 1) * tile_size),
+            slice(x * tile_size, (x + 1) * tile_size))
+
+
+def supported_codecs():
+    '''Names of the codecs this installation can decode'''
+    return [codec.name for codec in FrameCodecs if codec != FrameCodecs.lz4 or lz4 is not None]
+
+
+class FrameEncoder:
+    '''Encodes frames for the return stream. With the legacy protocol every
+    frame is sent whole and uncompressed behind a width and height, as
+    receivers that never sent DataIDs.capabilities expect.'''
+    def __init__(self, codec=FrameCodecs.raw, tile_size=32, protocol=FRAME_PROTOCOL):
+        if codec == FrameCodecs.lz4 and lz4 is None:
+            print("lz4 is not installed, falling back to zlib")
+            codec = FrameCodecs.zlib
+
+        self.requested_codec = codec
+        self.codec = codec
+        self.tile_size = tile_size
+        self.protocol = protocol
+        self._previous = None
+
+    @property
+    def legacy(self):
+        return self.protocol < FRAME_PROTOCOL
+
+    def reset(self):
+        self._previous = None
+
+    def negotiate(self, capabilities):
+        '''Switches to the newest protocol both sides speak and to the
+        requested codec if the receiver can decode it, raw otherwise'''
+        self.protocol = min(int(capabilities.get("frame_protocol", LEGACY_FRAME_PROTOCOL)), FRAME_PROTOCOL)
+        codecs = capabilities.get("codecs", ())
+        self.codec = self.requested_codec if self.requested_codec.name in codecs else FrameCodecs.raw
+        self.reset()
+        print("Frame protocol %d, %s frames" % (self.protocol, self.codec.name))
+
+    def _changed_tiles(self, frame):
+        height, width = frame.shape[:2]
+        grid = _tile_grid(height, width, self.tile_size)
+
+        changed = numpy.zeros((grid[0] * self.tile_size, grid[1] * self.tile_size), bool)
+        changed[:height, :width] = (frame != self._previous).any(axis=2)
+        changed = changed.reshape(grid[0], self.tile_size, grid[1], self.tile_size)
+        return numpy.flatnonzero(changed.any(axis=(1, 3))).astype(numpy.uint32), grid
+
+    def encode(self, frame):
+        '''Takes an (height, width, 3) uint8 array and returns the header and
+        payload for the frame return stream'''
+        height, width = frame.shape[:2]
+        if self.legacy:
+            return encode_legacy_frame_header(width, height), numpy.ascontiguousarray(frame).tobytes()
+
+        if self._previous is not None and self._previous.shape == frame.shape:
+            tiles, grid = self._changed_tiles(frame)
+            if len(tiles) == 0:
+                return encode_frame_header(width, height, FrameKinds.unchanged, FrameCodecs.raw, 0), b""
+
+            if len(tiles) * 2 < grid[0] * grid[1]:
+                parts = [struct.pack(TILE_HEADER, self.tile_size, len(tiles)), tiles.tobytes()]
+                for index in tiles:
+                    rows, cols = _tile_slices(int(index), grid[1], self.tile_size)
+                    parts.append(frame[rows, cols].tobytes())
+                self._previous[...] = frame
+                return self._finish(width, height, FrameKinds.delta, b"".join(parts))
+
+        self._previous = numpy.array(frame)
+        return self._finish(width, height, FrameKinds.full, self._previous.tobytes())
+
+    def _finish(self, width, height, kind, payload):
+        payload = compress(self.codec, payload)
+        return encode_frame_header(width, height, kind, self.codec, len(payload)), payload
+
+
+def encode_message_frame(method, data_id, data):
+    '''Wraps a JSON message so it can travel in the frame stream'''
+    payload = encode_message(method, data_id, data)
+    return encode_frame_header(0, 0, FrameKinds.message, FrameCodecs.raw, len(payload)), payload
+
+
+class FrameDecoder:
+    def __init__(self, protocol=FRAME_PROTOCOL):
+        self.protocol = protocol
+        self.frame = None
+        # (method_id, data_id, data) of messages received between frames
+        self.messages = []
+
+    def capabilities(self):
+        '''The DataIDs.capabilities message announcing this decoder'''
+        return {"frame_protocol": self.protocol, "codecs": supported_codecs()}
+
+    def read(self, _socket):
+        '''Blocks until a whole frame has arrived and returns it'''
+        if self.protocol < FRAME_PROTOCOL:
+            width, height = decode_legacy_frame_header(recv_exactly(_socket, LEGACY_FRAME_HEADER_SIZE))
+            payload = recv_exactly(_socket, width * height * 3)
+            return self.decode(width, height, FrameKinds.full, FrameCodecs.raw, payload)
+
+        header = decode_frame_header(recv_exactly(_socket, FRAME_HEADER_SIZE))
+        return self.decode(*header[:4], recv_exactly(_socket, header[4]))
+
+    def decode(self, width, height, kind, codec, payload):
+        if kind == FrameKinds.unchanged:
+            return self.frame
+        if kind == FrameKinds.message:
+            self.messages.append(decode_message(payload))
+            return self.frame
+
+        payload = decompress(codec, payload)
+        if kind == FrameKinds.full:
+            self.frame = numpy.frombuffer(payload, numpy.uint8).reshape(height, width, 3).copy()
+            return self.frame
+
+        tile_size, count = struct.unpack_from(TILE_HEADER, payload)
+        offset = struct.calcsize(TILE_HEADER)
+        tiles = numpy.frombuffer(payload, numpy.uint32, count, offset)
+        offset += tiles.nbytes
+
+        grid_width = _tile_grid(height, width, tile_size)[1]
+        for index in tiles:
+            rows, cols = _tile_slices(int(index), grid_width, tile_size)
+            target = self.frame[rows, cols]
+            size = target.size
+            target[...] = numpy.frombuffer(payload, numpy.uint8, size, offset).reshape(target.shape)
+            offset += size
+        return self.frame
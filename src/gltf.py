@@ -0,0 +1,224 @@
+import base64
+
+import numpy
+
+
+COMPONENT_TYPES = {
+    5120: numpy.int8,
+    5121: numpy.uint8,
+    5122: numpy.int16,
+    5123: numpy.uint16,
+    5125: numpy.uint32,
+    5126: numpy.float32,
+}
+
+
+TYPE_SHAPES = {
+    "SCALAR": (1, 1),
+    "VEC2": (1, 2),
+    "VEC3": (1, 3),
+    "VEC4": (1, 4),
+    "MAT2": (2, 2),
+    "MAT3": (3, 3),
+    "MAT4": (4, 4),
+}
+
+
+class BufferCache:
+    def __init__(self, gltf, chunks=None):
+        self.gltf = gltf
+        self._buffers = {}
+
+        # Binary payloads carry one raw chunk per buffer, in document order
+        if chunks is not None:
+            keys = gltf["buffers"]
+            if not isinstance(keys, dict):
+                keys = range(len(keys))
+            self._buffers = {key: memoryview(chunk) for key, chunk in zip(keys, chunks)}
+
+    def get(self, index):
+        if index not in self._buffers:
+            self._buffers[index] = self._decode(self.gltf["buffers"][index])
+        return self._buffers[index]
+
+    def _decode(self, info):
+        uri = info["uri"]
+        if not uri.startswith("data:"):
+            raise ValueError("Unsupported buffer uri: %s" % uri[:32])
+        return memoryview(base64.b64decode(uri.split(",", 1)[1]))
+
+
+def read_accessor(gltf, index, buffers):
+    '''Returns a contiguous array of shape (count,) for scalars, (count, n) for
+    vectors or (count, cols, rows) for matrices'''
+    accessor = gltf["accessors"][index]
+    dtype = numpy.dtype(COMPONENT_TYPES[accessor["componentType"]])
+    cols, rows = TYPE_SHAPES[accessor["type"]]
+    count = accessor["count"]
+
+    if accessor.get("bufferView") is None:
+        out = numpy.zeros((count, cols, rows), dtype)
+    else:
+        bufview = gltf["bufferViews"][accessor["bufferView"]]
+        data = buffers.get(bufview["buffer"])
+        offset = bufview.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+
+        # Matrix columns are aligned to four bytes
+        col_stride = rows * dtype.itemsize
+        if cols > 1:
+            col_stride = (col_stride + 3) & ~3
+        stride = accessor.get("byteStride") or bufview.get("byteStride") or col_stride * cols
+
+        out = numpy.ndarray((count, cols, rows), dtype, data, offset,
+                            (stride, col_stride, dtype.itemsize))
+
+    if accessor.get("normalized") and dtype.kind in "iu":
+        info = numpy.iinfo(dtype)
+        out = numpy.maximum(out.astype(numpy.float32) / info.max, -1.0)
+
+    if cols == 1:
+        out = out.reshape(count, rows) if rows > 1 else out.reshape(count)
+    return numpy.ascontiguousarray(out)
+
+
+def items(collection):
+    '''(id, entry) pairs of a glTF 1.0 dictionary or a glTF 2.0 list'''
+    if isinstance(collection, dict):
+        return collection.items()
+    return enumerate(collection)
+
+
+def find_id(collection, key):
+    '''The key of collection matching key or None. JSON object keys are
+    always strings, so "3" also finds glTF 2.0 index 3.'''
+    if key in collection:
+        return key
+    if isinstance(key, str):
+        try:
+            index = int(key)
+        except ValueError:
+            return None
+        if index in collection:
+            return index
+    return None
+
+
+def node_matrix(node):
+    '''The local transform of a node as a 4x4 array acting on column vectors,
+    from its column major matrix or its translation, rotation and scale'''
+    if "matrix" in node:
+        return numpy.asarray(node["matrix"], numpy.float64).reshape(4, 4).T
+
+    x, y, z, w = node.get("rotation", (0.0, 0.0, 0.0, 1.0))
+    rotation = numpy.array([
+        [1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+        [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+        [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)],
+    ])
+    matrix = numpy.identity(4)
+    matrix[:3, :3] = rotation * numpy.asarray(node.get("scale", (1.0, 1.0, 1.0)))
+    matrix[:3, 3] = node.get("translation", (0.0, 0.0, 0.0))
+    return matrix
+
+
+def node_meshes(node):
+    '''Ids of the meshes a node places: a list in glTF 1.0, one in 2.0'''
+    if "mesh" in node:
+        return [node["mesh"]]
+    return node.get("meshes", [])
+
+
+class NodeTree:
+    '''The node hierarchy received so far. Keeps parents and local
+    transforms, so transform and removal updates can be applied without
+    the rest of the document.'''
+    def __init__(self):
+        self.nodes = {}
+        self.parents = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def update(self, nodes):
+        '''Adds or replaces nodes given as {id: node} and returns the ids
+        whose world transform may have changed'''
+        for node_id, node in nodes.items():
+            old = self.nodes.get(node_id)
+            if old is not None:
+                for child in old.get("children", ()):
+                    if self.parents.get(child) == node_id:
+                        del self.parents[child]
+            self.nodes[node_id] = node
+            for child in node.get("children", ()):
+                self.parents[child] = node_id
+        return self.subtree(nodes)
+
+    def set_transforms(self, transforms):
+        '''Replaces the local transform of nodes given as {id: {"matrix": ...}}
+        or translation, rotation and scale. Returns the ids whose world
+        transform changed.'''
+        moved = []
+        for key, transform in transforms.items():
+            node_id = self.find(key)
+            if node_id is None:
+                print("Transform for unknown node", key)
+                continue
+            node = {k: v for k, v in self.nodes[node_id].items()
+                    if k not in ("matrix", "translation", "rotation", "scale")}
+            node.update(transform)
+            self.nodes[node_id] = node
+            moved.append(node_id)
+        return self.subtree(moved)
+
+    def find(self, node_id):
+        '''The id of the stored node matching node_id or None, see find_id'''
+        return find_id(self.nodes, node_id)
+
+    def remove(self, node_ids):
+        '''Removes nodes, matched with find; their children become roots.
+        Returns the ids whose world transform changed.'''
+        orphans = []
+        for key in node_ids:
+            node_id = self.find(key)
+            if node_id is None:
+                continue
+            node = self.nodes.pop(node_id)
+            parent = self.parents.pop(node_id, None)
+            if parent in self.nodes:
+                children = self.nodes[parent].get("children", [])
+                self.nodes[parent]["children"] = [c for c in children if c != node_id]
+            for child in node.get("children", ()):
+                if self.parents.get(child) == node_id:
+                    del self.parents[child]
+                    orphans.append(child)
+        return self.subtree(orphans)
+
+    def subtree(self, node_ids):
+        '''The given nodes that exist and all their descendants'''
+        found = []
+        stack = [node_id for node_id in node_ids if node_id in self.nodes]
+        seen = set()
+        while stack:
+            node_id = stack.pop()
+            if node_id in seen or node_id not in self.nodes:
+                continue
+            seen.add(node_id)
+            found.append(node_id)
+            stack.extend(self.nodes[node_id].get("children", ()))
+        return found
+
+    def world_transform(self, node_id):
+        '''A node's local transform composed with those of its ancestors'''
+        matrix = node_matrix(self.nodes[node_id])
+        parent = self.parents.get(node_id)
+        while parent in self.nodes:
+            matrix = node_matrix(self.nodes[parent]) @ matrix
+            parent = self.parents.get(parent)
+        return matrix
+
+
+def world_transforms(gltf):
+    '''Maps every node id to its world transform'''
+    tree = NodeTree()
+    tree.update(dict(items(gltf.get("nodes", {}))))
+    return {node_id: tree.world_transform(node_id) for node_id in tree.nodes}
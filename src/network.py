@@ -0,0 +1,157 @@
+import collections
+import json
+import queue
+import select
+import threading
+
+import numpy
+
+from socket_api import *
+
+
+# Only the most recent of these matter, so older ones are dropped
+LATEST_WINS = (DataIDs.view, DataIDs.projection, DataIDs.viewport)
+
+
+class NetworkThread(threading.Thread):
+    '''Owns the socket so that downloads and frame uploads never block the
+    render loop. Commands are handed over through poll() and frames through
+    submit_frame().'''
+    def __init__(self, _socket, encoder, max_queued=8):
+        threading.Thread.__init__(self, daemon=True)
+        self._socket = _socket
+        # Only this thread encodes, so delta frames are always computed
+        # against the last frame that was actually sent
+        self._encoder = encoder
+        self._reader = MessageReader()
+
+        self._lock = threading.Lock()
+        self._latest = collections.OrderedDict()
+        self._messages = queue.Queue(max_queued)
+        # Messages waiting for room in the queue; the socket is not read
+        # while any are held, so the sender is slowed down instead
+        self._overflow = collections.deque()
+
+        self._pending_frame = None
+        self._pending_messages = collections.deque()
+        self._sending = collections.deque()
+
+        self.running = True
+        self.closed = False
+        # Exception that ended the thread, raised again by poll()
+        self.error = None
+
+    def poll(self):
+        '''Returns the (method_id, data_id, data, chunks) tuples received since
+        the last call. Raises the error that stopped the thread, if any.'''
+        if self.error is not None:
+            raise self.error
+
+        messages = []
+        while True:
+            try:
+                messages.append(self._messages.get_nowait())
+            except queue.Empty:
+                break
+
+        with self._lock:
+            latest = list(self._latest.values())
+            self._latest.clear()
+        return latest + messages
+
+    def submit_frame(self, frame):
+        '''Replaces any frame that has not started sending yet. The frame is
+        copied since the caller reuses its read back buffer.'''
+        frame = numpy.array(frame)
+        with self._lock:
+            self._pending_frame = frame
+
+    def submit_message(self, header, payload):
+        '''Queues a message frame; unlike frames these are never dropped,
+        except for receivers on the legacy protocol, which cannot read them'''
+        with self._lock:
+            self._pending_messages.append((header, payload))
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+    def run(self):
+        self._socket.setblocking(False)
+        try:
+            while self.running:
+                if not self._sending:
+                    frame = None
+                    with self._lock:
+                        if self._pending_messages:
+                            message = self._pending_messages.popleft()
+                            if not self._encoder.legacy:
+                                self._sending.extend(memoryview(part) for part in message)
+                        elif self._pending_frame is not None:
+                            frame = self._pending_frame
+                            self._pending_frame = None
+                    if frame is not None:
+                        self._sending.extend(memoryview(part) for part in self._encoder.encode(frame))
+
+                self._flush()
+                readers = [] if self._overflow else [self._socket]
+                writers = [self._socket] if self._sending else []
+                readable, writable, _ = select.select(readers, writers, [], 0.005)
+                if readable:
+                    self._receive()
+                if writable:
+                    self._send()
+        except (ConnectionResetError, BrokenPipeError):
+            print("Connection reset")
+        except Exception as error:
+            self.error = error
+        finally:
+            self.closed = True
+
+    def _flush(self):
+        while self._overflow:
+            try:
+                self._messages.put_nowait(self._overflow[0])
+            except queue.Full:
+                return
+            self._overflow.popleft()
+
+    def _receive(self):
+        while True:
+            message = self._reader.read(self._socket)
+            if message is None:
+                return
+
+            method_id, data_id, payload = message
+            chunks = None
+            if data_id == DataIDs.gltf_binary:
+                # The reader reuses its buffer, so keep a private copy
+                data, chunks = decode_binary_payload(bytearray(payload))
+            else:
+                data = json.loads(bytes(payload).decode())
+
+            message = (method_id, data_id, data, chunks)
+            if data_id == DataIDs.capabilities:
+                # Answered here, since only this thread encodes frames
+                self._encoder.negotiate(data)
+            elif data_id in LATEST_WINS:
+                with self._lock:
+                    self._latest.pop(data_id, None)
+                    self._latest[data_id] = message
+            else:
+                self._overflow.append(message)
+                self._flush()
+                if self._overflow:
+                    return
+
+    def _send(self):
+        while self._sending:
+            view = self._sending[0]
+            try:
+                sent = self._socket.send(view)
+            except BlockingIOError:
+                return
+            if sent < len(view):
+                self._sending[0] = view[sent:]
+            else:
+                self._sending.popleft()
@@ -20,11 +20,95 @@ class MethodIDs(AutoNumber):
 
 
 class DataIDs(AutoNumber):
-	__order__ = "view projection viewport gltf"
+	__order__ = "view projection viewport gltf gltf_binary stats transform capabilities"
 	view = ()
 	projection = ()
 	viewport = ()
 	gltf = ()
+	gltf_binary = ()
+	stats = ()
+	# Node transforms only, {"nodes": {id: {"matrix": ...}}}
+	transform = ()
+	# Sent by receivers of the framed return stream, {"frame_protocol": 2,
+	# "codecs": ["raw", ...]}. Without it frames use the legacy protocol.
+	capabilities = ()
+
+
+class FrameKinds(AutoNumber):
+	__order__ = "full delta unchanged message"
+	full = ()
+	delta = ()
+	unchanged = ()
+	# Carries an encode_message payload instead of pixels
+	message = ()
+
+
+class FrameCodecs(AutoNumber):
+	__order__ = "raw zlib lz4"
+	raw = ()
+	zlib = ()
+	lz4 = ()
+
+
+HEADER_SIZE = 5
+# Legacy frames are a width and height followed by raw RGB rows
+LEGACY_FRAME_PROTOCOL = 1
+LEGACY_FRAME_HEADER = "HH"
+LEGACY_FRAME_HEADER_SIZE = struct.calcsize(LEGACY_FRAME_HEADER)
+FRAME_PROTOCOL = 2
+FRAME_HEADER = "HHBBI"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
+
+class BufferPool:
+	def __init__(self, initial_size=2**16):
+		self._buffer = bytearray(initial_size)
+
+	def get(self, size):
+		'''The returned view is only valid until the next call'''
+		if size > len(self._buffer):
+			capacity = max(len(self._buffer), 1)
+			while capacity < size:
+				capacity *= 2
+			# Views into the old buffer may still be alive, so never resize in place
+			self._buffer = bytearray(capacity)
+		return memoryview(self._buffer)[:size]
+
+
+class MessageReader:
+	def __init__(self, pool=None):
+		self.pool = pool if pool is not None else BufferPool()
+		self._header = bytearray(HEADER_SIZE)
+		self._body = None
+		self._received = 0
+
+	def _recv_into(self, _socket, view):
+		count = _socket.recv_into(view, min(2**23, len(view)))
+		if count == 0:
+			raise ConnectionResetError("Socket closed by peer")
+		self._received += count
+
+	def read(self, _socket):
+		'''Returns (method_id, data_id, payload) for a complete message or None
+		if the socket would block. Partial reads are kept for the next call.'''
+		try:
+			header = memoryview(self._header)
+			while self._received < HEADER_SIZE:
+				self._recv_into(_socket, header[self._received:])
+
+			if self._body is None:
+				self._body = self.pool.get(decode_size_message(self._header[1:]))
+
+			while self._received - HEADER_SIZE < len(self._body):
+				self._recv_into(_socket, self._body[self._received - HEADER_SIZE:])
+		except BlockingIOError:
+			return None
+
+		method_id, data_id = decode_cmd_message(self._header[:1])
+		payload = self._body
+		self._body = None
+		self._received = 0
+		return method_id, data_id, payload
 
 
 def send_message(_socket, method, data_id, data):
@@ -50,6 +134,65 @@ def send_message(_socket, method, data_id, data):
 	_socket.setblocking(False)
 
 
+def encode_message(method, data_id, data):
+	'''The bytes send_message writes for a JSON message'''
+	data_str = json.dumps(data).encode()
+	return encode_cmd_message(method, data_id) + struct.pack("I", len(data_str)) + data_str
+
+
+def decode_message(message):
+	'''Returns (method_id, data_id, data) for the output of encode_message'''
+	method_id, data_id = decode_cmd_message(message[:1])
+	size = decode_size_message(message[1:HEADER_SIZE])
+	data = json.loads(bytes(message[HEADER_SIZE:HEADER_SIZE + size]).decode())
+	return method_id, data_id, data
+
+
+def send_binary_message(_socket, method, data_id, header, chunks):
+	payload = encode_binary_payload(header, chunks)
+	size = sum(len(part) for part in payload)
+
+	_socket.setblocking(True)
+	try:
+		_socket.sendall(encode_cmd_message(method, data_id) + struct.pack("I", size))
+		for part in payload:
+			_socket.sendall(part)
+	except socket.timeout:
+		print("Failed to send message (%s, %s)." % (method.name, data_id.name))
+
+	_socket.setblocking(False)
+
+
+def _padding(size, fill=b"\0"):
+	return fill * (-size % 4)
+
+
+def encode_binary_payload(header, chunks):
+	'''Lays out a JSON header followed by raw chunks aligned to four bytes'''
+	header = dict(header, chunks=[len(chunk) for chunk in chunks])
+	header_bytes = json.dumps(header).encode()
+	header_bytes += _padding(len(header_bytes), b" ")
+
+	payload = [struct.pack("I", len(header_bytes)), header_bytes]
+	for chunk in chunks:
+		payload.append(chunk)
+		payload.append(_padding(len(chunk)))
+	return payload
+
+
+def decode_binary_payload(payload):
+	payload = memoryview(payload)
+	header_size = struct.unpack_from("I", payload)[0]
+	offset = 4 + header_size
+	header = json.loads(bytes(payload[4:offset]).decode())
+
+	chunks = []
+	for size in header.pop("chunks"):
+		chunks.append(payload[offset:offset + size])
+		offset += size + (-size % 4)
+	return header, chunks
+
+
 def encode_cmd_message(method_id, data_id):
 	message = data_id.value & 0b00001111
 	message |= method_id.value << 4
@@ -65,3 +208,32 @@ def decode_cmd_message(message):
 
 def decode_size_message(message):
 	return struct.unpack('I', message)[0]
+
+
+def encode_frame_header(width, height, kind, codec, size):
+	return struct.pack(FRAME_HEADER, width, height, kind.value, codec.value, size)
+
+
+def decode_frame_header(message):
+	width, height, kind, codec, size = struct.unpack(FRAME_HEADER, message)
+	return width, height, FrameKinds(kind), FrameCodecs(codec), size
+
+
+def encode_legacy_frame_header(width, height):
+	return struct.pack(LEGACY_FRAME_HEADER, width, height)
+
+
+def decode_legacy_frame_header(message):
+	return struct.unpack(LEGACY_FRAME_HEADER, message)
+
+
+def recv_exactly(_socket, size):
+	data = bytearray(size)
+	view = memoryview(data)
+	received = 0
+	while received < size:
+		count = _socket.recv_into(view[received:])
+		if count == 0:
+			raise ConnectionResetError("Socket closed by peer")
+		received += count
+	return data
@@ -0,0 +1,69 @@
+import numpy
+import pytest
+
+import adaptive
+from adaptive import SCALE_STEP, AdaptiveResolution, upscale
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''Replaces perf_counter with a clock the test advances'''
+    now = [100.0]
+    monkeypatch.setattr(adaptive.time, "perf_counter", lambda: now[0])
+    return now
+
+
+def test_scale_steps_are_quantized(clock):
+    resolution = AdaptiveResolution(budget_ms=10.0)
+    resolution.motion()
+    assert resolution.update(40.0) == 0.5
+    # sqrt(1 / 1.1) of 0.5 rounds down to the step below
+    assert resolution.update(11.0) == 7 * SCALE_STEP
+    # Climbing is limited to 1.25x per frame
+    assert resolution.update(1.0) == 8 * SCALE_STEP
+    assert resolution.update(1000.0) == resolution.min_scale
+    for frame_ms in (3.0, 7.0, 9.5, 12.0, 2.0):
+        scale = resolution.update(frame_ms)
+        assert scale / SCALE_STEP == int(scale / SCALE_STEP)
+        assert resolution.min_scale <= scale <= 1.0
+
+
+def test_refines_over_three_frames(clock):
+    resolution = AdaptiveResolution(budget_ms=10.0, settle_time=0.1, refine_frames=3)
+    resolution.motion()
+    resolution.update(1000.0)
+    assert resolution.scale == 0.25
+    assert not resolution.settled
+
+    # Still moving within the settle time
+    clock[0] += 0.05
+    assert resolution.update(1.0) == 0.3125
+
+    clock[0] += 0.1
+    scales = [resolution.update(1.0) for _ in range(3)]
+    assert scales == pytest.approx([0.5625, 0.8125, 1.0])
+    assert resolution.settled
+    assert resolution.update(1.0) == 1.0
+
+
+def test_size_rounds_up(clock):
+    resolution = AdaptiveResolution()
+    assert resolution.size(1506, 871) == (1506, 871)
+    resolution.scale = 0.25
+    assert resolution.size(1506, 871) == (377, 218)
+    assert resolution.size(2, 1) == (1, 1)
+
+
+def test_upscale_nearest_neighbour():
+    image = numpy.arange(2 * 3 * 3, dtype=numpy.uint8).reshape(2, 3, 3)
+    assert upscale(image, 3, 2) is image
+
+    large = upscale(image, 7, 5)
+    assert large.shape == (5, 7, 3)
+    rows = numpy.arange(5) * 2 // 5
+    cols = numpy.arange(7) * 3 // 7
+    for y in range(5):
+        for x in range(7):
+            assert numpy.array_equal(large[y, x], image[rows[y], cols[x]])
+    assert numpy.array_equal(large[0, 0], image[0, 0])
+    assert numpy.array_equal(large[-1, -1], image[-1, -1])
@@ -0,0 +1,102 @@
+import pytest
+
+from engine.allocator import RangeAllocator
+
+
+def test_allocate_first_fit():
+    allocator = RangeAllocator(10)
+    assert allocator.allocate(4) == 0
+    assert allocator.allocate(4) == 4
+    assert allocator.allocate(4) is None
+    assert allocator.allocate(2) == 8
+    assert allocator.used == 10
+    assert allocator.end == 10
+
+
+def test_allocate_zero_takes_a_unit():
+    allocator = RangeAllocator(4)
+    empty = allocator.allocate(0)
+    other = allocator.allocate(1)
+    assert empty != other
+    allocator.free(empty)
+    assert other in allocator.allocations
+    assert allocator.allocate(3) is None
+    assert allocator.allocate(1) == empty
+
+
+def test_free_reuses_hole():
+    allocator = RangeAllocator(12)
+    first, second, third = (allocator.allocate(4) for _ in range(3))
+    allocator.free(second)
+    assert allocator.allocate(4) == second
+    assert allocator.allocations == {first: 4, second: 4, third: 4}
+
+
+def test_free_merges_neighbours():
+    allocator = RangeAllocator(12)
+    first, second, third = (allocator.allocate(4) for _ in range(3))
+    allocator.free(first)
+    allocator.free(third)
+    allocator.free(second)
+    assert allocator.allocations == {}
+    assert allocator.allocate(12) == 0
+
+
+def test_grow_extends_trailing_free_block():
+    allocator = RangeAllocator()
+    assert allocator.allocate(1) is None
+    allocator.grow(3)
+    assert allocator.capacity == 4
+    assert allocator.allocate(3) == 0
+    allocator.grow(6)
+    assert allocator.capacity == 8
+    # The one unit left before growing joins the new space
+    assert allocator.allocate(5) == 3
+
+
+def test_grow_after_full_range():
+    allocator = RangeAllocator(4)
+    allocator.allocate(4)
+    allocator.grow(5)
+    assert allocator.capacity == 8
+    assert allocator.allocate(4) == 4
+
+
+def test_fragmentation_and_compact():
+    allocator = RangeAllocator(16)
+    offsets = [allocator.allocate(4) for _ in range(4)]
+    allocator.free(offsets[0])
+    allocator.free(offsets[2])
+    assert allocator.fragmentation() == pytest.approx(0.5)
+
+    moves = allocator.compact()
+    assert moves == {offsets[1]: 0, offsets[3]: 4}
+    assert allocator.allocations == {0: 4, 4: 4}
+    assert allocator.fragmentation() == 0.0
+    assert allocator.allocate(8) == 8
+
+
+def test_compact_within_budget():
+    allocator = RangeAllocator(32)
+    offsets = [allocator.allocate(4) for _ in range(6)]
+    for offset in offsets[::2]:
+        allocator.free(offset)
+
+    assert allocator.compact(budget=4) == {offsets[1]: 0}
+    assert allocator.allocations == {0: 4, offsets[3]: 4, offsets[5]: 4}
+    # The holes left behind are still free
+    assert allocator.allocate(8) == 4
+    allocator.free(4)
+
+    assert allocator.compact(budget=4) == {offsets[3]: 4}
+    assert allocator.compact(budget=4) == {offsets[5]: 8}
+    assert allocator.fragmentation() == 0.0
+    assert allocator.compact(budget=4) == {}
+
+
+def test_compact_budget_moves_one_large_range():
+    allocator = RangeAllocator(16)
+    first = allocator.allocate(2)
+    allocator.allocate(8)
+    allocator.free(first)
+    assert allocator.compact(budget=1) == {2: 0}
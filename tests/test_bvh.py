@@ -0,0 +1,101 @@
+import ctypes
+
+import numpy
+import pytest
+
+from engine import bvh
+from engine.cpu_tracer import CpuTracer
+from engine.gpu_types import BVH_NODE
+from engine.instance import Instance
+from engine.mesh_data import MeshData
+
+
+def soup(count, seed=0):
+    rng = numpy.random.default_rng(seed)
+    centers = rng.random((count, 1, 3), numpy.float32)
+    positions = (centers + (rng.random((count, 3, 3), numpy.float32) - 0.5) * 0.1).reshape(-1, 3)
+    return positions, numpy.arange(len(positions), dtype=numpy.uint32)
+
+
+def leaf_ranges(nodes):
+    leaves = nodes[nodes["count"] > 0]
+    return sorted(zip(leaves["first"].tolist(), leaves["count"].tolist()))
+
+
+def check_tree(nodes, order, positions, indices):
+    '''Children lie inside their parent, leaves cover their triangles and
+    every triangle sits in exactly one leaf'''
+    verts = positions[indices.reshape(-1, 3)]
+    for node in nodes:
+        if node["count"]:
+            tris = verts[order[node["first"]:node["first"] + node["count"]]]
+            assert numpy.all(tris.min(axis=(0, 1)) >= node["lower"])
+            assert numpy.all(tris.max(axis=(0, 1)) <= node["upper"])
+        else:
+            for child in nodes[node["first"]:node["first"] + 2]:
+                assert numpy.all(child["lower"] >= node["lower"])
+                assert numpy.all(child["upper"] <= node["upper"])
+
+    offset = 0
+    for first, count in leaf_ranges(nodes):
+        assert first == offset
+        offset += count
+    assert offset == len(verts)
+    assert sorted(order.tolist()) == list(range(len(verts)))
+
+
+def test_layout_matches_gpu_struct():
+    assert bvh.BVH_NODE_DTYPE.itemsize == ctypes.sizeof(BVH_NODE)
+
+
+@pytest.mark.parametrize("count", [1, 5, 300])
+def test_bounds_contain_children_and_triangles(count):
+    positions, indices = soup(count)
+    nodes, order = bvh.build_bvh(positions, indices)
+    check_tree(nodes, order, positions, indices)
+    assert numpy.all(nodes["count"] <= bvh.MAX_LEAF_SIZE * 4)
+
+
+def test_empty_mesh_has_inverted_root():
+    nodes, order = bvh.build_bvh(numpy.zeros((0, 3), numpy.float32), numpy.zeros(0, numpy.uint32))
+    assert len(nodes) == 1
+    assert len(order) == 0
+    assert numpy.all(nodes["lower"][0] > nodes["upper"][0])
+
+
+def test_max_depth_forces_leaves(monkeypatch):
+    monkeypatch.setattr(bvh, "MAX_DEPTH", 3)
+    positions, indices = soup(500)
+    nodes, order = bvh.build_bvh(positions, indices)
+    assert bvh.tree_depth(nodes) == 3
+    check_tree(nodes, order, positions, indices)
+    assert nodes["count"].max() > bvh.MAX_LEAF_SIZE * 4
+
+
+def test_unsplittable_triangles_stay_in_one_leaf():
+    # Identical centroids give no split that separates anything
+    positions = numpy.tile(numpy.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], numpy.float32), (40, 1))
+    indices = numpy.arange(len(positions), dtype=numpy.uint32)
+    nodes, order = bvh.build_bvh(positions, indices)
+    assert len(nodes) == 1
+    assert nodes["count"][0] == 40
+
+
+def test_bvh_and_grid_traces_agree():
+    positions, indices = soup(2000, seed=3)
+    mesh = MeshData(positions, numpy.tile([0, 0, 1], (len(positions), 1)), indices)
+    moved = numpy.identity(4)
+    moved[:3, 3] = [0.5, 0.0, 1.5]
+    instances = [Instance("a", mesh), Instance("b", mesh, moved)]
+
+    rng = numpy.random.default_rng(1)
+    ray_o = numpy.column_stack([rng.random((4000, 2)) * 1.5 - 0.2, numpy.full(4000, 5.0)]).astype(numpy.float32)
+    ray_d = numpy.column_stack([(rng.random((4000, 2)) - 0.5) * 0.2, -numpy.ones(4000)]).astype(numpy.float32)
+    ray_d /= numpy.linalg.norm(ray_d, axis=1)[:, numpy.newaxis]
+
+    grid = CpuTracer("grid").trace(instances, ray_o, ray_d)
+    tree = CpuTracer("bvh").trace(instances, ray_o, ray_d)
+    assert (grid["instance_id"] >= 0).sum() > 1000
+    assert numpy.array_equal(grid["instance_id"], tree["instance_id"])
+    assert numpy.allclose(grid["t"], tree["t"], atol=1e-5)
+    assert numpy.mean(grid["tri_id"] == tree["tri_id"]) > 0.999
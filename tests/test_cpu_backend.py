@@ -0,0 +1,66 @@
+import numpy
+import pytest
+
+from engine.cpu_backend import CpuEngine
+from engine.cpu_tracer import CpuTracer
+
+
+WIDTH = 24
+HEIGHT = 16
+# Looking down the -z axis from z=4
+VIEW = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, -4, 1]
+PROJECTION = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, -1, -1, 0, 0, -0.2, 0]
+
+
+def quad(size=0.5):
+    positions = numpy.array([[-size, -size, 0], [size, -size, 0], [size, size, 0], [-size, size, 0]],
+                            numpy.float32)
+    normals = numpy.tile(numpy.array([0, 0, 1], numpy.float32), (4, 1))
+    return positions, normals, numpy.array([0, 1, 2, 0, 2, 3], numpy.uint32)
+
+
+def moved(x):
+    matrix = numpy.identity(4)
+    matrix[0, 3] = x
+    return matrix
+
+
+@pytest.fixture
+def engine():
+    engine = CpuEngine(workers=1)
+    yield engine
+    engine.renderer.close()
+
+
+def test_draw_without_instances(engine):
+    assert engine.draw(WIDTH, HEIGHT, VIEW, PROJECTION) is None
+    image = engine.resize(WIDTH, HEIGHT)
+    assert engine.draw(WIDTH, HEIGHT, VIEW, PROJECTION) is image
+
+
+def test_move_republishes_instances(engine):
+    engine.resize(WIDTH, HEIGHT)
+    engine.add_or_update_mesh("quad", engine.get_mesh(*quad()))
+    engine.add_or_update_instance("a", "quad", moved(-0.6))
+    engine.add_or_update_instance("b", "quad", moved(0.6))
+
+    def expected():
+        instances = list(engine._instances.values())
+        return CpuTracer().render(instances, WIDTH, HEIGHT, VIEW, PROJECTION)[0]
+
+    first = engine.draw(WIDTH, HEIGHT, VIEW, PROJECTION).copy()
+    assert len(numpy.unique(first)) > 1
+    assert numpy.array_equal(first, expected())
+    scene, instances = engine.renderer._scene, engine.renderer._instances
+
+    engine.set_instance_matrix("b", moved(1.8))
+    second = engine.draw(WIDTH, HEIGHT, VIEW, PROJECTION).copy()
+    assert not numpy.array_equal(first, second)
+    assert numpy.array_equal(second, expected())
+    # Only the instances were shared again, not the meshes
+    assert engine.renderer._scene is scene
+    assert engine.renderer._instances is not instances
+
+    instances = engine.renderer._instances
+    engine.draw(WIDTH, HEIGHT, VIEW, PROJECTION)
+    assert engine.renderer._instances is instances
@@ -0,0 +1,76 @@
+import numpy
+import pytest
+
+from engine.cpu_tracer import BACKGROUND, LIGHT_POSITION, CpuTracer
+from engine.instance import Instance
+from engine.mesh_data import MeshData
+
+
+def plane():
+    positions = numpy.array([[-1, -1, 0], [1, -1, 0], [1, 1, 0], [-1, 1, 0]], numpy.float32)
+    normals = numpy.tile(numpy.array([0, 0, 1], numpy.float32), (4, 1))
+    indices = numpy.array([0, 1, 2, 0, 2, 3], numpy.uint16)
+    return MeshData(positions, normals, indices)
+
+
+def quad_grid(size):
+    '''size x size unit quads in the z=0 plane, two triangles each'''
+    x, y = numpy.meshgrid(numpy.arange(size + 1), numpy.arange(size + 1))
+    positions = numpy.stack([x.ravel(), y.ravel(), numpy.zeros(x.size)], axis=1).astype(numpy.float32)
+    normals = numpy.tile(numpy.array([0, 0, 1], numpy.float32), (len(positions), 1))
+    a = (numpy.arange(size)[numpy.newaxis, :] + numpy.arange(size)[:, numpy.newaxis] * (size + 1)).ravel()
+    b, c, d = a + 1, a + size + 2, a + size + 1
+    indices = numpy.stack([a, b, c, a, c, d], axis=1).astype(numpy.uint32).ravel()
+    return MeshData(positions, normals, indices)
+
+
+def down_rays(points, height=4.0):
+    ray_o = numpy.array([(x, y, height) for x, y in points], numpy.float32)
+    ray_d = numpy.tile(numpy.array([0, 0, -1], numpy.float32), (len(points), 1))
+    return ray_o, ray_d
+
+
+# (t, tri_id, u, v, instance_id) for each ray of test_ray_hits
+GOLDEN = [
+    (4.0, 0, 0.5, 0.25, 0),
+    (4.0, 1, 0.25, 0.5, 0),
+    (3.0, 0, 0.5, 0.25, 1),
+    (-1.0, 0, 0.0, 0.0, -1),
+]
+
+
+@pytest.mark.parametrize("acceleration", ["grid", "bvh"])
+def test_ray_hits(acceleration):
+    mesh = plane()
+    moved = numpy.identity(4)
+    moved[:3, 3] = [3, 0, 1]
+    instances = [Instance("a", mesh), Instance("b", mesh, moved)]
+    ray_o, ray_d = down_rays([(0.5, -0.5), (-0.5, 0.5), (3.5, -0.5), (5, 5)])
+
+    hits = CpuTracer(acceleration).trace(instances, ray_o, ray_d)
+    for hit, (t, tri_id, u, v, instance_id) in zip(hits, GOLDEN):
+        assert hit["t"] == pytest.approx(t, abs=1e-5)
+        assert hit["tri_id"] == tri_id
+        assert hit["u"] == pytest.approx(u, abs=1e-5)
+        assert hit["v"] == pytest.approx(v, abs=1e-5)
+        assert hit["instance_id"] == instance_id
+
+    color = CpuTracer(acceleration).shade(instances, hits)
+    light = LIGHT_POSITION - numpy.array([0.5, -0.5, 0.0])
+    assert color[0] == pytest.approx(light[2] / numpy.linalg.norm(light) * 0.8, abs=1e-5)
+    assert color[3] == pytest.approx(BACKGROUND)
+
+
+@pytest.mark.parametrize("acceleration", ["grid", "bvh"])
+def test_triangle_ids_past_16_bits(acceleration):
+    size = 182
+    mesh = quad_grid(size)
+    assert mesh.count > 65536
+    instances = [Instance("empty", plane(), numpy.diag([0.1, 0.1, 0.1, 1.0])), Instance("grid", mesh)]
+    ray_o, ray_d = down_rays([(size - 0.25, size - 0.75)])
+
+    hit = CpuTracer(acceleration).trace(instances, ray_o, ray_d)[0]
+    assert hit["tri_id"] == 2 * (size * size - 1)
+    assert hit["instance_id"] == 1
+    assert hit["u"] == pytest.approx(0.5, abs=1e-4)
+    assert hit["v"] == pytest.approx(0.25, abs=1e-4)
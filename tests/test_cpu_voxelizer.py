@@ -0,0 +1,101 @@
+import numpy
+import pytest
+
+from engine import cpu_voxelizer
+from engine.mesh_data import MeshData
+
+
+def random_mesh(count, seed, spread=0.4):
+    '''count triangles of random size scattered through a unit cube'''
+    rng = numpy.random.default_rng(seed)
+    centers = rng.random((count, 1, 3))
+    positions = (centers + (rng.random((count, 3, 3)) - 0.5) * spread).reshape(-1, 3)
+    indices = numpy.arange(len(positions), dtype=numpy.uint16)
+    return MeshData(positions.astype(numpy.float32), positions.astype(numpy.float32), indices)
+
+
+def args(mesh):
+    return (mesh.buf_positions, mesh.buf_indices, mesh.aabb, mesh.dimensions, mesh.voxel_resolution)
+
+
+def cell_sets(offsets, tri_ids):
+    return [set(tri_ids[start:end].tolist()) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+@pytest.fixture(params=[0, 1, 2])
+def mesh(request):
+    return random_mesh(24, request.param)
+
+
+@pytest.mark.parametrize("overlap", cpu_voxelizer.OVERLAP_MODES)
+def test_vectorized_matches_loop(mesh, overlap):
+    expected_voxels, expected_links = cpu_voxelizer.voxelize_loop(*args(mesh), overlap=overlap)
+    voxels, links = cpu_voxelizer.voxelize(*args(mesh), overlap=overlap)
+    assert numpy.array_equal(voxels, expected_voxels)
+    assert numpy.array_equal(links, expected_links)
+
+
+@pytest.mark.parametrize("overlap", cpu_voxelizer.OVERLAP_MODES)
+def test_csr_matches_lists(mesh, overlap):
+    voxels, links = cpu_voxelizer.voxelize(*args(mesh), overlap=overlap)
+    offsets, tri_ids = cpu_voxelizer.voxelize_csr(*args(mesh), overlap=overlap)
+    expected_offsets, expected_ids = cpu_voxelizer.to_csr(voxels, links)
+    assert numpy.array_equal(offsets, expected_offsets)
+    assert numpy.array_equal(tri_ids, expected_ids)
+    cpu_voxelizer.validate_csr(offsets, tri_ids, voxels, links)
+
+    # Back to link lists and again to the compact layout
+    round_trip = cpu_voxelizer.to_csr(*cpu_voxelizer.from_csr(offsets, tri_ids, mesh.voxel_resolution))
+    assert numpy.array_equal(round_trip[0], offsets)
+    assert numpy.array_equal(round_trip[1], tri_ids)
+
+
+def test_validate_csr_reports_missing_triangle(mesh):
+    voxels, links = cpu_voxelizer.voxelize(*args(mesh))
+    offsets, tri_ids = cpu_voxelizer.to_csr(voxels, links)
+    tri_ids = tri_ids.copy()
+    tri_ids[0] += 1
+    with pytest.raises(ValueError):
+        cpu_voxelizer.validate_csr(offsets, tri_ids, voxels, links)
+
+
+def test_sat_lists_are_subsets_of_aabb_lists(mesh):
+    aabb_cells = cell_sets(*cpu_voxelizer.voxelize_csr(*args(mesh), overlap="aabb"))
+    sat_cells = cell_sets(*cpu_voxelizer.voxelize_csr(*args(mesh), overlap="sat"))
+    assert all(sat <= box for sat, box in zip(sat_cells, aabb_cells))
+    assert sum(map(len, sat_cells)) < sum(map(len, aabb_cells))
+
+
+def test_sat_is_conservative(mesh):
+    '''Every cell a point of a triangle lies in must list the triangle'''
+    sat_cells = cell_sets(*cpu_voxelizer.voxelize_csr(*args(mesh), overlap="sat"))
+    verts = cpu_voxelizer.voxel_triangles(*args(mesh)).astype(numpy.float64)
+    resolution = numpy.asarray(mesh.voxel_resolution)
+
+    steps = numpy.linspace(0.0, 1.0, 41)
+    u, v = numpy.meshgrid(steps, steps)
+    keep = u + v <= 1.0
+    weights = numpy.stack([1 - u[keep] - v[keep], u[keep], v[keep]], axis=1)
+    for tri_id, corners in enumerate(verts):
+        points = weights @ corners
+        cells = numpy.clip(numpy.floor(points).astype(numpy.int64), 0, resolution - 1)
+        for cell in numpy.unique(numpy.ravel_multi_index(cells.T, tuple(resolution))):
+            assert tri_id in sat_cells[cell]
+
+
+def test_triangle_box_overlap():
+    triangle = numpy.array([[[0.0, 0.0, 0.5], [1.0, 0.0, 0.5], [0.0, 1.0, 0.5]]] * 3)
+    centers = numpy.array([[0.5, 0.5, 0.5], [1.5, 1.5, 0.5], [0.5, 0.5, 2.5]])
+    # The middle cube only touches the bounding box, not the triangle
+    assert cpu_voxelizer.triangle_box_overlap(triangle, centers).tolist() == [True, False, False]
+
+
+def test_link_lists_keep_insertion_order():
+    bb_min = numpy.array([[0, 0, 0], [0, 0, 0], [1, 0, 0]])
+    bb_max = numpy.array([[2, 1, 1], [1, 1, 1], [2, 1, 1]])
+    voxels, links = cpu_voxelizer.link_lists(bb_min, bb_max, (2, 1, 1))
+    lengths = cpu_voxelizer.list_lengths(voxels, links)
+    assert lengths.ravel().tolist() == [2, 2]
+    # Heads point at the latest insertion
+    assert links[voxels[0, 0, 0], 0] == 1
+    assert links[voxels[1, 0, 0], 0] == 2
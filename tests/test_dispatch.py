@@ -0,0 +1,70 @@
+import types
+
+import numpy
+import pytest
+
+from engine.dispatch import LOCAL_SIZE, MAX_GROUPS, find_job, plan_batch, plan_dispatch
+
+
+def covered(groups, local_size):
+    '''Number of linear indices the shaders rebuild from a dispatch'''
+    return groups[0] * groups[1] * groups[2] * local_size
+
+
+def test_small_dispatch_is_one_row():
+    assert plan_dispatch(1) == (1, 1, 1)
+    assert plan_dispatch(LOCAL_SIZE) == (1, 1, 1)
+    assert plan_dispatch(LOCAL_SIZE + 1) == (2, 1, 1)
+    assert plan_dispatch(MAX_GROUPS * LOCAL_SIZE) == (MAX_GROUPS, 1, 1)
+
+
+@pytest.mark.parametrize("invocations", [MAX_GROUPS * LOCAL_SIZE + 1, 10**9, 3 * MAX_GROUPS * LOCAL_SIZE])
+def test_large_dispatch_tiles_over_y(invocations):
+    groups = plan_dispatch(invocations)
+    assert groups[0] <= MAX_GROUPS and groups[1] <= MAX_GROUPS and groups[2] == 1
+    assert groups[1] > 1
+    total = covered(groups, LOCAL_SIZE)
+    assert total >= invocations
+    # At most one partial row of groups is wasted
+    assert total - invocations < (groups[0] + 1) * LOCAL_SIZE
+
+
+def test_dispatch_limit():
+    assert plan_dispatch(10, local_size=1, max_groups=4) == (4, 3, 1)
+    with pytest.raises(ValueError):
+        plan_dispatch(17, local_size=1, max_groups=4)
+
+
+def mesh(count, resolution):
+    return types.SimpleNamespace(count=count, voxel_resolution=resolution)
+
+
+def test_plan_batch_packs_ranges():
+    meshes = [mesh(4, (2, 2, 2)), mesh(0, (1, 1, 1)), mesh(10, (3, 1, 2))]
+    jobs, tri_total, cell_total = plan_batch(meshes)
+    assert jobs.dtype == numpy.uint32
+    assert jobs.tolist() == [[0, 0], [4, 8], [4, 9]]
+    assert (tri_total, cell_total) == (14, 15)
+
+
+def test_plan_batch_empty():
+    jobs, tri_total, cell_total = plan_batch([])
+    assert jobs.shape == (0, 2)
+    assert (tri_total, cell_total) == (0, 0)
+
+
+def test_find_job_at_boundaries():
+    meshes = [mesh(4, (1, 1, 1)), mesh(0, (1, 1, 1)), mesh(5, (1, 1, 1)), mesh(1, (1, 1, 1))]
+    jobs, tri_total, _ = plan_batch(meshes)
+    starts = jobs[:, 0]
+    expected = [0] * 4 + [2] * 5 + [3]
+    assert [find_job(starts, index) for index in range(tri_total)] == expected
+    # First and last invocation; the empty job shares its start with job 2
+    assert find_job(starts, 0) == 0
+    assert find_job(starts, starts[1]) == 2
+    assert find_job(starts, tri_total - 1) == 3
+
+
+def test_find_job_single():
+    assert find_job(numpy.array([0], numpy.uint32), 0) == 0
+    assert find_job(numpy.array([0], numpy.uint32), 99) == 0
@@ -0,0 +1,44 @@
+import numpy
+import pytest
+
+pytest.importorskip("OpenGL")
+
+from engine import engine
+
+
+def gl_names(count=1, *args):
+    return tuple(range(1, count + 1)) if count > 1 else 1
+
+
+@pytest.fixture
+def no_gl(monkeypatch):
+    '''Lets Mesh be built and deleted without a GL context'''
+    for name in dir(engine):
+        if name.startswith("gl") and callable(getattr(engine, name)):
+            monkeypatch.setattr(engine, name, lambda *args: None)
+    for name in ("glGenBuffers", "glGenTextures", "glGenVertexArrays"):
+        monkeypatch.setattr(engine, name, gl_names)
+    monkeypatch.setattr(engine, "glGetTextureHandleARB", lambda texture: texture)
+    monkeypatch.setattr(engine, "create_voxel_grid", lambda resolution: (1, 1))
+    monkeypatch.setattr(engine, "create_voxel_list", lambda width, height: (1, 1))
+    monkeypatch.setattr(engine, "delete_voxel_texture", lambda *args: None)
+
+
+def quad():
+    positions = numpy.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], numpy.float32)
+    return positions, positions, numpy.array([0, 1, 2, 0, 2, 3], numpy.uint16)
+
+
+def test_only_grid_meshes_count_voxel_references(no_gl, monkeypatch):
+    calls = []
+    count = engine.cpu_voxelizer.reference_count
+    monkeypatch.setattr(engine.cpu_voxelizer, "reference_count", lambda *args: calls.append(1) or count(*args))
+
+    mesh = engine.Mesh(*quad(), acceleration="bvh")
+    assert calls == []
+    assert mesh.voxel_list_capacity == 0
+
+    mesh = engine.Mesh(*quad(), acceleration="grid")
+    assert calls == [1]
+    assert mesh.voxel_list_used > 0
+    assert mesh.voxel_list_capacity > mesh.voxel_list_used
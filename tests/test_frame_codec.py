@@ -0,0 +1,93 @@
+import socket
+
+import numpy
+import pytest
+
+from frame_codec import FrameDecoder, FrameEncoder, encode_message_frame
+from socket_api import *
+
+
+CODECS = [FrameCodecs.raw, FrameCodecs.zlib, FrameCodecs.lz4]
+
+
+def frames():
+    '''A full frame, a small change sent as a delta and an unchanged frame'''
+    first = numpy.zeros((70, 100, 3), numpy.uint8)
+    first[10:20, 10:20] = 200
+    second = first.copy()
+    second[65:70, 90:100] = (1, 2, 3)
+    return [first, second, second.copy()]
+
+
+def round_trip(encoder, decoder, frame):
+    header, payload = encoder.encode(frame)
+    width, height, kind, codec, size = decode_frame_header(header)
+    assert size == len(payload)
+    return kind, codec, decoder.decode(width, height, kind, codec, payload)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_full_delta_unchanged_round_trip(codec):
+    if codec == FrameCodecs.lz4:
+        pytest.importorskip("lz4.frame")
+    encoder = FrameEncoder(codec)
+    decoder = FrameDecoder()
+
+    kinds = []
+    for frame in frames():
+        kind, sent_codec, decoded = round_trip(encoder, decoder, frame)
+        kinds.append(kind)
+        assert numpy.array_equal(decoded, frame)
+        assert sent_codec == (FrameCodecs.raw if kind == FrameKinds.unchanged else codec)
+    assert kinds == [FrameKinds.full, FrameKinds.delta, FrameKinds.unchanged]
+
+
+def test_resize_sends_full_frame():
+    encoder = FrameEncoder(FrameCodecs.zlib)
+    decoder = FrameDecoder()
+    round_trip(encoder, decoder, frames()[0])
+    frame = numpy.full((30, 40, 3), 9, numpy.uint8)
+    kind, _, decoded = round_trip(encoder, decoder, frame)
+    assert kind == FrameKinds.full
+    assert numpy.array_equal(decoded, frame)
+
+
+def test_messages_between_frames():
+    decoder = FrameDecoder()
+    frame = round_trip(FrameEncoder(), decoder, frames()[0])[2]
+    header, payload = encode_message_frame(MethodIDs.update, DataIDs.stats, {"frame": 3})
+    assert decoder.decode(*decode_frame_header(header)[:4], payload) is frame
+    assert decoder.messages == [(MethodIDs.update, DataIDs.stats, {"frame": 3})]
+
+
+def test_legacy_frames_until_negotiated():
+    encoder = FrameEncoder(FrameCodecs.zlib, protocol=LEGACY_FRAME_PROTOCOL)
+    sender, receiver = socket.socketpair()
+    try:
+        for frame in frames()[:2]:
+            for part in encoder.encode(frame):
+                sender.sendall(part)
+            assert numpy.array_equal(FrameDecoder(LEGACY_FRAME_PROTOCOL).read(receiver), frame)
+
+        encoder.negotiate({"frame_protocol": FRAME_PROTOCOL, "codecs": ["raw"]})
+        assert not encoder.legacy
+        assert encoder.codec == FrameCodecs.raw
+        decoder = FrameDecoder()
+        for frame in frames():
+            for part in encoder.encode(frame):
+                sender.sendall(part)
+            assert numpy.array_equal(decoder.read(receiver), frame)
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_negotiate_keeps_requested_codec():
+    encoder = FrameEncoder(FrameCodecs.zlib, protocol=LEGACY_FRAME_PROTOCOL)
+    encoder.negotiate(FrameDecoder().capabilities())
+    assert encoder.protocol == FRAME_PROTOCOL
+    assert encoder.codec == FrameCodecs.zlib
+
+    # A newer receiver still gets the newest protocol this side knows
+    encoder.negotiate({"frame_protocol": FRAME_PROTOCOL + 1, "codecs": ["zlib"]})
+    assert encoder.protocol == FRAME_PROTOCOL
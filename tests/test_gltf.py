@@ -0,0 +1,79 @@
+import json
+
+import numpy
+
+from gltf import NodeTree, find_id, items, world_transforms
+
+
+def transform_message(nodes):
+    '''Round trips like a DataIDs.transform message, turning keys into strings'''
+    return json.loads(json.dumps({"nodes": nodes}))["nodes"]
+
+
+def test_world_transforms_compose_parents():
+    gltf = {"nodes": [
+        {"children": [1], "translation": [1.0, 0.0, 0.0]},
+        {"translation": [0.0, 2.0, 0.0], "scale": [2.0, 2.0, 2.0]},
+    ]}
+    transforms = world_transforms(gltf)
+    assert numpy.allclose(transforms[1][:3, 3], [1.0, 2.0, 0.0])
+    assert numpy.allclose(numpy.diag(transforms[1])[:3], [2.0, 2.0, 2.0])
+
+
+def test_set_transforms_finds_gltf2_integer_ids():
+    nodes = [
+        {"children": [1], "translation": [1.0, 0.0, 0.0]},
+        {"mesh": 0, "translation": [0.0, 2.0, 0.0]},
+    ]
+    tree = NodeTree()
+    assert sorted(tree.update(dict(items(nodes)))) == [0, 1]
+
+    moved = tree.set_transforms(transform_message({0: {"translation": [5.0, 0.0, 0.0]}}))
+    assert sorted(moved) == [0, 1]
+    assert numpy.allclose(tree.world_transform(1)[:3, 3], [5.0, 2.0, 0.0])
+    assert tree.nodes[1]["mesh"] == 0
+
+
+def test_set_transforms_replaces_trs_with_matrix():
+    tree = NodeTree()
+    tree.update({"a": {"translation": [1.0, 0.0, 0.0], "scale": [3.0, 3.0, 3.0]}})
+    matrix = numpy.identity(4)
+    matrix[3, :3] = (0.0, 0.0, 4.0)
+    assert tree.set_transforms(transform_message({"a": {"matrix": matrix.ravel().tolist()}})) == ["a"]
+    assert numpy.allclose(tree.world_transform("a")[:3, 3], [0.0, 0.0, 4.0])
+    assert numpy.allclose(numpy.diag(tree.world_transform("a")), 1.0)
+
+
+def test_set_transforms_reports_unknown_nodes(capsys):
+    tree = NodeTree()
+    tree.update(dict(items([{}])))
+    assert tree.set_transforms(transform_message({7: {"translation": [1.0, 0.0, 0.0]}})) == []
+    assert "unknown node 7" in capsys.readouterr().out
+
+
+def test_remove_makes_children_roots():
+    tree = NodeTree()
+    tree.update(dict(items([
+        {"children": [1], "translation": [1.0, 0.0, 0.0]},
+        {"children": [2]},
+        {"translation": [0.0, 0.0, 1.0]},
+    ])))
+    assert sorted(tree.remove([0])) == [1, 2]
+    assert numpy.allclose(tree.world_transform(2)[:3, 3], [0.0, 0.0, 1.0])
+    assert len(tree) == 2
+
+
+def test_remove_finds_gltf2_integer_ids():
+    tree = NodeTree()
+    tree.update(dict(items([{"children": [1]}, {}, {}])))
+    assert tree.remove(["0", "2", "missing"]) == [1]
+    assert list(tree.nodes) == [1]
+    assert tree.parents == {}
+
+
+def test_find_id():
+    assert find_id({3: None}, "3") == 3
+    assert find_id({3: None}, 3) == 3
+    assert find_id({"3": None}, "3") == "3"
+    assert find_id({"mesh": None}, "3") is None
+    assert find_id({3: None}, "mesh") is None
@@ -0,0 +1,75 @@
+import numpy
+
+from engine.mesh_cache import MeshCache
+
+
+class FakeMesh:
+    def __init__(self, size):
+        self.size = size
+
+    def gpu_size(self):
+        return self.size
+
+
+def test_key_depends_on_contents_dtype_and_shape():
+    positions = numpy.arange(12, dtype=numpy.float32)
+    assert MeshCache.key(positions) == MeshCache.key(positions.copy())
+    assert MeshCache.key(positions) != MeshCache.key(positions + 1)
+    assert MeshCache.key(positions) != MeshCache.key(positions.reshape(4, 3))
+    assert MeshCache.key(positions) != MeshCache.key(positions.view(numpy.int32))
+
+
+def test_hit_and_miss_counters():
+    cache = MeshCache()
+    mesh = FakeMesh(10)
+    assert cache.get(b"a") is None
+    cache.put(b"a", mesh)
+    assert cache.get(b"a") is mesh
+    assert cache.get(b"a") is mesh
+    assert cache.get(b"b") is None
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_evicts_least_recently_used_over_budget():
+    cache = MeshCache(budget=30)
+    meshes = {key: FakeMesh(10) for key in (b"a", b"b", b"c")}
+    for key, mesh in meshes.items():
+        cache.put(key, mesh)
+    assert cache.size == 30
+
+    cache.get(b"a")
+    cache.put(b"d", FakeMesh(10))
+    # b was used least recently
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") is meshes[b"a"]
+    assert len(cache) == 3
+    assert cache.size == 30
+
+
+def test_in_use_meshes_are_kept():
+    cache = MeshCache(budget=20)
+    meshes = [FakeMesh(10) for _ in range(3)]
+    for i, mesh in enumerate(meshes):
+        cache.put(bytes([i]), mesh, in_use=meshes[:i])
+    # Everything is in use, so the cache stays over budget
+    assert len(cache) == 3
+    assert cache.size == 30
+
+    cache.put(b"big", FakeMesh(15), in_use=meshes[1:])
+    assert cache.get(bytes([0])) is None
+    assert len(cache) == 3
+    assert cache.size == 35
+
+
+def test_replace_and_discard_track_size():
+    cache = MeshCache()
+    old, new = FakeMesh(10), FakeMesh(4)
+    cache.put(b"a", old)
+    cache.put(b"a", new)
+    assert cache.size == 4
+
+    cache.discard(old)
+    assert cache.size == 4
+    cache.discard(new)
+    assert cache.size == 0
+    assert len(cache) == 0
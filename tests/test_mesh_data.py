@@ -0,0 +1,61 @@
+import numpy
+import pytest
+
+from engine import cpu_voxelizer
+from engine.cpu_tracer import CpuTracer, generate_rays
+from engine.instance import Instance
+from engine.mesh_data import MIN_EXTENT, MeshData
+
+
+def plane(height=0.0):
+    positions = numpy.array([[-1, -1, height], [1, -1, height], [1, 1, height], [-1, 1, height]],
+                            numpy.float32)
+    normals = numpy.tile(numpy.array([0, 0, 1], numpy.float32), (4, 1))
+    indices = numpy.array([0, 1, 2, 0, 2, 3], numpy.uint16)
+    return MeshData(positions, normals, indices)
+
+
+def test_bounds_and_resolution():
+    positions = numpy.array([[0, 0, 0], [2, 0, 0], [0, 1, 0], [0, 0, 4]], numpy.float32)
+    mesh = MeshData(positions, positions, numpy.array([0, 1, 2, 0, 2, 3], numpy.uint16))
+    assert numpy.all(numpy.array(mesh.aabb[0]) < [0, 0, 0])
+    assert numpy.all(numpy.array(mesh.aabb[1]) > [2, 1, 4])
+    assert numpy.allclose(mesh.aabb[1], [2, 1, 4], atol=0.01)
+    assert mesh.count == 2
+    assert all(res >= 1 for res in mesh.voxel_resolution)
+
+
+def test_flat_mesh_gets_finite_grid():
+    mesh = plane()
+    assert numpy.all(numpy.array(mesh.dimensions) >= MIN_EXTENT * 0.999)
+    assert mesh.voxel_resolution[2] == 1
+    assert all(1 <= res < 1000 for res in mesh.voxel_resolution)
+
+    offsets, tri_ids = cpu_voxelizer.voxelize_mesh(mesh, csr=True)
+    assert offsets[-1] == len(tri_ids)
+    assert set(numpy.asarray(tri_ids).tolist()) == {0, 1}
+
+
+def test_positive_minimum_stays_inside():
+    positions = numpy.array([[3, 4, 5], [6, 4, 5], [3, 8, 7]], numpy.float32)
+    mesh = MeshData(positions, positions, numpy.array([0, 1, 2], numpy.uint16))
+    assert numpy.all(numpy.array(mesh.aabb[0]) < positions.min(axis=0))
+    assert numpy.all(numpy.array(mesh.aabb[1]) > positions.max(axis=0))
+
+
+@pytest.mark.parametrize("height", [-1.0, 0.0, 5.0])
+def test_offset_plane_is_inside_and_traced(height):
+    mesh = plane(height)
+    lower, upper = numpy.array(mesh.aabb)
+    assert lower[2] < height < upper[2]
+
+    view = numpy.identity(4)
+    view[2, 3] = -(height + 4.0)
+    focal = 1.0
+    projection = numpy.array([[focal, 0, 0, 0], [0, focal, 0, 0], [0, 0, -1.0, -0.2], [0, 0, -1, 0]])
+    ray_o, ray_d = generate_rays(32, 32, view.T.ravel().tolist(), projection.T.ravel().tolist())
+    instances = [Instance("plane", mesh)]
+    grid_hits = CpuTracer("grid").trace(instances, ray_o, ray_d)["instance_id"] >= 0
+    bvh_hits = CpuTracer("bvh").trace(instances, ray_o, ray_d)["instance_id"] >= 0
+    assert grid_hits.sum() > 32
+    assert numpy.array_equal(grid_hits, bvh_hits)
@@ -0,0 +1,117 @@
+import socket
+import struct
+import time
+
+import numpy
+import pytest
+
+from frame_codec import FrameDecoder, FrameEncoder, encode_message_frame
+from network import NetworkThread
+from socket_api import *
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise AssertionError("Timed out")
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def connection():
+    '''A running NetworkThread and the peer socket it talks to'''
+    client, peer = socket.socketpair()
+    thread = NetworkThread(client, FrameEncoder(FrameCodecs.raw), max_queued=2)
+    thread.start()
+    yield thread, peer
+    thread.running = False
+    thread.join(1.0)
+    client.close()
+    peer.close()
+
+
+def collect(thread, count):
+    messages = []
+    wait_for(lambda: messages.extend(thread.poll()) or len(messages) >= count)
+    return messages
+
+
+def test_latest_wins_and_ordered_messages(connection):
+    thread, peer = connection
+    for i in range(3):
+        peer.sendall(encode_message(MethodIDs.update, DataIDs.view, {"data": i}))
+        peer.sendall(encode_message(MethodIDs.add, DataIDs.gltf, {"index": i}))
+
+    messages = collect(thread, 4)
+    views = [data for _, data_id, data, _ in messages if data_id == DataIDs.view]
+    gltfs = [data["index"] for _, data_id, data, _ in messages if data_id == DataIDs.gltf]
+    assert views[-1] == {"data": 2}
+    assert gltfs == [0, 1, 2]
+
+
+def test_full_queue_does_not_block_sending(connection):
+    thread, peer = connection
+    for i in range(20):
+        peer.sendall(encode_message(MethodIDs.add, DataIDs.gltf, {"index": i}))
+
+    # Nothing is polled, yet frames still go out
+    frame = numpy.full((4, 6, 3), 7, numpy.uint8)
+    thread.submit_frame(frame)
+    peer.settimeout(2.0)
+    assert numpy.array_equal(FrameDecoder().read(peer), frame)
+
+    messages = collect(thread, 20)
+    assert [data["index"] for _, _, data, _ in messages] == list(range(20))
+    assert not thread.closed
+
+
+@pytest.mark.parametrize("message", [
+    # Broken JSON
+    encode_cmd_message(MethodIDs.add, DataIDs.gltf) + struct.pack("I", 3) + b"{x}",
+    # DataID that does not exist
+    struct.pack("B", (MethodIDs.add.value << 4) | 0b1111) + struct.pack("I", 2) + b"{}",
+])
+def test_errors_are_raised_from_poll(connection, message):
+    thread, peer = connection
+    peer.sendall(message)
+    wait_for(lambda: thread.closed)
+    assert thread.error is not None
+    with pytest.raises(type(thread.error)):
+        thread.poll()
+
+
+def test_capabilities_switch_from_legacy_frames():
+    client, peer = socket.socketpair()
+    thread = NetworkThread(client, FrameEncoder(FrameCodecs.zlib, protocol=LEGACY_FRAME_PROTOCOL))
+    thread.start()
+    try:
+        frame = numpy.full((4, 6, 3), 7, numpy.uint8)
+        # Legacy receivers cannot parse message frames, so they are dropped
+        thread.submit_message(*encode_message_frame(MethodIDs.update, DataIDs.stats, {}))
+        thread.submit_frame(frame)
+        assert numpy.array_equal(FrameDecoder(LEGACY_FRAME_PROTOCOL).read(peer), frame)
+
+        decoder = FrameDecoder()
+        send_message(peer, MethodIDs.update, DataIDs.capabilities, decoder.capabilities())
+        wait_for(lambda: not thread._encoder.legacy)
+        thread.submit_message(*encode_message_frame(MethodIDs.update, DataIDs.stats, {"frame": 1}))
+        thread.submit_frame(frame + 1)
+        peer.setblocking(True)
+        assert decoder.read(peer) is None
+        assert decoder.messages == [(MethodIDs.update, DataIDs.stats, {"frame": 1})]
+        assert numpy.array_equal(decoder.read(peer), frame + 1)
+        assert thread.poll() == []
+    finally:
+        thread.running = False
+        thread.join(1.0)
+        client.close()
+        peer.close()
+
+
+def test_peer_close_ends_thread(connection):
+    thread, peer = connection
+    peer.close()
+    wait_for(lambda: thread.closed)
+    assert thread.error is None
+    assert thread.poll() == []
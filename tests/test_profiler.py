@@ -0,0 +1,134 @@
+import json
+import types
+
+import pytest
+
+from engine import profiler as profiler_module
+from engine.profiler import Profiler
+
+
+class FakeGL:
+    '''Timer queries that finish when the test says so'''
+    GL_TIME_ELAPSED = 1
+    GL_QUERY_RESULT_AVAILABLE = 2
+    GL_QUERY_RESULT = 3
+
+    def __init__(self):
+        self.next_query = 1
+        self.available = set()
+        self.results = {}
+        self.open = []
+
+    def glGenQueries(self, count):
+        self.next_query += 1
+        return self.next_query - 1
+
+    def glBeginQuery(self, target, query):
+        self.open.append(query)
+
+    def glEndQuery(self, target):
+        self.open.pop()
+
+    @staticmethod
+    def GLint(value):
+        return types.SimpleNamespace(value=value)
+
+    GLuint64 = GLint
+
+    def glGetQueryObjectiv(self, query, name, result):
+        result.value = int(query in self.available)
+
+    def glGetQueryObjectui64v(self, query, name, result):
+        result.value = self.results[query]
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    fake = FakeGL()
+    monkeypatch.setattr(profiler_module, "GL", fake)
+    return fake
+
+
+def test_percentiles():
+    profiler = Profiler(history=100)
+    profiler.samples["cpu"]["trace"].extend(float(i) for i in range(1, 101))
+    stats = profiler.summary()
+    entry = stats["cpu"]["trace"]
+    assert entry["count"] == 100
+    assert entry["p50"] == pytest.approx(50.5)
+    assert entry["p90"] == pytest.approx(90.1)
+    assert entry["p99"] == pytest.approx(99.01)
+    assert stats["gpu"] == {}
+
+
+def test_history_is_bounded():
+    profiler = Profiler(history=3)
+    for _ in range(5):
+        with profiler.scope("frame"):
+            pass
+    assert profiler.summary()["cpu"]["frame"]["count"] == 3
+
+
+def test_chrome_trace(tmp_path):
+    profiler = Profiler(trace=True, max_events=3)
+    with profiler.scope("upload"):
+        pass
+    profiler.end_frame()
+    for _ in range(3):
+        with profiler.scope("trace"):
+            pass
+
+    path = tmp_path / "trace.json"
+    profiler.dump_trace(str(path))
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["upload", "trace", "trace"]
+    assert [event["args"]["frame"] for event in events] == [0, 1, 1]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+def test_gpu_scopes_cannot_nest(gl):
+    profiler = Profiler(gpu=True)
+    with profiler.scope("outer", gpu=True):
+        # CPU scopes may still nest inside
+        with profiler.scope("cpu"):
+            pass
+        with pytest.raises(RuntimeError):
+            with profiler.scope("inner", gpu=True):
+                pass
+    assert gl.open == []
+    with profiler.scope("next", gpu=True):
+        pass
+
+
+def test_gpu_results_collected_in_order(gl):
+    profiler = Profiler(gpu=True, trace=True)
+    for name in ("first", "second"):
+        with profiler.scope(name, gpu=True):
+            pass
+    first, second = [query for _, query, _ in profiler._pending]
+    gl.results = {first: 2000000, second: 3000000}
+
+    # The second query finishing first does not let it jump the queue
+    gl.available.add(second)
+    profiler.end_frame()
+    assert profiler.summary()["gpu"] == {}
+
+    gl.available.add(first)
+    profiler.end_frame()
+    gpu = profiler.summary()["gpu"]
+    assert gpu["first"]["p50"] == pytest.approx(2.0)
+    assert gpu["second"]["p50"] == pytest.approx(3.0)
+    assert [e["name"] for e in profiler.events if e["cat"] == "gpu"] == ["first", "second"]
+
+    # Finished queries are reused
+    with profiler.scope("third", gpu=True):
+        pass
+    assert profiler._pending[0][1] in (first, second)
+
+
+def test_cpu_only_profiler_ignores_gpu_flag():
+    profiler = Profiler(gpu=False)
+    with profiler.scope("outer", gpu=True):
+        with profiler.scope("inner", gpu=True):
+            pass
+    assert set(profiler.summary()["cpu"]) == {"outer", "inner"}
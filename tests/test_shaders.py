@@ -0,0 +1,59 @@
+import os
+import struct
+
+import pytest
+
+pytest.importorskip("OpenGL")
+
+from OpenGL.error import GLError
+
+from engine import shaders
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    '''A ProgramCache with GL replaced by a driver that accepts format 1'''
+    deleted = []
+
+    def program_binary(program, binary_format, binary, length):
+        if binary_format != 1:
+            raise GLError(shaders.GL_INVALID_ENUM, None)
+
+    monkeypatch.setattr(shaders, "glCreateProgram", lambda: 5)
+    monkeypatch.setattr(shaders, "glProgramBinary", program_binary)
+    monkeypatch.setattr(shaders, "glGetProgramiv", lambda program, name: 1)
+    monkeypatch.setattr(shaders, "glDeleteProgram", deleted.append)
+    cache = shaders.ProgramCache(str(tmp_path))
+    cache.deleted = deleted
+    return cache
+
+
+def write(cache, key, data):
+    with open(cache._path(key), 'wb') as fout:
+        fout.write(data)
+
+
+def test_missing_entry_is_a_miss(cache):
+    assert cache.load("missing") is None
+    assert cache.misses == 1
+
+
+def test_valid_entry_is_a_hit(cache):
+    write(cache, "good", struct.pack("<I", 1) + b"binary")
+    assert cache.load("good") == 5
+    assert cache.hits == 1
+
+
+@pytest.mark.parametrize("data", [b"", b"\x01\x00", struct.pack("<I", 1)])
+def test_truncated_entry_is_discarded(cache, data):
+    write(cache, "short", data)
+    assert cache.load("short") is None
+    assert cache.misses == 1
+    assert not os.path.exists(cache._path("short"))
+
+
+def test_rejected_binary_is_discarded(cache):
+    write(cache, "stale", struct.pack("<I", 2) + b"binary")
+    assert cache.load("stale") is None
+    assert cache.deleted == [5]
+    assert not os.path.exists(cache._path("stale"))
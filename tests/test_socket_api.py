@@ -0,0 +1,103 @@
+import socket
+import struct
+
+import numpy
+import pytest
+
+from socket_api import *
+
+
+@pytest.mark.parametrize("sizes", [[], [0], [1, 2, 3, 4, 5], [12, 7]])
+def test_binary_payload_round_trip(sizes):
+    chunks = [bytes(range(i, i + size)) for i, size in enumerate(sizes)]
+    payload = b"".join(encode_binary_payload({"asset": {"version": "2.0"}}, chunks))
+
+    header, decoded = decode_binary_payload(bytearray(payload))
+    assert header == {"asset": {"version": "2.0"}}
+    assert [bytes(chunk) for chunk in decoded] == chunks
+
+
+def test_binary_payload_alignment():
+    chunks = [b"\1", b"\2\2\2\2\2", numpy.arange(3, dtype=numpy.float32).tobytes()]
+    payload = b"".join(encode_binary_payload({"a": 1}, chunks))
+    header_size = struct.unpack_from("I", payload)[0]
+    assert header_size % 4 == 0
+    # Padded with spaces, so the header is still valid JSON
+    assert payload[4:4 + header_size].rstrip(b" ").endswith(b"}")
+
+    # Every chunk starts four byte aligned, padded with zeros
+    offset = 4 + header_size
+    for chunk in chunks:
+        assert offset % 4 == 0
+        assert payload[offset:offset + len(chunk)] == chunk
+        offset += len(chunk)
+        assert payload[offset:offset + -offset % 4] == b"\0" * (-offset % 4)
+        offset += -offset % 4
+    assert offset == len(payload)
+
+    decoded = decode_binary_payload(bytearray(payload))[1]
+    assert numpy.array_equal(numpy.frombuffer(decoded[2], numpy.float32), [0, 1, 2])
+
+
+def test_buffer_pool_reuses_and_grows():
+    pool = BufferPool(8)
+    first = pool.get(6)
+    assert len(first) == 6
+    assert pool.get(8).obj is first.obj
+
+    first[:] = b"abcdef"
+    grown = pool.get(20)
+    assert len(grown) == 20
+    assert len(grown.obj) == 32
+    # Views handed out earlier keep the old storage
+    assert grown.obj is not first.obj
+    assert bytes(first) == b"abcdef"
+
+
+@pytest.fixture
+def pair():
+    sender, receiver = socket.socketpair()
+    receiver.setblocking(False)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def test_message_reader_resumes_partial_reads(pair):
+    sender, receiver = pair
+    reader = MessageReader(BufferPool(4))
+    message = encode_message(MethodIDs.update, DataIDs.view, {"data": list(range(20))})
+
+    assert reader.read(receiver) is None
+    # Split inside the header, then inside the body
+    for start, end in ((0, 3), (3, HEADER_SIZE + 5), (HEADER_SIZE + 5, len(message) - 1)):
+        sender.sendall(message[start:end])
+        assert reader.read(receiver) is None
+    sender.sendall(message[-1:])
+
+    method_id, data_id, payload = reader.read(receiver)
+    assert (method_id, data_id) == (MethodIDs.update, DataIDs.view)
+    assert bytes(payload) == message[HEADER_SIZE:]
+    assert reader.read(receiver) is None
+
+
+def test_message_reader_back_to_back(pair):
+    sender, receiver = pair
+    reader = MessageReader()
+    messages = [encode_message(MethodIDs.add, DataIDs.gltf, {"i": i}) for i in range(3)]
+    sender.sendall(b"".join(messages))
+
+    for message in messages:
+        payload = reader.read(receiver)[2]
+        assert bytes(payload) == message[HEADER_SIZE:]
+    assert reader.read(receiver) is None
+
+
+def test_message_reader_raises_on_close(pair):
+    sender, receiver = pair
+    reader = MessageReader()
+    sender.sendall(encode_message(MethodIDs.add, DataIDs.gltf, {})[:3])
+    assert reader.read(receiver) is None
+    sender.close()
+    with pytest.raises(ConnectionResetError):
+        reader.read(receiver)
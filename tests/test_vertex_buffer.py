@@ -0,0 +1,95 @@
+import types
+
+import numpy
+import pytest
+
+pytest.importorskip("OpenGL")
+
+from engine import vertex_buffer
+
+
+GL_CALLS = ("glBindBuffer", "glBufferData", "glBufferSubData", "glBindVertexArray",
+            "glEnableVertexAttribArray", "glVertexAttribPointer")
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    '''A VertexBuffer whose GL calls do nothing, for range bookkeeping'''
+    for name in GL_CALLS:
+        monkeypatch.setattr(vertex_buffer, name, lambda *args: None)
+    monkeypatch.setattr(vertex_buffer, "glGenBuffers", lambda count: (1, 2))
+    monkeypatch.setattr(vertex_buffer, "glGenVertexArrays", lambda count: 3)
+    return vertex_buffer.VertexBuffer()
+
+
+class FakeMesh:
+    def __init__(self, vert_count, element_count):
+        self.vert_count = vert_count
+        self.element_count = element_count
+        self.buf_positions = numpy.zeros((vert_count, 3), numpy.float32)
+        self.buf_normals = numpy.zeros((vert_count, 3), numpy.float32)
+        self.buf_indices = numpy.zeros(element_count, numpy.uint32)
+        self.gpu_data = types.SimpleNamespace(vert_offset=0, element_offset=0)
+
+
+def test_ranges_do_not_overlap(buffer):
+    meshes = [FakeMesh(3, 3), FakeMesh(5, 9), FakeMesh(0, 0), FakeMesh(2, 6)]
+    for m in meshes:
+        buffer.add_mesh(m)
+
+    for index in (0, 1):
+        spans = sorted((buffer.ranges[m][index], (m.vert_count, m.element_count)[index]) for m in meshes)
+        for (offset, size), (next_offset, _) in zip(spans, spans[1:]):
+            assert offset + max(size, 1) <= next_offset
+    assert buffer.vertex_count == 10
+    assert buffer.element_count == 18
+
+
+def test_remove_frees_ranges(buffer):
+    first, second = FakeMesh(4, 6), FakeMesh(4, 6)
+    buffer.add_mesh(first)
+    buffer.add_mesh(second)
+    buffer.update()
+    buffer.remove_mesh(first)
+
+    assert first not in buffer.ranges
+    assert buffer.vertex_count == 4
+    third = FakeMesh(4, 6)
+    buffer.add_mesh(third)
+    assert buffer.ranges[third] == (0, 0)
+
+
+def test_compact_moves_and_reuploads(buffer):
+    meshes = [FakeMesh(4, 6) for _ in range(4)]
+    for m in meshes:
+        buffer.add_mesh(m)
+    buffer.update()
+    for m in meshes[:3]:
+        buffer.remove_mesh(m)
+
+    buffer.update()
+    assert buffer.ranges[meshes[3]] == (0, 0)
+    assert meshes[3].gpu_data.vert_offset == 0
+    assert not buffer.is_dirty
+
+
+def test_compaction_spread_over_updates(buffer):
+    buffer.compact_budget = 4
+    meshes = [FakeMesh(4, 6) for _ in range(6)]
+    for m in meshes:
+        buffer.add_mesh(m)
+    buffer.update()
+    for m in meshes[::2]:
+        buffer.remove_mesh(m)
+
+    kept = meshes[1::2]
+    offsets = []
+    while True:
+        moved = buffer.update()
+        offsets.append([m.gpu_data.vert_offset for m in kept])
+        if not moved:
+            break
+    # One mesh of four vertices moves per update
+    assert offsets == [[0, 12, 20], [0, 4, 20], [0, 4, 8], [0, 4, 8]]
+    assert [buffer.ranges[m][0] for m in kept] == [0, 4, 8]
+    assert buffer.vertices.fragmentation() == 0.0